@@ -1,9 +1,9 @@
 import streamlit as st
 import os
 from utils.save_docs import save_docs_to_vectordb
-from utils.session_state import initialize_session_state_variables
-from utils.prepare_vectordb import get_vectorstore
-from utils.chatbot import chat
+from utils.corpora import create_corpus, list_corpora
+from utils.session_state import initialize_session_state_variables, select_corpus
+from utils.prepare_vectordb import open_vectorstore, poll_ingest_status, show_ingest_status
 
 class ChatApp:
     """
@@ -18,19 +18,31 @@ class ChatApp:
         """
         Initializes the ChatApp class
 
-        This method ensures the existence of the 'docs' folder, sets Streamlit page configurations,
-        and initializes session state variables
+        This method sets Streamlit page configurations, initializes session state variables
+        and ensures the existence of the docs folder of the selected corpus
         """
-        # Ensure the docs folder exists
-        if not os.path.exists("docs"):
-            os.makedirs("docs")
-
         # Configurations and session state initialization
         st.set_page_config(page_title="AI Search")
         st.title("AI Search")
         initialize_session_state_variables(st)
+        self.corpus = st.session_state.corpus
+        # Ensure the docs folder exists
+        os.makedirs(self.corpus.docs_path, exist_ok=True)
         self.docs_files = st.session_state.processed_documents
 
+    def create_corpus(self):
+        """
+        Create the corpus named in the 'New corpus' form and switch the session to it
+        """
+        name = st.session_state.get("new_corpus_name", "").strip()
+        if not name:
+            return
+        try:
+            create_corpus(name)
+            select_corpus(st, name)
+        except ValueError as e:
+            st.session_state.corpus_error = str(e)
+
     def run(self):
         """
         Runs the Streamlit app for chatting with PDFs
@@ -38,9 +50,26 @@ class ChatApp:
         This method handles the frontend for document upload, unlocks the chat when documents are uploaded,
         and locks the chat until documents are uploaded
         """
-        upload_docs = os.listdir("docs")
-        # Sidebar frontend for document upload
+        corpus = self.corpus
+        upload_docs = corpus.pdfs()
+        # Sidebar frontend for corpus selection and document upload
         with st.sidebar:
+            st.subheader("Corpus")
+            names = list_corpora()
+            if corpus.name not in names:
+                names.append(corpus.name)
+            selected = st.selectbox("Documents to search", names, index=names.index(corpus.name))
+            if selected != corpus.name:
+                # Each corpus has its own documents, vectorstore and conversation
+                select_corpus(st, selected)
+                st.rerun()
+            with st.expander("New corpus"):
+                st.text_input("Name", key="new_corpus_name")
+                # Created in a callback, which runs before the page is rendered again, so the page shows the new corpus right away
+                st.button("Create", key="create_corpus", on_click=self.create_corpus)
+                if "corpus_error" in st.session_state:
+                    st.error(st.session_state.pop("corpus_error"))
+
             st.subheader("Your documents")
             if upload_docs:
                 st.write("Uploaded Documents:")
@@ -48,29 +77,31 @@ class ChatApp:
             else:
                 st.info("No documents uploaded yet.")
             
-            # Show processing status
-            if st.session_state.vectordb is None and upload_docs:
-                st.info("⏳ Processing documents... Check progress below.")
+            # Show processing status (documents are ingested in the background)
+            ingest_status = show_ingest_status(corpus)
+            if ingest_status["active"]:
+                st.info("⏳ Processing documents in the background... You can already chat with the ones that are done.")
             elif st.session_state.vectordb is not None:
                 st.success("✅ Documents ready! You can chat now.")
             
             st.subheader("Upload PDF documents")
             pdf_docs = st.file_uploader("Select a PDF document and click on 'Process'", type=['pdf'], accept_multiple_files=True)
             if pdf_docs:
-                save_docs_to_vectordb(pdf_docs, upload_docs)
+                save_docs_to_vectordb(pdf_docs, upload_docs, corpus)
 
         # Unlocks the chat when document is uploaded
         if self.docs_files or st.session_state.uploaded_pdfs:
-            # Check to see if a new document was uploaded to update the vectordb variable in the session state
+            # Check to see if a new document was uploaded (e.g. by another session) to queue it if needed
             if len(upload_docs) > st.session_state.previous_upload_docs_length:
-                st.session_state.vectordb = get_vectorstore(upload_docs, from_session_state=True)
+                st.session_state.vectordb = open_vectorstore(upload_docs, corpus)
                 st.session_state.previous_upload_docs_length = len(upload_docs)
-            # Ensure vectordb is loaded (auto-process if needed)
+            # Ensure vectordb is loaded (documents that need it are processed in the background)
             if st.session_state.vectordb is None and upload_docs:
-                with st.spinner("🔄 Processing documents... This may take a few minutes on first run."):
-                    st.session_state.vectordb = get_vectorstore(upload_docs, from_session_state=False)
+                st.session_state.vectordb = open_vectorstore(upload_docs, corpus)
             if st.session_state.vectordb is not None:
-                st.session_state.chat_history = chat(st.session_state.chat_history, st.session_state.vectordb)
+                # Imported on first use, so the page renders before LangChain is loaded
+                from utils.chatbot import chat
+                st.session_state.chat_history = chat(st.session_state.chat_history, st.session_state.vectordb, st.session_state.history_manager, db_path=corpus.db_path)
             else:
                 # Show status if processing failed
                 st.info("⏳ Waiting for documents to be processed... Check the sidebar for progress.")
@@ -79,6 +110,9 @@ class ChatApp:
         if not self.docs_files and not st.session_state.uploaded_pdfs:
             st.info("Upload a pdf file to chat with it. You can keep uploading files to chat with, and if you need to leave, you won't need to upload these files again")
 
+        # Keeps the processing status up to date while documents are ingested in the background
+        poll_ingest_status(ingest_status)
+
 if __name__ == "__main__":
     app = ChatApp()
     app.run()
\ No newline at end of file
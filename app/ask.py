@@ -0,0 +1,78 @@
+"""
+Command-line batch question answering, without Streamlit.
+
+Examples (from the project root):
+    python app/ask.py questions.txt -o answers.jsonl
+    python app/ask.py regression.jsonl --corpus support --concurrency 8 -o answers.jsonl
+
+The input has one question per line, or one JSON object per line with a "question" field (its other fields,
+e.g. an id or the expected answer, are copied to the output). Each output line is a JSON object with the
+answer, its sources and the timings of each stage (see utils/batch_qa.py). Identical questions are answered
+once, and the chat calls stay under CHAT_RPM requests per minute.
+"""
+import argparse
+import json
+import os
+import sys
+from utils import config
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Answer a file of questions from the vector DB, without the web app")
+    parser.add_argument("questions", help="Text file with one question per line, or JSONL file with a 'question' field ('-' for stdin)")
+    parser.add_argument("-o", "--output", default="-", help="JSONL file the results are written to (default: stdout)")
+    parser.add_argument("--corpus", default=None, help="Corpus the questions are asked to (default: CORPUS from the config, i.e. '%s')" % config.CORPUS)
+    parser.add_argument("--db", default=None, help="Vector DB folder (default: the one of the corpus)")
+    parser.add_argument("--concurrency", type=int, default=config.BATCH_QA_CONCURRENCY, help="Questions answered at the same time (default: %(default)s)")
+    parser.add_argument("--quiet", action="store_true", help="Only print the summary")
+    args = parser.parse_args(argv)
+    # Imported here rather than at the top, so that --help does not wait for LangChain and Chroma
+    from utils.batch_qa import answer_questions, read_questions
+    from utils.corpora import Corpus
+    from utils.ingest_pipeline import create_embedding, open_vectordb
+
+    try:
+        db_path = args.db or Corpus(args.corpus).db_path
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    if not os.path.isdir(db_path):
+        print(f"No vector DB in '{db_path}': ingest the documents first (python app/ingest.py)", file=sys.stderr)
+        return 2
+    if args.questions == "-":
+        records = read_questions(sys.stdin)
+    else:
+        with open(args.questions, encoding="utf-8") as file:
+            records = read_questions(file)
+    if not records:
+        print(f"No questions found in {args.questions}", file=sys.stderr)
+        return 1
+
+    output = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    written = 0
+
+    def write(result):
+        nonlocal written
+        output.write(json.dumps(result, ensure_ascii=False) + "\n")
+        output.flush()
+        written += 1
+        if not args.quiet and output is not sys.stdout:
+            status = "FAILED " if result["error"] else "ok     "
+            print(f"[{written}/{len(records)}] {status} {result['id']} ({result['timings']['total_ms']:.0f} ms)", file=sys.stderr, flush=True)
+
+    try:
+        vectordb = open_vectordb(create_embedding(), db_path)
+        summary = answer_questions(records, vectordb, db_path=db_path, concurrency=args.concurrency, on_result=write)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    print(
+        f"Done in {summary['elapsed_s']:.1f}s: {summary['questions']} questions ({summary['distinct']} distinct), "
+        f"{summary['failed']} failed, p50 {summary['p50_ms']} ms, p95 {summary['p95_ms']} ms",
+        file=sys.stderr, flush=True,
+    )
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,319 @@
+"""
+Offline benchmark of ingest throughput and query latency.
+
+Generates synthetic PDF corpora of several sizes and runs every stage with deterministic fake embedding
+and chat models (see utils/fakes.py), so no network or API quota is needed. For each corpus it reports
+pages/s, chunks/s, query latency percentiles and the peak RSS of each stage, and writes everything
+to a JSON file that can be compared with a previous run.
+
+Examples (from the project root):
+    python app/benchmark.py
+    python app/benchmark.py --sizes 20x10,200x20 --queries 200 --output bench.json
+    python app/benchmark.py --compare bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+# Offline stand-ins must be selected before the app modules read the configuration
+os.environ["EMBEDDING_MODEL"] = "fake-embedding"
+os.environ["CHAT_MODEL"] = "fake-chat"
+os.environ["EMBEDDING_CACHE_MAX_ENTRIES"] = "0"
+# Every stage is measured without the caches that would skip its work (the page text cache has its own stage)
+os.environ["PAGE_TEXT_CACHE_MAX_MB"] = "0"
+os.environ["ANSWER_CACHE_MAX_ENTRIES"] = "0"
+
+from utils import config
+
+VOCABULARY = (
+    "pump valve pressure sensor motor controller firmware calibration torque voltage current flow "
+    "temperature seal bearing gasket filter nozzle housing bracket cable connector relay fuse "
+    "install remove replace inspect adjust verify measure tighten clean lubricate reset configure "
+    "warning caution note procedure step figure table section chapter manual maintenance service"
+).split()
+
+
+def write_synthetic_pdf(path, pages):
+    """
+    Write a minimal PDF with one text page per string (no external PDF library needed)
+    """
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>"]
+    kids = " ".join(f"{3 + 2 * i} 0 R" for i in range(len(pages)))
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>".encode())
+    font_id = 3 + 2 * len(pages)
+    for i, text in enumerate(pages):
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {4 + 2 * i} 0 R "
+            f"/Resources << /Font << /F1 {font_id} 0 R >> >> >>".encode()
+        )
+        lines = " ".join(f"({line}) '" for line in text.split("\n"))
+        stream = f"BT /F1 9 Tf 40 760 Td 11 TL {lines} ET".encode()
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    data = b"%PDF-1.4\n"
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(data))
+        data += b"%d 0 obj\n" % number + obj + b"\nendobj\n"
+    xref = len(data)
+    data += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    data += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    data += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def generate_corpus(folder, files, pages, seed=0, lines_per_page=60, words_per_line=12):
+    """
+    Generate `files` PDFs of `pages` pages of pseudo-random technical text (deterministic for a seed)
+
+    Returns:
+    - list: Names of the generated files
+    """
+    rng = random.Random(seed)
+    names = []
+    for f in range(files):
+        page_texts = []
+        for p in range(pages):
+            lines = [" ".join(rng.choice(VOCABULARY) for _ in range(words_per_line)) for _ in range(lines_per_page)]
+            # Identifiers the keyword index should find
+            lines[rng.randrange(lines_per_page)] += f" code ERR-{f:03d}{p:03d}"
+            page_texts.append("\n".join(lines))
+        name = f"synthetic_{f:05d}.pdf"
+        write_synthetic_pdf(os.path.join(folder, name), page_texts)
+        names.append(name)
+    return names
+
+
+def current_rss():
+    """
+    Resident memory of this process in bytes (Linux), or the peak so far elsewhere
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Stage:
+    """
+    Times a stage and samples its peak RSS from a background thread
+    """
+    def __init__(self, results, name, interval=0.01):
+        self.results = results
+        self.name = name
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = current_rss()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self.started
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+        self.results[self.name] = {"seconds": round(self.seconds, 4), "peak_rss_mb": round(self.peak / 2**20, 1)}
+        return False
+
+    def rate(self, key, count):
+        self.results[self.name][key] = round(count / self.seconds, 1) if self.seconds else None
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def run_corpus(workdir, files, pages, queries, workers, seed):
+    """
+    Benchmark every stage on one synthetic corpus
+
+    Returns:
+    - dict: Metrics by stage
+    """
+    # Imported here rather than at the top: PDF worker processes re-import this module, and they
+    # should not pay for loading LangChain and Chroma
+    from utils.ingest_pipeline import create_embedding, extract_pdf_text, get_text_chunks, open_vectordb, sync_vectorstore
+    from utils.chatbot import get_response, clear_chain_cache
+    from utils.chunking import count_tokens
+    docs_path = os.path.join(workdir, "docs")
+    os.makedirs(docs_path)
+    config.DOCS_PATH = docs_path
+    config.VECTOR_DB_PATH = os.path.join(workdir, "vector_db")
+    config.PDF_EXTRACT_WORKERS = workers
+    results = {"files": files, "pages_per_file": pages}
+
+    pdfs = generate_corpus(docs_path, files, pages, seed=seed)
+
+    with Stage(results, "parse") as stage:
+        docs = extract_pdf_text(pdfs)
+    stage.rate("pages_per_s", len(docs))
+    if workers > 1:
+        with Stage(results, "parse_parallel") as stage:
+            docs = extract_pdf_text(pdfs, max_workers=workers)
+        stage.rate("pages_per_s", len(docs))
+        results["parse_parallel"]["workers"] = workers
+
+    # Reading the texts back from the page text cache, as re-chunking or a rebuild does instead of parsing
+    from utils.document_registry import file_content_hash
+    from utils.page_text_cache import PageTextCache
+    text_cache = PageTextCache(os.path.join(workdir, "page_text"), 1 << 40)
+    hashes = {pdf: file_content_hash(os.path.join(docs_path, pdf)) for pdf in pdfs}
+    texts_by_source = {}
+    for doc in docs:
+        texts_by_source.setdefault(doc.metadata["source"], []).append(doc.page_content)
+    for pdf in pdfs:
+        text_cache.put(hashes[pdf], texts_by_source.get(os.path.join(docs_path, pdf), []))
+    with Stage(results, "parse_cached") as stage:
+        cached_pages = 0
+        for pdf in pdfs:
+            with text_cache.get(hashes[pdf]) as cached:
+                cached_pages += len(list(cached))
+    stage.rate("pages_per_s", cached_pages)
+    text_bytes = sum(len(text.encode("utf-8")) for texts in texts_by_source.values() for text in texts)
+    cache_bytes = sum(os.path.getsize(text_cache.path(content_hash)) for content_hash in hashes.values())
+    results["parse_cached"]["compression_ratio"] = round(text_bytes / cache_bytes, 2) if cache_bytes else None
+
+    with Stage(results, "chunk") as stage:
+        chunks = get_text_chunks(docs)
+    stage.rate("chunks_per_s", len(chunks))
+    results["chunk"]["chunks"] = len(chunks)
+
+    embedding = create_embedding()
+    texts = [chunk.page_content for chunk in chunks]
+    with Stage(results, "embed") as stage:
+        vectors = embedding.embed_documents(texts)
+    stage.rate("chunks_per_s", len(texts))
+
+    # Upsert of precomputed vectors, to measure the vector store alone
+    vectordb = open_vectordb(embedding)
+    ids = [f"bench-{i}" for i in range(len(chunks))]
+    with Stage(results, "upsert") as stage:
+        for start in range(0, len(chunks), config.UPSERT_BATCH_SIZE):
+            end = start + config.UPSERT_BATCH_SIZE
+            metadatas = [chunk.metadata for chunk in chunks[start:end]]
+            if config.VECTOR_BACKEND == "numpy":
+                vectordb.upsert_vectors(ids[start:end], vectors[start:end], texts[start:end], metadatas)
+            else:
+                vectordb._collection.upsert(ids=ids[start:end], embeddings=vectors[start:end], documents=texts[start:end], metadatas=metadatas)
+    stage.rate("chunks_per_s", len(chunks))
+    vectordb.delete(ids=ids)
+
+    # Full pipeline, as the app and the ingest CLI run it
+    with Stage(results, "ingest_pipeline") as stage:
+        sync_vectorstore(vectordb, pdfs)
+    stage.rate("pages_per_s", len(docs))
+    stage.rate("chunks_per_s", len(chunks))
+
+    rng = random.Random(seed + 1)
+    questions = [
+        " ".join(rng.choice(VOCABULARY) for _ in range(6)) if i % 2 else f"What does code ERR-{rng.randrange(files):03d}{rng.randrange(pages):03d} mean?"
+        for i in range(queries)
+    ]
+    clear_chain_cache()
+    latencies = []
+    context_tokens = []
+    with Stage(results, "query") as stage:
+        for question in questions:
+            started = time.perf_counter()
+            _, context = get_response(question, [], vectordb)
+            latencies.append((time.perf_counter() - started) * 1000)
+            context_tokens.append(sum(count_tokens(doc.page_content) for doc in context))
+    results["query"].update({
+        "queries": len(latencies),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        # Estimated LLM input tokens of the retrieved context, per question
+        "context_tokens_mean": round(sum(context_tokens) / len(context_tokens), 1) if context_tokens else None,
+    })
+    return results
+
+
+def compare(current, previous):
+    """
+    Print the change of every rate and latency against a previous run
+    """
+    print("\nComparison with previous run (ratio current/previous):")
+    for corpus, stages in current["corpora"].items():
+        before = previous.get("corpora", {}).get(corpus)
+        if not before:
+            continue
+        for stage, metrics in stages.items():
+            if not isinstance(metrics, dict) or stage not in before:
+                continue
+            for key, value in metrics.items():
+                old = before[stage].get(key)
+                if (key.endswith("_per_s") or key.endswith("_ms")) and value and old:
+                    print(f"  {corpus:>10} {stage:<16} {key:<14} {old:>10} -> {value:>10} ({value / old:.2f}x)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline ingest and query benchmark")
+    parser.add_argument("--sizes", default="10x5,50x10,200x20", help="Corpora as FILESxPAGES, comma separated (default: %(default)s)")
+    parser.add_argument("--queries", type=int, default=50, help="Questions per corpus (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=config.PDF_EXTRACT_WORKERS, help="PDF parsing processes (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backend", choices=["chroma", "numpy"], default=config.VECTOR_BACKEND, help="Vector store backend (default: %(default)s)")
+    parser.add_argument("--output", default=None, help="JSON results file (default: benchmark-<timestamp>.json)")
+    parser.add_argument("--compare", default=None, help="Previous JSON results to compare with")
+    args = parser.parse_args(argv)
+    config.VECTOR_BACKEND = args.backend
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "settings": {**config.ingest_params(), "upsert_batch_size": config.UPSERT_BATCH_SIZE, "workers": args.workers, "backend": args.backend,
+                     "context_compression": config.CONTEXT_COMPRESSION, "context_token_budget": config.CONTEXT_TOKEN_BUDGET},
+        "corpora": {},
+    }
+    for size in args.sizes.split(","):
+        files, pages = (int(n) for n in size.lower().split("x"))
+        workdir = tempfile.mkdtemp(prefix="aiforsm-bench-")
+        try:
+            print(f"Corpus {files} files x {pages} pages...", flush=True)
+            results = run_corpus(workdir, files, pages, args.queries, args.workers, args.seed)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        report["corpora"][size] = results
+        for stage, metrics in results.items():
+            if isinstance(metrics, dict):
+                print(f"  {stage:<16} " + ", ".join(f"{k}={v}" for k, v in metrics.items()), flush=True)
+
+    output = args.output or f"benchmark-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(report, json.load(f))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
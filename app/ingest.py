@@ -0,0 +1,106 @@
+"""
+Command-line ingestion, without Streamlit.
+
+Examples (from the project root):
+    python app/ingest.py docs/
+    python app/ingest.py "manuals/**/*.pdf" --db "Vector_DB - Documents" --workers 16
+    python app/ingest.py --corpus support        # the PDFs of the 'support' corpus folder
+
+Files are streamed through extract → chunk → embed → upsert in bounded batches, and only new or changed
+files are embedded (see utils/ingest_pipeline.py). The vector DB can be used by the app afterwards.
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from utils import config
+
+
+class ConsoleProgress:
+    """
+    Prints one line per file to stdout (an IngestProgress, see utils/ingest_pipeline.py)
+    """
+    def __init__(self, quiet=False):
+        self.quiet = quiet
+        self.done = 0
+        self.chunks = 0
+        self.started = time.time()
+
+    def update(self, fraction, message):
+        pass
+
+    def file_done(self, pdf, chunk_count):
+        self.done += 1
+        self.chunks += chunk_count
+        if not self.quiet:
+            print(f"[{time.time() - self.started:7.1f}s] ok      {pdf} ({chunk_count} chunks)", flush=True)
+
+    def file_failed(self, pdf, error):
+        print(f"[{time.time() - self.started:7.1f}s] FAILED  {pdf}: {error}", file=sys.stderr, flush=True)
+
+
+def resolve_pdfs(target):
+    """
+    Find the PDF files of a directory or a glob pattern
+
+    Parameters:
+    - target (str): Directory (searched recursively) or glob pattern
+
+    Returns:
+    - tuple: (docs_path, pdfs) with the base folder and the file names relative to it
+    """
+    if os.path.isdir(target):
+        docs_path = target
+        paths = glob.glob(os.path.join(target, "**", "*.pdf"), recursive=True)
+    else:
+        paths = glob.glob(target, recursive=True)
+        docs_path = os.path.commonpath([os.path.dirname(os.path.abspath(p)) for p in paths]) if paths else "."
+    paths = [p for p in paths if os.path.isfile(p) and p.lower().endswith(".pdf")]
+    return docs_path, sorted(os.path.relpath(os.path.abspath(p), os.path.abspath(docs_path)) for p in paths)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ingest PDF files into the vector DB without the web app")
+    parser.add_argument("target", nargs="?", default=None, help="Directory or glob pattern of PDF files (default: the docs folder of the corpus)")
+    parser.add_argument("--corpus", default=None, help="Corpus the files are ingested into (default: CORPUS from the config, i.e. '%s')" % config.CORPUS)
+    parser.add_argument("--db", default=None, help="Vector DB folder (default: the one of the corpus)")
+    parser.add_argument("--workers", type=int, default=config.PDF_EXTRACT_WORKERS, help="PDF parsing processes (default: %(default)s)")
+    parser.add_argument("--batch-size", type=int, default=config.UPSERT_BATCH_SIZE, help="Chunks embedded and written per batch (default: %(default)s)")
+    parser.add_argument("--quiet", action="store_true", help="Only print failures and the summary")
+    args = parser.parse_args(argv)
+    # Imported here rather than at the top: PDF worker processes re-import this module, and they
+    # should not pay for loading LangChain and Chroma
+    from utils.ingest_pipeline import create_embedding, open_vectordb, sync_vectorstore
+    from utils.corpora import create_corpus
+
+    try:
+        corpus = create_corpus(args.corpus)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    db_path = args.db or corpus.db_path
+    config.PDF_EXTRACT_WORKERS = args.workers
+    config.UPSERT_BATCH_SIZE = args.batch_size
+
+    target = args.target or corpus.docs_path
+    docs_path, pdfs = resolve_pdfs(target)
+    if not pdfs:
+        print(f"No PDF files found in {target}", file=sys.stderr)
+        return 1
+    print(f"Ingesting {len(pdfs)} PDF file(s) from {docs_path} into '{db_path}' (corpus '{corpus.name}')", flush=True)
+
+    progress = ConsoleProgress(quiet=args.quiet)
+    vectordb = open_vectordb(create_embedding(), db_path)
+    plan = sync_vectorstore(vectordb, pdfs, progress=progress, docs_path=docs_path, db_path=db_path)
+    elapsed = time.time() - progress.started
+    print(
+        f"Done in {elapsed:.1f}s: {progress.done} ingested ({progress.chunks} chunks), "
+        f"{len(plan['unchanged'])} unchanged, {len(plan['removed'])} removed, {len(plan['failed'])} failed",
+        flush=True,
+    )
+    return 1 if plan["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
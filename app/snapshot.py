@@ -0,0 +1,75 @@
+"""
+Command-line export and import of index snapshots, to start new nodes without ingesting the documents again.
+
+Examples (from the project root):
+    python app/snapshot.py export support.snap --corpus support     # on a node where the corpus is ingested
+    python app/snapshot.py import support.snap --corpus support     # on a new node, before starting the app
+
+A snapshot is one file with the vectors, chunk texts and metadata, document registry and BM25 index of a
+corpus (see utils/index_snapshot.py). Import loads it into an empty vector DB folder with the configured
+backend, without embedding calls. Copy the PDFs of the corpus to its docs folder as well (or share the
+folder): the documents of the snapshot that are missing there are removed by the next sync.
+"""
+import argparse
+import os
+import sys
+from utils import config
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export or import a snapshot of the vector DB of a corpus")
+    parser.add_argument("command", choices=["export", "import"], help="'export' writes the snapshot file, 'import' loads it")
+    parser.add_argument("file", help="Snapshot file")
+    parser.add_argument("--corpus", default=None, help="Corpus exported or imported (default: CORPUS from the config, i.e. '%s')" % config.CORPUS)
+    parser.add_argument("--db", default=None, help="Vector DB folder (default: the one of the corpus)")
+    parser.add_argument("--no-verify", action="store_true", help="Import without checking the checksums of the file first")
+    parser.add_argument("--quiet", action="store_true", help="Only print the summary")
+    args = parser.parse_args(argv)
+    # Imported here rather than at the top, so that --help does not wait for LangChain and Chroma
+    from utils.corpora import create_corpus
+    from utils.index_snapshot import SnapshotError, export_snapshot, import_snapshot
+    from utils.ingest_pipeline import create_embedding, open_vectordb
+
+    try:
+        corpus = create_corpus(args.corpus)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    db_path = args.db or corpus.db_path
+
+    def progress(fraction, message):
+        if not args.quiet:
+            print(f"[{fraction * 100:5.1f}%] {message}", file=sys.stderr, flush=True)
+
+    try:
+        if args.command == "export":
+            if not os.path.isdir(db_path):
+                print(f"No vector DB in '{db_path}': ingest the documents first (python app/ingest.py)", file=sys.stderr)
+                return 2
+            vectordb = open_vectordb(create_embedding(), db_path)
+            summary = export_snapshot(vectordb, args.file, db_path=db_path, progress=progress)
+            print(
+                f"Exported {summary['documents']} documents ({summary['chunks']} chunks, dimension {summary['dim']}) "
+                f"to {args.file} in {summary['seconds']:.1f}s ({summary['bytes'] / 1024 / 1024:.1f} MB)",
+                flush=True,
+            )
+        else:
+            vectordb = open_vectordb(create_embedding(), db_path)
+            summary = import_snapshot(args.file, vectordb, db_path=db_path, docs_path=corpus.docs_path,
+                                      verify=not args.no_verify, progress=progress)
+            print(
+                f"Imported {summary['documents']} documents ({summary['chunks']} chunks) into '{db_path}' "
+                f"in {summary['seconds']:.1f}s" + (" (BM25 index rebuilt)" if summary["bm25_rebuilt"] else ""),
+                flush=True,
+            )
+            if not summary["params_match"]:
+                print("Warning: the snapshot was ingested with other chunking settings than the config: "
+                      "the next sync will ingest its documents again", file=sys.stderr, flush=True)
+    except (SnapshotError, OSError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,290 @@
+"""
+Offline recall/latency harness for the HNSW settings of the vector index (see VECTOR_METRIC and HNSW_* in the config).
+
+The stored embeddings of a corpus (or synthetic clustered vectors of a given size) are split into queries and an
+indexed set. A temporary Chroma collection is built for every metric, M and ef_construction combination, then
+queried at every ef_search and k. Each result is compared with an exact brute-force search over the same vectors:
+the report gives recall@k against p50/p95 query latency, build time and index size on disk, and for each k the
+fastest setting that reaches the target recall. The corpus itself is only read, and no embedding call is made.
+
+Examples (from the project root):
+    python app/tune_index.py --corpus support
+    python app/tune_index.py --synthetic 200000x768 --m 16,32 --ef-search 20,50,100,200 --output tune.json
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+from utils import config
+
+# Queries run before measuring each setting (loads the index in memory)
+WARMUP_QUERIES = 10
+# Rows scored at a time by the exact search (bounds the size of the score matrix)
+EXACT_BLOCK_ROWS = 8192
+PAGE_SIZE = 5000
+
+
+def parse_list(text, cast=int):
+    return [cast(item) for item in text.split(",") if item.strip()]
+
+
+def load_vectors(db_path, max_chunks=0, seed=0):
+    """
+    Read the stored embeddings of a vector DB folder (chroma or numpy backend, as configured)
+
+    Parameters:
+    - db_path (str): Vector DB folder
+    - max_chunks (int, optional): Random sample of at most this many vectors (0: all). Defaults to 0
+    - seed (int, optional): Seed of the sample
+
+    Returns:
+    - np.ndarray: float32 matrix, one row per chunk
+    """
+    if config.VECTOR_BACKEND == "numpy":
+        from utils.numpy_vectorstore import NumpyVectorStore
+        store = NumpyVectorStore(os.path.join(db_path, "vectors"), None)
+        total = store.count()
+        read = lambda offset: store.get(limit=PAGE_SIZE, offset=offset, include=["embeddings"])["embeddings"]
+    else:
+        import chromadb
+        from langchain_community.vectorstores import Chroma
+        # Read straight from the collection: opening it through the app would also apply this node's HNSW_EF_SEARCH to it
+        collection = chromadb.PersistentClient(path=db_path).get_collection(Chroma._LANGCHAIN_DEFAULT_COLLECTION_NAME)
+        total = collection.count()
+        read = lambda offset: collection.get(limit=PAGE_SIZE, offset=offset, include=["embeddings"])["embeddings"]
+    pages = [np.asarray(read(offset), dtype=np.float32) for offset in range(0, total, PAGE_SIZE)]
+    vectors = np.concatenate(pages) if pages else np.zeros((0, 0), dtype=np.float32)
+    if max_chunks and len(vectors) > max_chunks:
+        vectors = vectors[np.sort(np.random.default_rng(seed).choice(len(vectors), max_chunks, replace=False))]
+    return vectors
+
+
+def synthetic_vectors(count, dim, seed=0, clusters=256):
+    """
+    Unit vectors scattered around random cluster centers, a rough stand-in for the embeddings of a document corpus
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim), dtype=np.float32)
+    vectors = centers[rng.integers(0, clusters, count)] + 0.6 * rng.standard_normal((count, dim), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def _scores(base, queries, metric, base_norms=None):
+    # Higher is closer, consistently with the distance of the metric
+    if metric == "l2":
+        return 2 * queries @ base.T - base_norms[None, :]
+    if metric == "cosine":
+        return (queries / np.linalg.norm(queries, axis=1, keepdims=True)) @ (base / base_norms[:, None]).T
+    return queries @ base.T
+
+
+def exact_neighbors(base, queries, k, metric):
+    """
+    Exact top-k rows of `base` for each query, by blocks of EXACT_BLOCK_ROWS rows
+
+    Returns:
+    - np.ndarray: (queries, k) row indices, closest first
+    """
+    best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+    best_scores = np.zeros((len(queries), 0), dtype=np.float32)
+    for start in range(0, len(base), EXACT_BLOCK_ROWS):
+        block = base[start:start + EXACT_BLOCK_ROWS]
+        norms = (block ** 2).sum(axis=1) if metric == "l2" else np.linalg.norm(block, axis=1)
+        scores = np.concatenate([best_scores, _scores(block, queries, metric, norms)], axis=1)
+        rows = np.concatenate([best_rows, np.broadcast_to(np.arange(start, start + len(block)), (len(queries), len(block)))], axis=1)
+        keep = np.argpartition(-scores, min(k, scores.shape[1]) - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(scores, keep, axis=1)
+        best_rows = np.take_along_axis(rows, keep, axis=1)
+    order = np.argsort(-best_scores, axis=1, kind="stable")
+    return np.take_along_axis(best_rows, order, axis=1)
+
+
+def exact_latencies(base, queries, k, metric):
+    """
+    Latency (ms) of an exact scan per query, the reference the ANN settings are compared with
+    """
+    norms = (base ** 2).sum(axis=1) if metric == "l2" else np.linalg.norm(base, axis=1)
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        scores = _scores(base, query[None, :], metric, norms)[0]
+        np.argpartition(-scores, min(k, len(scores)) - 1)[:k]
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+
+def build_collection(client, vectors, metric, m, ef_construction, ef_search):
+    """
+    Build a Chroma collection of the vectors with the given HNSW settings
+
+    Returns:
+    - tuple: The collection and the build time in seconds
+    """
+    from utils.ingest_pipeline import hnsw_metadata
+    collection = client.create_collection("tune-index", metadata=hnsw_metadata(metric, m, ef_construction, ef_search))
+    batch_size = client.get_max_batch_size() if hasattr(client, "get_max_batch_size") else 5000
+    started = time.perf_counter()
+    for start in range(0, len(vectors), batch_size):
+        batch = vectors[start:start + batch_size]
+        collection.add(ids=[str(row) for row in range(start, start + len(batch))], embeddings=batch)
+    return collection, time.perf_counter() - started
+
+
+def reopen_collection(path, name):
+    """
+    Open a collection again with a new client, so a changed ef_search is used: a process keeps the index it loaded
+    with the settings it had then
+    """
+    import chromadb
+    from chromadb.api.client import SharedSystemClient
+    SharedSystemClient.clear_system_cache()
+    return chromadb.PersistentClient(path=path).get_collection(name)
+
+
+def evaluate(collection, queries, truth, k):
+    """
+    Query the collection and compare with the exact neighbors
+
+    Returns:
+    - tuple: Mean recall@k and the latency (ms) of each query
+    """
+    for query in queries[:WARMUP_QUERIES]:
+        collection.query(query_embeddings=[query.tolist()], n_results=k, include=[])
+    recalls = []
+    latencies = []
+    for query, expected in zip(queries, truth):
+        started = time.perf_counter()
+        found = collection.query(query_embeddings=[query.tolist()], n_results=k, include=[])["ids"][0]
+        latencies.append((time.perf_counter() - started) * 1000)
+        recalls.append(len({int(row) for row in found} & set(expected[:k].tolist())) / k)
+    return float(np.mean(recalls)), latencies
+
+
+def folder_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure recall@k against query latency of HNSW index settings")
+    parser.add_argument("--corpus", default=None, help="Corpus whose stored embeddings are used (default: CORPUS from the config, i.e. '%s')" % config.CORPUS)
+    parser.add_argument("--db", default=None, help="Vector DB folder (default: the one of the corpus)")
+    parser.add_argument("--synthetic", default=None, help="Use COUNTxDIM synthetic vectors instead of a corpus (e.g. 200000x768)")
+    parser.add_argument("--max-chunks", type=int, default=0, help="Random sample of the stored vectors (default: all)")
+    parser.add_argument("--queries", type=int, default=200, help="Vectors held out of the index and used as queries (default: %(default)s)")
+    parser.add_argument("--metric", default=config.VECTOR_METRIC, help="Metrics, comma separated: l2, cosine, ip (default: %(default)s)")
+    parser.add_argument("--m", default="8,16,32", help="HNSW M values (default: %(default)s)")
+    parser.add_argument("--ef-construction", default="100,200", help="HNSW ef_construction values (default: %(default)s)")
+    parser.add_argument("--ef-search", default="10,20,50,100,200", help="HNSW ef_search values (default: %(default)s)")
+    parser.add_argument("--k", default=f"{config.RETRIEVAL_K},{config.RETRIEVAL_FETCH_K}", help="Results per query (default: RETRIEVAL_K,RETRIEVAL_FETCH_K, i.e. %(default)s)")
+    parser.add_argument("--target-recall", type=float, default=0.95, help="Recall the recommended settings must reach (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="JSON results file (default: tune-index-<timestamp>.json)")
+    args = parser.parse_args(argv)
+    # Imported here rather than at the top, so that --help does not wait for Chroma
+    import chromadb
+    from utils.batch_qa import percentile
+    from utils.corpora import Corpus
+    from utils.ingest_pipeline import HNSW_METRICS, set_ef_search
+
+    metrics_list = parse_list(args.metric, str)
+    if set(metrics_list) - set(HNSW_METRICS):
+        print(f"Unsupported metric in {args.metric!r}, expected {', '.join(HNSW_METRICS)}", file=sys.stderr)
+        return 2
+    if args.synthetic:
+        count, dim = (int(n) for n in args.synthetic.lower().split("x"))
+        vectors = synthetic_vectors(count, dim, args.seed)
+        source = f"synthetic {count}x{dim}"
+    else:
+        try:
+            db_path = args.db or Corpus(args.corpus).db_path
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 2
+        if not os.path.isdir(db_path):
+            print(f"No vector DB in '{db_path}': ingest the documents first (python app/ingest.py)", file=sys.stderr)
+            return 2
+        vectors = load_vectors(db_path, args.max_chunks, args.seed)
+        source = db_path
+    if len(vectors) <= args.queries:
+        print(f"Only {len(vectors)} vectors in {source}: not enough for {args.queries} queries", file=sys.stderr)
+        return 1
+    # Queries are held out of the index, like the questions of the users
+    held_out = np.random.default_rng(args.seed).choice(len(vectors), args.queries, replace=False)
+    queries = vectors[held_out]
+    base = np.delete(vectors, held_out, axis=0)
+    k_values = parse_list(args.k)
+    print(f"{len(base)} vectors of dimension {base.shape[1]} from {source}, {len(queries)} queries", flush=True)
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "source": source,
+        "vectors": int(len(base)),
+        "dim": int(base.shape[1]),
+        "queries": int(len(queries)),
+        "chromadb": chromadb.__version__,
+        "results": [],
+    }
+    print(f"{'metric':<7} {'M':>4} {'ef_c':>5} {'ef_s':>5} {'k':>4} {'recall':>7} {'p50 ms':>8} {'p95 ms':>8} {'build s':>8} {'disk MB':>8}", flush=True)
+
+    def add(result):
+        report["results"].append(result)
+        print(f"{result['metric']:<7} {result['m'] or '-':>4} {result['ef_construction'] or '-':>5} {result['ef_search'] or '-':>5} {result['k']:>4} "
+              f"{result['recall']:>7.3f} {result['p50_ms']:>8} {result['p95_ms']:>8} {result['build_s'] if result['build_s'] is not None else '-':>8} "
+              f"{result['disk_mb'] if result['disk_mb'] is not None else '-':>8}", flush=True)
+
+    for metric in metrics_list:
+        truth = exact_neighbors(base, queries, max(k_values), metric)
+        for k in k_values:
+            latencies = exact_latencies(base, queries, k, metric)
+            add({"metric": metric, "m": None, "ef_construction": None, "ef_search": None, "k": k, "recall": 1.0, "exact": True,
+                 "p50_ms": round(percentile(latencies, 50), 3), "p95_ms": round(percentile(latencies, 95), 3), "build_s": None, "disk_mb": None})
+        for m in parse_list(args.m):
+            for ef_construction in parse_list(args.ef_construction):
+                workdir = tempfile.mkdtemp(prefix="aiforsm-tune-")
+                try:
+                    client = chromadb.PersistentClient(path=workdir)
+                    ef_values = parse_list(args.ef_search)
+                    collection, build_s = build_collection(client, base, metric, m, ef_construction, ef_values[0])
+                    disk_mb = round(folder_size(workdir) / 1024 / 1024, 1)
+                    for ef_search in ef_values:
+                        if ef_search != ef_values[0]:
+                            if set_ef_search(collection, ef_search):
+                                collection = reopen_collection(workdir, collection.name)
+                            else:
+                                # Chroma before 1.0 only takes ef_search at creation
+                                client.delete_collection(collection.name)
+                                collection, build_s = build_collection(client, base, metric, m, ef_construction, ef_search)
+                        # hnswlib explores max(ef_search, k) candidates: a smaller ef_search would only repeat ef_search=k
+                        for k in (k for k in k_values if k <= ef_search):
+                            recall, latencies = evaluate(collection, queries, truth, k)
+                            add({"metric": metric, "m": m, "ef_construction": ef_construction, "ef_search": ef_search, "k": k,
+                                 "recall": round(recall, 4), "exact": False, "p50_ms": round(percentile(latencies, 50), 3),
+                                 "p95_ms": round(percentile(latencies, 95), 3), "build_s": round(build_s, 2), "disk_mb": disk_mb})
+                finally:
+                    shutil.rmtree(workdir, ignore_errors=True)
+
+    # For each k, the setting with the lowest p95 that reaches the target recall
+    report["recommended"] = {}
+    for k in k_values:
+        candidates = [r for r in report["results"] if r["k"] == k and not r["exact"] and r["recall"] >= args.target_recall]
+        if candidates:
+            best = min(candidates, key=lambda r: (r["p95_ms"], r["m"], r["ef_construction"]))
+            report["recommended"][str(k)] = best
+            print(f"k={k}: VECTOR_METRIC={best['metric']} HNSW_M={best['m']} HNSW_EF_CONSTRUCTION={best['ef_construction']} "
+                  f"HNSW_EF_SEARCH={best['ef_search']} reaches recall {best['recall']:.3f} at p95 {best['p95_ms']} ms", flush=True)
+        else:
+            print(f"k={k}: no setting reaches recall {args.target_recall}", flush=True)
+
+    output = args.output or f"tune-index-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
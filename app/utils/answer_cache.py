@@ -0,0 +1,182 @@
+"""
+Semantic answer cache: the answer to a question asked before is reused for the same or a near-identical question.
+
+Entries are grouped by scope (the corpus and every setting the answer depends on) and by version of the corpus
+(see corpus_version: it changes whenever documents are added, changed or removed). A question matches a cached
+one of its scope and version when their embeddings are within a cosine similarity threshold and they name the
+same identifiers (numbers, codes, part numbers): "What is ERR-11?" never gets the answer to "What is ERR-12?",
+however close the two embeddings are. Entries expire after a TTL and the least recently used ones are dropped
+past the size limit; a new version of a corpus drops all the entries of the previous one.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from utils.bm25_index import tokenize
+from utils.document_registry import REGISTRY_FILENAME
+
+
+def corpus_version(db_path):
+    """
+    Version of the documents of a vector DB folder: it changes whenever the document registry is written,
+    i.e. when a document is added, changed or removed, by this process or another one
+
+    Parameters:
+    - db_path (str): Vector DB folder
+
+    Returns:
+    - tuple or None: Modification time and size of the registry (None when nothing was ingested yet)
+    """
+    try:
+        stat = os.stat(os.path.join(db_path, REGISTRY_FILENAME))
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def identifiers(question):
+    """
+    Terms of a question that contain a digit (error codes, part numbers, versions, years...): two questions
+    only share an answer when they name the same ones
+    """
+    return frozenset(term for term in tokenize(question) if any(c.isdigit() for c in term))
+
+
+class CachedAnswer:
+    """
+    An answer kept in the cache, with the documents it was generated from (for its sources)
+    """
+
+    def __init__(self, question, vector, answer, context, created):
+        self.question = question
+        self.vector = vector
+        self.identifiers = identifiers(question)
+        self.answer = answer
+        self.context = context
+        self.created = created
+        self.hits = 0
+
+
+class SemanticAnswerCache:
+    """
+    Thread-safe, in-memory cache of answers looked up by question embedding
+    """
+
+    def __init__(self, max_entries, ttl_seconds, threshold, clock=time.monotonic):
+        """
+        Parameters:
+        - max_entries (int): Most answers kept, all scopes together (least recently used dropped first)
+        - ttl_seconds (float): Age after which an answer is no longer returned (0: no expiry)
+        - threshold (float): Lowest cosine similarity between two questions for them to share an answer
+        - clock (callable, optional): Time source, in seconds. Defaults to time.monotonic
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+        self._clock = clock
+        self._lock = threading.Lock()
+        # (scope, position) -> CachedAnswer, least recently used first
+        self._entries = OrderedDict()
+        # scope -> version of the corpus the entries of the scope were answered on
+        self._versions = {}
+        # scope -> (keys, matrix of their unit vectors), rebuilt after the entries of the scope change
+        self._matrices = {}
+        self._next_position = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    @staticmethod
+    def _unit(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm else vector
+
+    def _drop(self, key):
+        del self._entries[key]
+        self._matrices.pop(key[0], None)
+
+    def _check_version(self, scope, version):
+        # Entries answered on an earlier version of the documents are dropped at once
+        if self._versions.get(scope, version) != version:
+            for key in [key for key in self._entries if key[0] == scope]:
+                self._drop(key)
+        self._versions[scope] = version
+
+    def _matrix(self, scope):
+        if scope not in self._matrices:
+            keys = [key for key in self._entries if key[0] == scope]
+            matrix = np.stack([self._entries[key].vector for key in keys]) if keys else None
+            self._matrices[scope] = (keys, matrix)
+        return self._matrices[scope]
+
+    def lookup(self, scope, version, question, vector):
+        """
+        Find the answer to a near-identical question
+
+        Parameters:
+        - scope (hashable): Corpus and settings the answer must have been generated with
+        - version (hashable): Current version of the corpus (see corpus_version)
+        - question (str): The new question
+        - vector (list): Its embedding
+
+        Returns:
+        - CachedAnswer or None: The most similar cached answer above the threshold, if any
+        """
+        wanted = identifiers(question)
+        now = self._clock()
+        with self._lock:
+            self._check_version(scope, version)
+            keys, matrix = self._matrix(scope)
+            if matrix is None:
+                return None
+            similarities = matrix @ self._unit(vector)
+            for index in np.argsort(-similarities):
+                if similarities[index] < self.threshold:
+                    return None
+                key = keys[index]
+                entry = self._entries.get(key)
+                if entry is None or entry.identifiers != wanted:
+                    continue
+                if self.ttl_seconds and now - entry.created > self.ttl_seconds:
+                    self._drop(key)
+                    continue
+                entry.hits += 1
+                self._entries.move_to_end(key)
+                return entry
+        return None
+
+    def store(self, scope, version, question, vector, answer, context):
+        """
+        Keep an answer
+
+        Parameters:
+        - scope (hashable): Corpus and settings the answer was generated with
+        - version (hashable): Version of the corpus it was generated on (see corpus_version)
+        - question (str): The question
+        - vector (list): Its embedding
+        - answer (str): The answer
+        - context (list): Documents the answer was generated from
+        """
+        if self.max_entries <= 0 or not answer:
+            return
+        entry = CachedAnswer(question, self._unit(vector), answer, list(context), self._clock())
+        with self._lock:
+            # A lookup saw another version meanwhile: the documents changed while this answer was being generated
+            if self._versions.setdefault(scope, version) != version:
+                return
+            self._entries[(scope, self._next_position)] = entry
+            self._next_position += 1
+            self._matrices.pop(scope, None)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self, scope=None):
+        """
+        Drop the answers of a scope (of every scope when None)
+        """
+        with self._lock:
+            for key in [key for key in self._entries if scope is None or key[0] == scope]:
+                self._drop(key)
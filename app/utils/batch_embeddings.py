@@ -1,19 +1,28 @@
 """
 Custom batch embedding wrapper to reduce API calls and stay within free tier limits.
 Uses Gemini's batch embedding capability (100 chunks per API call) instead of individual calls.
+Vectors are also kept in a persistent on-disk cache, so re-ingesting only embeds chunks never seen before.
 """
 import os
-import google.generativeai as genai
+import threading
+from collections import OrderedDict
 from typing import List
+import numpy as np
 from dotenv import load_dotenv
+from utils.embedding_cache import embedding_cache_key, get_embedding_cache
+from utils.embedding_scheduler import EmbeddingScheduler, gemini_embed_batch, get_rate_limiter
+from utils import config
+from utils import metrics
+from utils.fakes import fake_embed_batch, is_fake_model
 
 class BatchGoogleGenerativeAIEmbeddings:
     """
     Custom embedding class that uses batch embedding to reduce API calls.
-    Processes 100 chunks per API call instead of 1 chunk per call.
+    Processes 100 chunks per API call instead of 1 chunk per call, with several calls in flight
+    within the configured quota.
     """
     
-    def __init__(self, model="models/text-embedding-004", google_api_key=None):
+    def __init__(self, model="models/text-embedding-004", google_api_key=None, cache=None, use_cache=True, embed_batch=None):
         # Load API key
         project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
         env_path = os.path.join(project_root, '.env')
@@ -21,16 +30,38 @@ class BatchGoogleGenerativeAIEmbeddings:
         load_dotenv()
         
         self.api_key = google_api_key or os.getenv('GOOGLE_API_KEY')
-        if not self.api_key:
+        if not self.api_key and not is_fake_model(model):
             raise ValueError("GOOGLE_API_KEY not found. Please set it in .env file.")
         
         self.model = model
-        genai.configure(api_key=self.api_key)
+        # Shared on-disk cache of document vectors (None disables caching)
+        self.cache = cache if cache is not None or not use_cache else get_embedding_cache()
+        if self.api_key and not is_fake_model(model):
+            # Imported on first use: the Google SDK is slow to import and not needed before the first embedding
+            import google.generativeai as genai
+            genai.configure(api_key=self.api_key)
+        # Batches go through the scheduler; embed_batch replaces the Gemini backend (e.g. with a local fake)
+        if embed_batch is None and is_fake_model(model):
+            embed_batch = fake_embed_batch
+        self.scheduler = EmbeddingScheduler(
+            embed_batch or gemini_embed_batch(model),
+            # The quota only applies to the real API
+            rate_limiter=None if is_fake_model(model) else get_rate_limiter(),
+            max_concurrency=config.EMBEDDING_CONCURRENCY,
+            max_batch_size=config.EMBEDDING_BATCH_SIZE,
+            max_retries=config.EMBEDDING_MAX_RETRIES,
+        )
+        # In-memory LRU of query vectors: the same question asked again (by any session) costs no API call
+        self._query_cache = OrderedDict()
+        self._query_cache_lock = threading.Lock()
+        self.query_cache_size = config.QUERY_EMBEDDING_CACHE_SIZE
     
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
         """
         Embed multiple texts using batch processing.
-        Processes up to 100 texts per API call to stay within quota limits.
+        Texts already in the embedding cache are served locally; only the rest are sent to the API,
+        up to 100 texts per API call to stay within quota limits. The vectors of each API call are cached
+        as soon as it returns, so an interrupted ingest does not pay again for the calls that succeeded.
         
         Args:
             texts: List of text strings to embed
@@ -40,51 +71,43 @@ class BatchGoogleGenerativeAIEmbeddings:
         """
         if not texts:
             return []
+        if self.cache is None:
+            return self._embed_batches(texts)
         
-        embeddings = []
-        batch_size = 100  # Gemini supports up to 100 texts per batch
+        keys = [embedding_cache_key(self.model, "retrieval_document", text) for text in texts]
+        cached = self.cache.get_many(keys)
         
-        # Process in batches
-        for i in range(0, len(texts), batch_size):
-            batch = texts[i:i + batch_size]
-            
-            try:
-                # Use Gemini's native batch embedding
-                result = genai.embed_content(
-                    model=self.model,
-                    content=batch,  # Pass entire list
-                    task_type="retrieval_document"
-                )
-                
-                # Extract embeddings from batch result
-                if isinstance(result, dict) and 'embedding' in result:
-                    batch_embeddings = result['embedding']
-                    if len(batch_embeddings) == len(batch):
-                        embeddings.extend(batch_embeddings)
-                    else:
-                        raise ValueError(f"Expected {len(batch)} embeddings, got {len(batch_embeddings)}")
-                else:
-                    raise ValueError(f"Unexpected result format: {type(result)}")
-                    
-            except Exception as e:
-                # If batch fails, try individual calls as fallback (slower but more reliable)
-                print(f"Batch embedding failed, falling back to individual calls: {e}")
-                for text in batch:
-                    try:
-                        result = genai.embed_content(
-                            model=self.model,
-                            content=text,
-                            task_type="retrieval_document"
-                        )
-                        if isinstance(result, dict) and 'embedding' in result:
-                            embeddings.append(result['embedding'])
-                        else:
-                            embeddings.append([])
-                    except Exception as individual_error:
-                        print(f"Failed to embed individual text: {individual_error}")
-                        embeddings.append([])
+        # Embed each missing text only once, even if it appears several times in the input
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        if missing:
+            missing_keys = list(missing)
+
+            def store_batch(start, end, vectors):
+                self.cache.put_many(dict(zip(missing_keys[start:end], vectors)))
+
+            new_embeddings = self._embed_batches(list(missing.values()), on_batch=store_batch)
+            cached.update(zip(missing_keys, new_embeddings))
+        
+        return [cached[key] for key in keys]
+    
+    def _embed_batches(self, texts: List[str], on_batch=None) -> List[List[float]]:
+        """
+        Embed texts with the API through the scheduler (concurrent, rate-limited batches of up to 100 texts).
         
-        return embeddings
+        Args:
+            texts: List of text strings to embed
+            on_batch: Called with (start, end, vectors) as each API call succeeds
+            
+        Returns:
+            List of embedding vectors
+            
+        Raises:
+            EmbeddingError: If any text could not be embedded
+        """
+        return self.scheduler.embed(texts, task_type="retrieval_document", on_batch=on_batch)
     
     def embed_query(self, text: str) -> List[float]:
         """
@@ -96,17 +119,57 @@ class BatchGoogleGenerativeAIEmbeddings:
         Returns:
             Embedding vector
         """
+        vector = self._cached_query(text)
+        metrics.count("query_embedding_cache", result="miss" if vector is None else "hit")
+        if vector is not None:
+            return vector
         try:
-            result = genai.embed_content(
-                model=self.model,
-                content=text,
-                task_type="retrieval_query"
-            )
-            
-            if isinstance(result, dict) and 'embedding' in result:
-                return result['embedding']
-            else:
-                raise ValueError(f"Unexpected result format: {type(result)}")
+            vector = self.scheduler.embed([text], task_type="retrieval_query")[0]
         except Exception as e:
             raise Exception(f"Error embedding query: {e}")
+        self._cache_queries({text: vector})
+        return vector
+
+    def _cached_query(self, text):
+        with self._query_cache_lock:
+            vector = self._query_cache.get(text)
+            if vector is None:
+                return None
+            self._query_cache.move_to_end(text)
+        return vector.tolist()
+
+    def _cache_queries(self, vectors):
+        if self.query_cache_size <= 0:
+            return
+        with self._query_cache_lock:
+            for text, vector in vectors.items():
+                # float32 arrays take a tenth of the memory of lists of Python floats
+                self._query_cache[text] = np.asarray(vector, dtype=np.float32)
+                self._query_cache.move_to_end(text)
+            while len(self._query_cache) > max(0, self.query_cache_size):
+                self._query_cache.popitem(last=False)
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed many query texts at once, up to 100 per API call instead of one call per query.
+        The vectors go to the query LRU, so the embed_query() calls the vector store makes for these texts
+        afterwards (e.g. a batch of questions answered one by one) are served without an API call.
+        
+        Args:
+            texts: Query texts to embed
+            
+        Returns:
+            List of embedding vectors
+        """
+        known = {}
+        for text in texts:
+            vector = self._cached_query(text)
+            if vector is not None:
+                known[text] = vector
+        missing = list(dict.fromkeys(text for text in texts if text not in known))
+        if missing:
+            new_vectors = dict(zip(missing, self.scheduler.embed(missing, task_type="retrieval_query")))
+            self._cache_queries(new_vectors)
+            known.update(new_vectors)
+        return [known[text] for text in texts]
 
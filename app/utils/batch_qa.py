@@ -0,0 +1,253 @@
+"""
+Batch question answering, without Streamlit (e.g. nightly regression sets of thousands of questions).
+
+Questions are normalized and deduplicated, so a question asked several times is answered once. The query
+embeddings of the distinct questions are computed ahead, up to 100 per API call, instead of one call per
+question. Retrieval and answer generation then run on a bounded pool of threads (BATCH_QA_CONCURRENCY), with
+the chat calls held under CHAT_RPM and retried with backoff on rate limit and transient errors. Results come
+out in the order of the questions as soon as each one (and every one before it) is done, with their sources
+and per-stage timings.
+"""
+import json
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from utils import config
+from utils import metrics
+from utils.embedding_scheduler import TokenBucket, is_retryable
+from utils.fakes import is_fake_model
+
+# Distinct questions embedded ahead together (5 API calls), then submitted
+PRIME_WINDOW = 500
+# Backoff between retries of a chat call (seconds, exponential with jitter)
+RETRY_BASE_DELAY = 2.0
+RETRY_MAX_DELAY = 60.0
+
+# The chat quota applies per API key, so every batch of the process shares the same bucket
+_chat_rate_limiter = None
+_chat_rate_limiter_lock = threading.Lock()
+
+
+def get_chat_rate_limiter():
+    """
+    Return the process-wide limiter of chat calls configured with CHAT_RPM (None for the offline fake model)
+    """
+    global _chat_rate_limiter
+    if is_fake_model(config.CHAT_MODEL):
+        return None
+    with _chat_rate_limiter_lock:
+        if _chat_rate_limiter is None:
+            _chat_rate_limiter = TokenBucket(config.CHAT_RPM)
+        return _chat_rate_limiter
+
+
+def normalize_question(text):
+    """
+    Collapse whitespace, so questions that only differ by spacing are answered once
+    """
+    return " ".join(str(text).split())
+
+
+def read_questions(lines):
+    """
+    Read questions from a text file with one question per line, or a JSONL file of objects with a "question"
+    field (other fields, e.g. an id or the expected answer, are kept in the results). Blank lines and lines
+    starting with '#' are skipped
+
+    Parameters:
+    - lines (iterable): Lines of the file
+
+    Returns:
+    - list: Question records (dicts with at least "id" and "question"); the id defaults to the line number
+
+    Raises:
+    - ValueError: If a JSON line has no question
+    """
+    records = []
+    for line_number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("{"):
+            record = json.loads(line)
+            if not normalize_question(record.get("question", "")):
+                raise ValueError(f"Line {line_number}: no question")
+        else:
+            record = {"question": line}
+        record.setdefault("id", line_number)
+        records.append(record)
+    return records
+
+
+def answer_one(question, vectordb, db_path=None, rate_limiter=None, max_retries=None):
+    """
+    Answer one question without chat history
+
+    Parameters:
+    - question (str): The question
+    - vectordb: Vector database used for context retrieval
+    - db_path (str, optional): Folder of the vector database (e.g. of a corpus). Defaults to VECTOR_DB_PATH
+    - rate_limiter (TokenBucket, optional): Taken once per chat call. Defaults to no limit
+    - max_retries (int, optional): Retries of the chat call on rate limit and transient errors. Defaults to CHAT_MAX_RETRIES
+
+    Returns:
+    - result (dict): "answer", "sources" (pages by document), "error" (None on success), "cached" (answered from
+      the semantic answer cache), "attempts" and "timings" in milliseconds (retrieval, rate limit wait, first
+      token, whole LLM call and total)
+    """
+    # Imported here: LangChain loads with the first batch, not when the module is imported
+    from utils.chatbot import ResponseStream, context_sources, find_cached_answer, remember_answer
+    max_retries = config.CHAT_MAX_RETRIES if max_retries is None else max_retries
+    started = time.perf_counter()
+    timings = {"retrieval_ms": None, "rate_limit_wait_ms": 0.0, "first_token_ms": None, "llm_ms": None}
+    result = {"answer": None, "sources": {}, "error": None, "cached": False, "attempts": 0, "timings": timings}
+    with metrics.span("batch_question") as span:
+        try:
+            cached, cache_key = find_cached_answer(question, [], vectordb, db_path)
+            if cached is not None:
+                result.update(answer=cached.answer, sources=context_sources(cached.context), cached=True)
+                return _finish(result, started)
+            stream = ResponseStream(question, [], vectordb, db_path=db_path)
+            stream.retrieve()
+            timings["retrieval_ms"] = (time.perf_counter() - started) * 1000
+            result["sources"] = context_sources(stream.context)
+            for attempt in range(max_retries + 1):
+                if attempt:
+                    # A new stream for the retry, with the context already retrieved
+                    retry = ResponseStream(question, [], vectordb, db_path=db_path)
+                    retry.context, retry.prompt_tokens = stream.context, stream.prompt_tokens
+                    stream = retry
+                if rate_limiter is not None:
+                    timings["rate_limit_wait_ms"] += rate_limiter.acquire(1) * 1000
+                result["attempts"] = attempt + 1
+                llm_started = time.perf_counter()
+                try:
+                    for _ in stream.tokens():
+                        if timings["first_token_ms"] is None:
+                            timings["first_token_ms"] = (time.perf_counter() - llm_started) * 1000
+                    timings["llm_ms"] = (time.perf_counter() - llm_started) * 1000
+                    break
+                except Exception as e:
+                    # A timeout without any answer is most often the quota too
+                    retryable = is_retryable(e) or (isinstance(e, TimeoutError) and not stream.answer)
+                    if not retryable or attempt == max_retries:
+                        raise
+                    timings["first_token_ms"] = None
+                    time.sleep(random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt))))
+            if not stream.answer:
+                raise Exception("No response received from API")
+            result["answer"] = stream.answer
+            if stream.completed:
+                remember_answer(cache_key, stream.answer, stream.context)
+        except Exception as e:
+            result["error"] = f"{type(e).__name__}: {e}"[:500]
+            span.set(failed=result["error"][:200])
+        finally:
+            span.set(attempts=result["attempts"], cached=result["cached"])
+    return _finish(result, started)
+
+
+def _finish(result, started):
+    # Total time, and timings rounded to 0.1 ms for the output
+    timings = result["timings"]
+    timings["total_ms"] = (time.perf_counter() - started) * 1000
+    for name, value in timings.items():
+        if value is not None:
+            timings[name] = round(value, 1)
+    return result
+
+
+def prime_query_embeddings(vectordb, questions):
+    """
+    Embed the questions in batches ahead of retrieval, when the embedding client of the vector store supports it
+    (see BatchGoogleGenerativeAIEmbeddings.embed_queries). On failure the questions are embedded one by one later
+    """
+    embedding = getattr(vectordb, "embeddings", None)
+    if not questions or not hasattr(embedding, "embed_queries") or getattr(embedding, "query_cache_size", 0) <= 0:
+        return
+    with metrics.span("query_embeddings", questions=len(questions)) as span:
+        try:
+            embedding.embed_queries(questions)
+        except Exception as e:
+            span.set(failed=str(e)[:200])
+
+
+def percentile(values, q):
+    """
+    The q-th percentile of the values (None if there are none)
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q / 100 * (len(ordered) - 1)))))]
+
+
+def answer_questions(records, vectordb, db_path=None, concurrency=None, on_result=None):
+    """
+    Answer a batch of questions
+
+    Parameters:
+    - records (list): Question records (dicts with a "question", see read_questions)
+    - vectordb: Vector database used for context retrieval
+    - db_path (str, optional): Folder of the vector database (e.g. of a corpus). Defaults to VECTOR_DB_PATH
+    - concurrency (int, optional): Questions answered at the same time. Defaults to BATCH_QA_CONCURRENCY
+    - on_result (callable, optional): Called with each result, in the order of the records, as soon as it and
+      every result before it are ready (e.g. to write them out while the batch goes on)
+
+    Returns:
+    - summary (dict): Question counts, failures, elapsed time and total latency percentiles (ms) of the distinct questions
+    """
+    concurrency = max(1, concurrency or config.BATCH_QA_CONCURRENCY)
+    started = time.perf_counter()
+    # Distinct questions, and the records asking each one
+    askers = {}
+    for index, record in enumerate(records):
+        askers.setdefault(normalize_question(record["question"]), []).append(index)
+    questions = list(askers)
+    rate_limiter = get_chat_rate_limiter()
+    results = [None] * len(records)
+    next_index = 0
+    latencies = []
+    failed = 0
+
+    # Questions are embedded and submitted a window at a time: the vectors computed ahead are still in the query
+    # embedding LRU when their question comes up, and a large batch is not queued all at once
+    window = max(concurrency, min(PRIME_WINDOW, config.QUERY_EMBEDDING_CACHE_SIZE // 2))
+    with metrics.span("batch_qa", questions=len(records), distinct=len(questions), concurrency=concurrency) as span:
+        pending = {}
+        submitted = 0
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while submitted < len(questions) or pending:
+                if submitted < len(questions) and len(pending) < window:
+                    batch = questions[submitted:submitted + window]
+                    prime_query_embeddings(vectordb, batch)
+                    for question in batch:
+                        pending[executor.submit(answer_one, question, vectordb, db_path, rate_limiter)] = question
+                    submitted += len(batch)
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    answer = future.result()
+                    latencies.append(answer["timings"]["total_ms"])
+                    failed += answer["error"] is not None
+                    for position, index in enumerate(askers[pending.pop(future)]):
+                        # Repeats of a question get the same answer, marked as such
+                        results[index] = dict(records[index], **answer, deduplicated=position > 0)
+                while next_index < len(results) and results[next_index] is not None:
+                    if on_result is not None:
+                        on_result(results[next_index])
+                    # Written results are not kept: a large batch does not pile up in memory
+                    results[next_index] = True
+                    next_index += 1
+        elapsed = time.perf_counter() - started
+        span.set(failed=failed)
+
+    return {
+        "questions": len(records),
+        "distinct": len(questions),
+        "failed": failed,
+        "elapsed_s": round(elapsed, 3),
+        "questions_per_s": round(len(records) / elapsed, 2) if elapsed > 0 else None,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+    }
@@ -0,0 +1,321 @@
+"""
+In-process BM25 inverted index over the chunks of the vector DB.
+Vector similarity misses exact identifiers (part numbers, error codes, ...), so the chatbot can combine
+it with this lexical index. The index is updated incrementally during ingestion and persisted next to
+the Chroma files. Queries only walk the postings of the query terms, so they stay in the millisecond
+range on collections with hundreds of thousands of chunks.
+The index is saved as plain arrays in an .npz file (postings back to back, chunk IDs and terms as JSON) and
+always read without pickle, so an index file received from elsewhere (e.g. in a snapshot) can't run code.
+"""
+import os
+import re
+import json
+import math
+import heapq
+import logging
+import zipfile
+import threading
+from collections import Counter
+import numpy as np
+
+BM25_FILENAME = "bm25.npz"
+# Pickled indexes of earlier versions: never loaded (the next sync rebuilds the index), deleted on the next save
+LEGACY_BM25_FILENAME = "bm25.pkl"
+BM25_FORMAT_VERSION = 1
+
+logger = logging.getLogger(__name__)
+
+# Words like "the" appear in nearly every chunk: they add nothing to the ranking and have huge postings
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were will with".split()
+)
+# Identifiers such as "ERR-42", "A1.2.3" or "part_no" are kept whole, and also split into their parts
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+_PART_RE = re.compile(r"[-_./]")
+
+
+def tokenize(text):
+    """
+    Split text into lowercase index terms
+
+    Parameters:
+    - text (str): Text to tokenize
+
+    Returns:
+    - list: Terms, compound identifiers followed by their parts
+    """
+    terms = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        terms.append(token)
+        if _PART_RE.search(token):
+            terms.extend(part for part in _PART_RE.split(token) if part and part not in STOPWORDS)
+    return terms
+
+
+def term_counts(text):
+    """
+    Count the index terms of a text, as Counter(tokenize(text)) but faster on long texts:
+    each distinct compound identifier is split once instead of at every occurrence
+
+    Parameters:
+    - text (str): Text to tokenize
+
+    Returns:
+    - Counter: Occurrences by term
+    """
+    counts = Counter(_TOKEN_RE.findall(text.lower()))
+    for word in STOPWORDS.intersection(counts):
+        del counts[word]
+    for token, count in [(token, count) for token, count in counts.items() if _PART_RE.search(token)]:
+        for part in _PART_RE.split(token):
+            if part and part not in STOPWORDS:
+                counts[part] += count
+    return counts
+
+
+class BM25Index:
+    """
+    BM25 (Okapi) inverted index keyed by chunk ID, with incremental add and remove
+    """
+
+    def __init__(self, path=None, k1=1.5, b=0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.postings = {}      # term -> {doc number: term frequency}
+        self.doc_ids = []       # doc number -> chunk ID (None once removed)
+        self.doc_terms = []     # doc number -> unique terms of the chunk (needed to remove it)
+        self.doc_lengths = []   # doc number -> number of terms
+        self.id_to_doc = {}     # chunk ID -> doc number
+        self.free_docs = []     # doc numbers of removed chunks, reused by later additions
+        self.total_length = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.id_to_doc)
+
+    def add(self, chunk_id, text):
+        """
+        Index a chunk (an existing chunk with the same ID is replaced)
+        """
+        with self._lock:
+            if chunk_id in self.id_to_doc:
+                self.remove([chunk_id])
+            counts = term_counts(text)
+            length = sum(counts.values())
+            if self.free_docs:
+                doc = self.free_docs.pop()
+                self.doc_ids[doc] = chunk_id
+                self.doc_terms[doc] = tuple(counts)
+                self.doc_lengths[doc] = length
+            else:
+                doc = len(self.doc_ids)
+                self.doc_ids.append(chunk_id)
+                self.doc_terms.append(tuple(counts))
+                self.doc_lengths.append(length)
+            self.id_to_doc[chunk_id] = doc
+            self.total_length += length
+            for term, count in counts.items():
+                self.postings.setdefault(term, {})[doc] = count
+
+    def add_many(self, chunk_ids, texts):
+        with self._lock:
+            for chunk_id, text in zip(chunk_ids, texts):
+                self.add(chunk_id, text)
+
+    def remove(self, chunk_ids):
+        """
+        Remove chunks from the index (unknown IDs are ignored)
+        """
+        with self._lock:
+            for chunk_id in chunk_ids:
+                doc = self.id_to_doc.pop(chunk_id, None)
+                if doc is None:
+                    continue
+                for term in self.doc_terms[doc]:
+                    posting = self.postings.get(term)
+                    if posting is not None:
+                        posting.pop(doc, None)
+                        if not posting:
+                            del self.postings[term]
+                self.total_length -= self.doc_lengths[doc]
+                self.doc_ids[doc] = None
+                self.doc_terms[doc] = ()
+                self.doc_lengths[doc] = 0
+                self.free_docs.append(doc)
+
+    def search(self, query, k=10):
+        """
+        Rank the chunks matching the query
+
+        Parameters:
+        - query (str): Query text
+        - k (int, optional): Number of results. Defaults to 10
+
+        Returns:
+        - list: (chunk_id, score) tuples, best first
+        """
+        with self._lock:
+            n_docs = len(self.id_to_doc)
+            if n_docs == 0:
+                return []
+            avg_length = self.total_length / n_docs or 1.0
+            scores = {}
+            for term in set(tokenize(query)):
+                posting = self.postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1 + (n_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+                for doc, tf in posting.items():
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc] / avg_length)
+                    scores[doc] = scores.get(doc, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+            best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            return [(self.doc_ids[doc], score) for doc, score in best]
+
+    def save(self, path=None):
+        """
+        Persist the index atomically
+        """
+        path = path or self.path
+        with self._lock:
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                self.dump(f)
+            os.replace(tmp_path, path)
+        legacy_path = os.path.join(os.path.dirname(path), LEGACY_BM25_FILENAME)
+        if os.path.exists(legacy_path):
+            os.remove(legacy_path)
+
+    def dump(self, file):
+        """
+        Write the index to an open binary file (e.g. a section of an index snapshot), in the format read() reads
+        """
+        with self._lock:
+            terms = list(self.postings)
+            sizes = np.fromiter((len(self.postings[term]) for term in terms), dtype=np.int64, count=len(terms))
+            docs = np.empty(int(sizes.sum()), dtype=np.int64)
+            tfs = np.empty(len(docs), dtype=np.int64)
+            start = 0
+            for term in terms:
+                posting = self.postings[term]
+                end = start + len(posting)
+                docs[start:end] = np.fromiter(posting.keys(), dtype=np.int64, count=len(posting))
+                tfs[start:end] = np.fromiter(posting.values(), dtype=np.int64, count=len(posting))
+                start = end
+            arrays = {
+                "header": np.array([BM25_FORMAT_VERSION, self.k1, self.b], dtype=np.float64),
+                # Strings as UTF-8 JSON bytes: fixed-width NumPy strings would pad every term to the longest one
+                "doc_ids": np.frombuffer(json.dumps(self.doc_ids).encode("utf-8"), dtype=np.uint8),
+                "doc_lengths": np.array(self.doc_lengths, dtype=np.int64),
+                "terms": np.frombuffer(json.dumps(terms).encode("utf-8"), dtype=np.uint8),
+                "posting_ends": np.cumsum(sizes),
+                "posting_docs": docs,
+                "posting_tfs": tfs,
+            }
+            # The layout of np.savez, written here because np.savez wants a readable file and snapshot sections are write-only
+            with zipfile.ZipFile(file, mode="w", compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+                for name, array in arrays.items():
+                    with archive.open(name + ".npy", mode="w", force_zip64=True) as entry:
+                        np.lib.format.write_array(entry, array, allow_pickle=False)
+
+    @classmethod
+    def read(cls, file, path=None):
+        """
+        Read an index written by dump() (never unpickles anything)
+
+        Parameters:
+        - file (str or file): Path or open binary file
+        - path (str, optional): Where the index is saved from now on
+
+        Returns:
+        - BM25Index: The index
+
+        Raises:
+        - ValueError: If the file is not a BM25 index of this format (e.g. a pickled index of an earlier version)
+        """
+        try:
+            with np.load(file, allow_pickle=False) as arrays:
+                version, k1, b = arrays["header"].tolist()
+                if version != BM25_FORMAT_VERSION:
+                    raise ValueError(f"Unsupported BM25 index format: {version}")
+                doc_ids = json.loads(arrays["doc_ids"].tobytes().decode("utf-8"))
+                terms = json.loads(arrays["terms"].tobytes().decode("utf-8"))
+                doc_lengths, ends, docs, tfs = (arrays[name] for name in ("doc_lengths", "posting_ends", "posting_docs", "posting_tfs"))
+        except (OSError, KeyError, EOFError, zipfile.BadZipFile, UnicodeDecodeError) as e:
+            raise ValueError(f"Not a BM25 index: {e}") from e
+        # The file may come from another node: check everything the queries index with
+        if not (isinstance(doc_ids, list) and all(chunk_id is None or isinstance(chunk_id, str) for chunk_id in doc_ids)
+                and isinstance(terms, list) and all(isinstance(term, str) for term in terms)):
+            raise ValueError("Damaged BM25 index: chunk IDs and terms must be strings")
+        if (any(array.dtype.kind not in "iu" or array.ndim != 1 for array in (doc_lengths, ends, docs, tfs))
+                or len(doc_lengths) != len(doc_ids) or len(ends) != len(terms) or len(docs) != len(tfs)
+                or (len(ends) and (ends[-1] != len(docs) or (np.diff(ends, prepend=0) < 0).any()))
+                or (len(docs) and (docs.min() < 0 or docs.max() >= len(doc_ids)))):
+            raise ValueError("Damaged BM25 index: inconsistent arrays")
+        index = cls(path, k1=k1, b=b)
+        # Terms of each chunk (for remove()): the term numbers of the postings, grouped by chunk with a stable sort
+        term_numbers = np.repeat(np.arange(len(terms)), np.diff(ends, prepend=0))[np.argsort(docs, kind="stable")].tolist()
+        doc_ends = np.cumsum(np.bincount(docs, minlength=len(doc_ids))).tolist()
+        index.doc_terms = [tuple(map(terms.__getitem__, term_numbers[start:end])) for start, end in zip([0] + doc_ends, doc_ends)]
+        ends, docs, tfs = ends.tolist(), docs.tolist(), tfs.tolist()
+        start = 0
+        for term, end in zip(terms, ends):
+            index.postings[term] = dict(zip(docs[start:end], tfs[start:end]))
+            start = end
+        index.doc_ids = doc_ids
+        doc_lengths = doc_lengths.tolist()
+        index.doc_lengths = doc_lengths
+        index.id_to_doc = {chunk_id: doc for doc, chunk_id in enumerate(doc_ids) if chunk_id is not None}
+        index.free_docs = [doc for doc, chunk_id in enumerate(doc_ids) if chunk_id is None]
+        index.total_length = sum(doc_lengths)
+        return index
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a persisted index, or return an empty one if the file does not exist or can't be read
+        (the next sync rebuilds an index that does not cover the registered chunks)
+        """
+        if not os.path.exists(path):
+            return cls(path)
+        try:
+            return cls.read(path, path)
+        except ValueError as e:
+            logger.warning("Ignoring the BM25 index in '%s': %s", path, e)
+            return cls(path)
+
+
+# One index per vector DB folder, shared by every session and reloaded if another process rewrote it
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_bm25_index(db_path):
+    """
+    Return the process-wide BM25 index of a vector DB folder
+
+    Parameters:
+    - db_path (str): Vector DB folder
+
+    Returns:
+    - BM25Index: The shared index (empty if none was built yet)
+    """
+    path = os.path.join(db_path, BM25_FILENAME)
+    mtime = os.path.getmtime(path) if os.path.exists(path) else None
+    with _indexes_lock:
+        cached = _indexes.get(path)
+        if cached is None or cached[1] != mtime:
+            cached = (BM25Index.load(path), mtime)
+            _indexes[path] = cached
+        return cached[0]
+
+
+def save_bm25_index(index):
+    """
+    Save a shared index and remember the new file time, so this process does not reload its own write
+    """
+    index.save()
+    with _indexes_lock:
+        _indexes[index.path] = (index, os.path.getmtime(index.path))
@@ -0,0 +1,200 @@
+"""
+Bounded chat history for the prompt.
+
+The full conversation stays in the session for display, but the LLM only receives the most recent turns
+verbatim, within HISTORY_TOKEN_BUDGET tokens, preceded by a running summary of the older turns. When the
+recent turns outgrow the budget, the oldest ones are folded into the summary by one LLM call, run in the
+background after the answer was shown; the next question waits for it only briefly. So the prompt, and
+the latency of each turn, stay flat however long the conversation gets.
+"""
+import threading
+from langchain_core.messages import AIMessage, HumanMessage
+from utils import config
+from utils import metrics
+from utils.chunking import count_tokens
+
+# Rough per-message overhead of the chat format (role markers, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+# How long a question waits for a summary still being written before going on without it (seconds)
+SUMMARY_WAIT_SECONDS = 5.0
+# Turn statistics kept per conversation
+MAX_TURN_STATS = 100
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a conversation between a user and an assistant that answers questions "
+    "about the user's documents. Update the summary with the new messages. Keep names, numbers, error codes, "
+    "decisions and open questions; drop greetings and repetition. Answer with the updated summary only, in at "
+    "most {max_words} words."
+)
+
+
+def message_tokens(message):
+    """
+    Estimated tokens of one chat message in the prompt
+    """
+    return count_tokens(message.content) + MESSAGE_OVERHEAD_TOKENS
+
+
+def llm_summarizer(summary, messages, max_tokens):
+    """
+    Fold messages into a summary with the chat model
+
+    Parameters:
+    - summary (str): Current summary (may be empty)
+    - messages (list): Messages to add to it, oldest first
+    - max_tokens (int): Size the summary should stay under
+
+    Returns:
+    - str: The updated summary
+    """
+    from langchain_core.output_parsers import StrOutputParser
+    from langchain_core.prompts import ChatPromptTemplate
+    from utils.chatbot import get_llm
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", SUMMARY_INSTRUCTIONS),
+        ("human", "Current summary:\n{summary}\n\nNew messages:\n{messages}"),
+    ])
+    transcript = "\n".join(f"{'User' if isinstance(message, HumanMessage) else 'Assistant'}: {message.content}" for message in messages)
+    chain = prompt | get_llm() | StrOutputParser()
+    return chain.invoke({"summary": summary or "(none yet)", "messages": transcript, "max_words": max(20, int(max_tokens * 0.7))})
+
+
+class ChatHistoryManager:
+    """
+    Chooses the history sent with each question: a summary of the older turns plus the recent turns verbatim,
+    within a token budget. One manager lives in each session, next to the full chat history it summarizes
+    """
+
+    def __init__(self, token_budget=None, summary_tokens=None, min_recent_turns=None, summarizer=None):
+        """
+        Parameters:
+        - token_budget (int, optional): Tokens of history sent per question, summary included. Defaults to HISTORY_TOKEN_BUDGET
+        - summary_tokens (int, optional): Size the summary is kept under. Defaults to HISTORY_SUMMARY_TOKENS
+        - min_recent_turns (int, optional): Question/answer pairs always sent verbatim. Defaults to HISTORY_MIN_RECENT_TURNS
+        - summarizer (callable, optional): Function (summary, messages, max_tokens) -> summary. Defaults to llm_summarizer
+        """
+        self.token_budget = config.HISTORY_TOKEN_BUDGET if token_budget is None else token_budget
+        self.summary_tokens = config.HISTORY_SUMMARY_TOKENS if summary_tokens is None else summary_tokens
+        self.min_recent_turns = config.HISTORY_MIN_RECENT_TURNS if min_recent_turns is None else min_recent_turns
+        self.summarizer = summarizer or llm_summarizer
+        self.summary = ""
+        # Number of messages at the start of the history that the summary covers
+        self.summarized = 0
+        self.turn_stats = []
+        self._lock = threading.Lock()
+        self._compaction = None
+
+    def _wait_for_compaction(self, timeout=SUMMARY_WAIT_SECONDS):
+        compaction = self._compaction
+        if compaction is not None:
+            compaction.join(timeout)
+
+    def prompt_messages(self, history):
+        """
+        Messages to send with the next question
+
+        Parameters:
+        - history (list): The whole conversation so far (HumanMessage/AIMessage), oldest first
+
+        Returns:
+        - list: Summary of the older turns (if any) followed by as many recent messages as fit in the budget
+        """
+        self._wait_for_compaction()
+        with self._lock:
+            if self.summarized > len(history):
+                # The history was cleared or replaced: the summary no longer applies
+                self.summary, self.summarized = "", 0
+            summary, start = self.summary, self.summarized
+
+        messages = []
+        if summary:
+            # A question/answer pair keeps the user/assistant alternation Gemini expects
+            messages = [HumanMessage(content=f"Summary of our conversation so far: {summary}"), AIMessage(content="Understood, I will take it into account.")]
+        budget = self.token_budget - sum(message_tokens(message) for message in messages)
+        recent = history[start:]
+        # Newest turns first, whole turns only, until the budget is used (the newest turn is always sent)
+        keep = len(recent)
+        used = 0
+        for index in range(len(recent) - 1, -1, -1):
+            used += message_tokens(recent[index])
+            if used > budget and keep < len(recent):
+                break
+            if isinstance(recent[index], HumanMessage):
+                keep = index
+        return messages + recent[keep:]
+
+    def _fold_plan(self, history):
+        """
+        Messages to fold into the summary so that the recent ones fit in the budget (None when they already do)
+        """
+        recent = history[self.summarized:]
+        room = self.token_budget - self.summary_tokens
+        if sum(message_tokens(message) for message in recent) <= room:
+            return None
+        # Keep the newest whole turns that fit in half the room, and at least min_recent_turns of them.
+        # Folding down to half (rather than just under the limit) means one summary call every few turns, not every turn
+        turn_starts = [i for i, message in enumerate(recent) if isinstance(message, HumanMessage)]
+        protected = turn_starts[-self.min_recent_turns:] if self.min_recent_turns > 0 else []
+        keep_from = protected[0] if protected else len(recent)
+        for start in reversed(turn_starts[:len(turn_starts) - len(protected)]):
+            if sum(message_tokens(message) for message in recent[start:]) > room // 2:
+                break
+            keep_from = start
+        if keep_from == 0:
+            return None
+        return recent[:keep_from]
+
+    def _compact(self, history):
+        with self._lock:
+            to_fold = self._fold_plan(history)
+            summary = self.summary
+        if not to_fold:
+            return
+        with metrics.span("history_summary", messages=len(to_fold)) as span:
+            try:
+                new_summary = self.summarizer(summary, to_fold, self.summary_tokens).strip()
+            except Exception as e:
+                # Quota or network error: the summary is not updated and older turns are simply left out of the prompt
+                span.set(failed=str(e)[:200])
+                return
+        # The summary can't be allowed to grow past its share of the budget
+        if count_tokens(new_summary) > self.summary_tokens:
+            words = new_summary.split()
+            while words and count_tokens(" ".join(words)) > self.summary_tokens:
+                words = words[:int(len(words) * 0.9)]
+            new_summary = " ".join(words)
+        with self._lock:
+            self.summary = new_summary
+            self.summarized += len(to_fold)
+
+    def after_turn(self, history, background=True):
+        """
+        Fold the oldest turns into the summary if the recent ones outgrew the budget
+
+        Parameters:
+        - history (list): The whole conversation, including the turn just answered
+        - background (bool, optional): Summarize in a background thread. Defaults to True
+        """
+        with self._lock:
+            if self._fold_plan(history) is None:
+                return
+        if not background:
+            self._compact(history)
+            return
+        if self._compaction is not None and self._compaction.is_alive():
+            # The previous summary is still being written; what is left is folded after a later turn
+            return
+        self._compaction = threading.Thread(target=self._compact, args=(list(history),), daemon=True)
+        self._compaction.start()
+
+    def record_turn(self, prompt_tokens):
+        """
+        Keep the prompt size of a turn (e.g. {"history": ..., "context": ..., "question": ...}) and report it to the metrics
+        """
+        if not prompt_tokens:
+            return
+        for part, tokens in prompt_tokens.items():
+            metrics.count("prompt_tokens", tokens, part=part)
+        with self._lock:
+            self.turn_stats.append(dict(prompt_tokens, total=sum(prompt_tokens.values())))
+            del self.turn_stats[:-MAX_TURN_STATS]
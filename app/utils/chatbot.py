@@ -1,51 +1,352 @@
 import streamlit as st
 import os
+import time
+import asyncio
+import queue
+import threading
 from collections import defaultdict
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.messages import AIMessage, HumanMessage
-from langchain.chains import create_retrieval_chain
-from langchain.chains.combine_documents import create_stuff_documents_chain
-from dotenv import load_dotenv
+from utils import config
+from utils import metrics
+from utils.hybrid_retriever import HybridRetriever
+from utils.context_compression import CompressingRetriever
+from utils.fakes import fake_chat_model, is_fake_model
+from utils.chunking import count_tokens, get_aliases
+from utils.chat_history import ChatHistoryManager, message_tokens
+from utils.answer_cache import SemanticAnswerCache, corpus_version
 
-def get_context_retriever_chain(vectordb):
+# System prompt of the chatbot. Built once, it does not depend on the vectorstore or the model
+prompt = ChatPromptTemplate.from_messages([
+    ("system", "You are a chatbot. You'll receive a prompt that includes a chat history and retrieved content from the vectorDB based on the user's question. Your task is to respond to the user's question using the information from the vectordb, relying as little as possible on your own knowledge. If for some reason you don't know the answer for the question, or the question cannot be answered because there's no context, ask the user for more details. Do not invent an answer. Answer the questions from this context: {context}"),
+    MessagesPlaceholder(variable_name="chat_history"),
+    ("human", "{input}")
+])
+
+# Process-wide caches shared by every Streamlit session: LLM clients by model settings, and
+# retrieval chains by vectorstore and settings. Keys include every setting the object depends on,
+# so changing the collection or the model settings builds a new one
+_llm_cache = {}
+_chain_cache = {}
+_cache_lock = threading.Lock()
+# Chains are kept for this many vectorstores at most (oldest dropped first)
+MAX_CACHED_CHAINS = 8
+# Answers reused for near-identical questions by every session (see answer_cache.py), created on first use
+_answer_cache = None
+
+def get_llm(model=None, temperature=None):
+    """
+    Return the shared chat model client for the given settings, creating it on first use
+
+    Parameters:
+    - model (str, optional): Gemini chat model. Defaults to CHAT_MODEL from the config
+    - temperature (float, optional): Sampling temperature. Defaults to CHAT_TEMPERATURE from the config
+
+    Returns:
+    - llm: ChatGoogleGenerativeAI client
     """
-    Create a context retriever chain for generating responses based on the chat history and vector database
+    model = model or config.CHAT_MODEL
+    temperature = config.CHAT_TEMPERATURE if temperature is None else temperature
+    key = (model, temperature)
+    with _cache_lock:
+        if key not in _llm_cache and is_fake_model(model):
+            # Offline stand-in, for benchmarks and development without quota
+            _llm_cache[key] = fake_chat_model()
+        if key not in _llm_cache:
+            # Get API key from environment (loaded from the .env file by the config module)
+            api_key = os.getenv('GOOGLE_API_KEY')
+            if not api_key:
+                raise ValueError("GOOGLE_API_KEY not found in environment. Please add it to your .env file.")
+            # Imported on first use (the Google SDK is slow to import)
+            from langchain_google_genai import ChatGoogleGenerativeAI
+            # gemini-pro is deprecated - use gemini-2.5-flash or gemini-1.5-pro
+            _llm_cache[key] = ChatGoogleGenerativeAI(model=model, temperature=temperature, convert_system_message_to_human=True, google_api_key=api_key)
+        return _llm_cache[key]
+
+def _vectorstore_key(vectordb):
+    """
+    Identify the collection behind a vectorstore. A new or recreated collection gets a new key
+    """
+    collection = getattr(vectordb, "_collection", None)
+    collection_id = getattr(collection, "id", None)
+    return (id(vectordb), str(collection_id))
+
+def get_context_retriever_chain(vectordb, db_path=None):
+    """
+    Create a context retriever chain for generating responses based on the chat history and vector database.
+    The chain is cached per vectorstore and settings, so it is only built once and then reused by every question
 
     Parameters:
     - vectordb: Vector database used for context retrieval
+    - db_path (str, optional): Folder of the vector database (for its keyword index), e.g. Corpus.db_path. Defaults to VECTOR_DB_PATH
 
     Returns:
     - retrieval_chain: Context retriever chain for generating responses
     """
-    # Load environment variables (gets api keys for the models)
-    # Load .env from project root
-    project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    env_path = os.path.join(project_root, '.env')
-    load_dotenv(dotenv_path=env_path)
-    # Also try loading from current directory as fallback
-    load_dotenv()
-    # Get API key from environment
-    api_key = os.getenv('GOOGLE_API_KEY')
-    if not api_key:
-        raise ValueError("GOOGLE_API_KEY not found in environment. Please add it to your .env file.")
+    return get_chain_components(vectordb, db_path)["retrieval_chain"]
+
+def get_chain_components(vectordb, db_path=None):
+    """
+    Return the cached retriever, documents chain and retrieval chain of a vectorstore, building them on first use
+
+    Parameters:
+    - vectordb: Vector database used for context retrieval
+    - db_path (str, optional): Folder of the vector database (for its keyword index), e.g. Corpus.db_path. Defaults to VECTOR_DB_PATH
+
+    Returns:
+    - components (dict): "retriever", "document_chain" (answers from given context) and "retrieval_chain" (both chained)
+    """
+    db_path = os.path.abspath(db_path or config.VECTOR_DB_PATH)
+    key = (_vectorstore_key(vectordb), db_path) + _answer_settings()
+    with _cache_lock:
+        cached = _chain_cache.get(key)
+        # The vectorstore is kept with the chain, so its id() can't be reused by another object meanwhile
+        if cached is not None and cached[0] is vectordb:
+            return cached[1]
+    from langchain.chains import create_retrieval_chain
+    from langchain.chains.combine_documents import create_stuff_documents_chain
     # Initialize the model, set the retreiver and prompt for the chatbot
-    # Use gemini-2.5-flash (latest, faster model)
-    # gemini-pro is deprecated - use gemini-2.5-flash or gemini-1.5-pro
-    llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", temperature=0.2, convert_system_message_to_human=True, google_api_key=api_key)
-    # Use retriever with similarity search (works with our batch embedding)
-    retriever = vectordb.as_retriever(search_kwargs={"k": 5})  # Get top 5 most similar chunks
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", "You are a chatbot. You'll receive a prompt that includes a chat history and retrieved content from the vectorDB based on the user's question. Your task is to respond to the user's question using the information from the vectordb, relying as little as possible on your own knowledge. If for some reason you don't know the answer for the question, or the question cannot be answered because there's no context, ask the user for more details. Do not invent an answer. Answer the questions from this context: {context}"),
-        MessagesPlaceholder(variable_name="chat_history"),
-        ("human", "{input}")
-    ])
+    llm = get_llm()
+    # With compression, more candidates are retrieved and then reranked and cut down to RETRIEVAL_K
+    k = max(config.RETRIEVAL_K, config.CONTEXT_CANDIDATES) if config.CONTEXT_COMPRESSION else config.RETRIEVAL_K
+    if config.HYBRID_RETRIEVAL:
+        # Vector similarity fused with BM25 keyword search, which catches exact part numbers and error codes
+        retriever = HybridRetriever(vectordb=vectordb, db_path=db_path, k=k, fetch_k=max(k, config.RETRIEVAL_FETCH_K))
+    else:
+        # Use retriever with similarity search (works with our batch embedding)
+        retriever = vectordb.as_retriever(search_kwargs={"k": k})  # Get top k most similar chunks (5 by default)
+    if config.CONTEXT_COMPRESSION:
+        # Only the relevant passages of the best, diverse chunks are sent: a fraction of the tokens of whole chunks
+        retriever = CompressingRetriever(base_retriever=retriever, k=config.RETRIEVAL_K, token_budget=config.CONTEXT_TOKEN_BUDGET, lambda_mult=config.CONTEXT_MMR_LAMBDA)
     # Create chain for generating responses and a retrieval chain
-    chain = create_stuff_documents_chain(llm=llm, prompt=prompt)
-    retrieval_chain = create_retrieval_chain(retriever, chain)
-    return retrieval_chain
+    document_chain = create_stuff_documents_chain(llm=llm, prompt=prompt)
+    components = {
+        "retriever": retriever,
+        "document_chain": document_chain,
+        "retrieval_chain": create_retrieval_chain(retriever, document_chain),
+    }
+    with _cache_lock:
+        _chain_cache[key] = (vectordb, components)
+        while len(_chain_cache) > MAX_CACHED_CHAINS:
+            _chain_cache.pop(next(iter(_chain_cache)))
+    return components
+
+def _answer_settings():
+    """
+    Every setting the answer to a question depends on, besides the documents
+    """
+    return (config.CHAT_MODEL, config.CHAT_TEMPERATURE, config.RETRIEVAL_K, config.HYBRID_RETRIEVAL, config.RETRIEVAL_FETCH_K,
+            config.CONTEXT_COMPRESSION, config.CONTEXT_CANDIDATES, config.CONTEXT_TOKEN_BUDGET, config.CONTEXT_MMR_LAMBDA)
+
+def clear_chain_cache():
+    """
+    Drop every cached chain, LLM client and answer (they are rebuilt on the next question)
+    """
+    with _cache_lock:
+        _chain_cache.clear()
+        _llm_cache.clear()
+        if _answer_cache is not None:
+            _answer_cache.invalidate()
+
+def get_answer_cache():
+    """
+    Return the process-wide semantic answer cache (None when ANSWER_CACHE_MAX_ENTRIES is 0)
+    """
+    global _answer_cache
+    if config.ANSWER_CACHE_MAX_ENTRIES <= 0:
+        return None
+    with _cache_lock:
+        if _answer_cache is None:
+            _answer_cache = SemanticAnswerCache(config.ANSWER_CACHE_MAX_ENTRIES, config.ANSWER_CACHE_TTL, config.ANSWER_CACHE_THRESHOLD)
+        return _answer_cache
+
+def find_cached_answer(question, chat_history, vectordb, db_path=None):
+    """
+    Look for the answer to the same or a near-identical question asked before on the same documents.
+    Only questions without chat history are cached: a follow-up question depends on the conversation
+
+    Parameters:
+    - question (str): The user's question
+    - chat_history (list): Chat messages sent with the question
+    - vectordb: Vector database used for context retrieval
+    - db_path (str, optional): Folder of the vector database (e.g. of the selected corpus). Defaults to VECTOR_DB_PATH
+
+    Returns:
+    - cached (CachedAnswer or None): The stored answer, with its context documents, if there is one
+    - key (tuple or None): Pass it to remember_answer() once the question is answered (None: not cacheable)
+    """
+    cache = get_answer_cache()
+    embedding = getattr(vectordb, "embeddings", None)
+    if cache is None or chat_history or embedding is None:
+        return None, None
+    db_path = os.path.abspath(db_path or config.VECTOR_DB_PATH)
+    try:
+        # Kept in the query embedding LRU, so retrieval does not embed the question again on a miss
+        vector = embedding.embed_query(question)
+    except Exception:
+        # Retrieval reports the error
+        return None, None
+    scope = (db_path,) + _answer_settings()
+    version = corpus_version(db_path)
+    cached = cache.lookup(scope, version, question, vector)
+    metrics.count("answer_cache", result="miss" if cached is None else "hit")
+    return cached, (scope, version, question, vector)
+
+def remember_answer(key, answer, context):
+    """
+    Keep an answer for the near-identical questions asked later (key from find_cached_answer). Empty answers are
+    not kept: callers only pass answers that arrived in full (ResponseStream.completed)
+    """
+    cache = get_answer_cache()
+    if cache is not None and key is not None and answer.strip():
+        cache.store(*key, answer, context)
 
-def get_response(question, chat_history, vectordb):
+# Marks the end of the token stream in the queue between the LLM event loop and the reader
+_END_OF_STREAM = object()
+
+class _StreamFailure:
+    """
+    Carries an exception raised while generating to the reader
+    """
+    def __init__(self, error):
+        self.error = error
+
+# Event loop in which every answer of the process is generated, started on first use. Generating as an asyncio
+# task lets a cancel abort the API call itself, even while it waits for its first token, and the SDK's async
+# client stays bound to this one loop
+_stream_loop = None
+_stream_loop_lock = threading.Lock()
+
+def _get_stream_loop():
+    global _stream_loop
+    with _stream_loop_lock:
+        if _stream_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="llm-streams", daemon=True).start()
+            _stream_loop = loop
+        return _stream_loop
+
+class ResponseStream:
+    """
+    Answer to one question, streamed token by token.
+
+    Retrieval runs first and synchronously (call retrieve() to show the sources right away). The answer is
+    then generated as a task of the shared LLM event loop, which hands tokens over through a queue. Reading is
+    bounded by a first-token deadline and an idle deadline between tokens instead of a whole-answer timeout.
+    When the reader gives up (deadline, error, or it simply stops reading) the task is cancelled, which aborts
+    the API call whether it is streaming or still waiting for its first token
+    """
+
+    def __init__(self, question, chat_history, vectordb, first_token_timeout=None, idle_timeout=None, db_path=None):
+        components = get_chain_components(vectordb, db_path)
+        self._retriever = components["retriever"]
+        self._document_chain = components["document_chain"]
+        self.question = question
+        self.chat_history = chat_history
+        self.first_token_timeout = config.FIRST_TOKEN_TIMEOUT if first_token_timeout is None else first_token_timeout
+        self.idle_timeout = config.TOKEN_IDLE_TIMEOUT if idle_timeout is None else idle_timeout
+        self.context = None
+        self.answer = ""
+        # True once the whole answer arrived (not after a cancel, a timeout or an error)
+        self.completed = False
+        # Estimated tokens sent by part of the prompt, known once the context is retrieved
+        self.prompt_tokens = None
+        self._queue = queue.Queue()
+        # Generation task in the LLM event loop, once started
+        self._future = None
+        # Spans recorded from the generator are attached to the span the stream was created in
+        self._parent_span = metrics.current_span()
+
+    def retrieve(self):
+        """
+        Retrieve the context documents for the question (only once)
+
+        Returns:
+        - context (list): Retrieved documents, with the page metadata used for the sources
+        """
+        if self.context is None:
+            with metrics.span("retrieval", hybrid=config.HYBRID_RETRIEVAL) as span:
+                self.context = self._retriever.invoke(self.question)
+                span.set(documents=len(self.context))
+            self.prompt_tokens = {
+                "history": sum(message_tokens(message) for message in self.chat_history),
+                "context": sum(count_tokens(doc.page_content) for doc in self.context),
+                "question": count_tokens(self.question),
+            }
+        return self.context
+
+    def cancel(self):
+        """
+        Stop generating: the pending API call is cancelled
+        """
+        if self._future is not None:
+            self._future.cancel()
+
+    async def _generate(self):
+        stream = self._document_chain.astream({"input": self.question, "chat_history": self.chat_history, "context": self.context})
+        try:
+            async for token in stream:
+                self._queue.put(token)
+        except asyncio.CancelledError:
+            # Whoever still reads must not take the partial answer for a complete one
+            self._queue.put(_StreamFailure(RuntimeError("The answer was cancelled")))
+            raise
+        except Exception as e:
+            self._queue.put(_StreamFailure(e))
+        finally:
+            # Closing the generator ends the underlying API stream
+            await stream.aclose()
+            self._queue.put(_END_OF_STREAM)
+
+    def tokens(self):
+        """
+        Generate the answer, yielding each piece of text as soon as it arrives
+
+        Yields:
+        - str: Next piece of the answer
+
+        Raises:
+        - TimeoutError: If the first token or the next token does not arrive in time
+        """
+        self.retrieve()
+        started = time.perf_counter()
+        first_token = None
+        token_count = 0
+        error = None
+        self._future = asyncio.run_coroutine_threadsafe(self._generate(), _get_stream_loop())
+        timeout = self.first_token_timeout
+        try:
+            while True:
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    if not self.answer:
+                        raise TimeoutError(f"Request timeout: no answer within {timeout:g} seconds. This usually means your quota is exhausted or the API is slow.")
+                    raise TimeoutError(f"Request timeout: the answer stalled for {timeout:g} seconds.")
+                if item is _END_OF_STREAM:
+                    self.completed = True
+                    return
+                if isinstance(item, _StreamFailure):
+                    raise item.error
+                if first_token is None:
+                    first_token = time.perf_counter() - started
+                    metrics.record("llm_first_token", first_token, parent=self._parent_span)
+                token_count += 1
+                self.answer += item
+                yield item
+                timeout = self.idle_timeout
+        except BaseException as e:
+            error = f"{type(e).__name__}: {e}"[:300]
+            raise
+        finally:
+            # Runs on completion, on errors and when the reader stops early (e.g. a Streamlit rerun)
+            self.cancel()
+            # Recorded by hand: a span can't be kept open across the yields of a generator
+            metrics.record("llm_call", time.perf_counter() - started, parent=self._parent_span, error=error,
+                           ttft=round(first_token, 6) if first_token is not None else None, chunks=token_count, chars=len(self.answer),
+                           **{f"{part}_tokens": tokens for part, tokens in (self.prompt_tokens or {}).items()})
+
+def get_response(question, chat_history, vectordb, db_path=None):
     """
     Generate a response to the user's question based on the chat history and vector database
 
@@ -53,6 +354,7 @@ def get_response(question, chat_history, vectordb):
     - question (str): The user's question
     - chat_history (list): List of previous chat messages
     - vectordb: Vector database used for context retrieval
+    - db_path (str, optional): Folder of the vector database (e.g. of the selected corpus). Defaults to VECTOR_DB_PATH
 
     Returns:
     - response: The generated response
@@ -61,39 +363,20 @@ def get_response(question, chat_history, vectordb):
     Raises:
     - Exception: If API call fails (quota, network, timeout, etc.)
     """
-    import signal
-    import threading
-    
     try:
-        chain = get_context_retriever_chain(vectordb)
-        
-        # Use timeout to prevent hanging (30 seconds max)
-        result_container = {"response": None, "error": None, "timeout": False}
-        
-        def invoke_with_timeout():
-            try:
-                result_container["response"] = chain.invoke({"input": question, "chat_history": chat_history})
-            except Exception as e:
-                result_container["error"] = e
-        
-        # Run in a thread with timeout
-        thread = threading.Thread(target=invoke_with_timeout)
-        thread.daemon = True
-        thread.start()
-        thread.join(timeout=30.0)  # 30 second timeout
-        
-        if thread.is_alive():
-            result_container["timeout"] = True
-            raise Exception("Request timed out after 30 seconds. This usually means your quota is exhausted or the API is slow.")
-        
-        if result_container["error"]:
-            raise result_container["error"]
-        
-        if result_container["response"]:
-            return result_container["response"]["answer"], result_container["response"]["context"]
-        else:
+        cached, cache_key = find_cached_answer(question, chat_history, vectordb, db_path)
+        if cached is not None:
+            return cached.answer, cached.context
+        # Same streaming path as the chat UI, so a timed out request is cancelled instead of left running
+        with metrics.span("answer"):
+            stream = ResponseStream(question, chat_history, vectordb, db_path=db_path)
+            for _ in stream.tokens():
+                pass
+        if not stream.answer:
             raise Exception("No response received from API")
-            
+        if stream.completed:
+            remember_answer(cache_key, stream.answer, stream.context)
+        return stream.answer, stream.context
     except Exception as e:
         # Re-raise with more context
         error_msg = str(e)
@@ -101,70 +384,158 @@ def get_response(question, chat_history, vectordb):
             raise Exception("⏱️ Request timed out. Your quota may be exhausted. Wait 24 hours or upgrade to paid tier.")
         raise Exception(f"Failed to generate response: {error_msg}")
 
-def chat(chat_history, vectordb):
+def show_sources(context):
+    """
+    Display the source documents and pages of a response on the sidebar
+
+    Parameters:
+    - context (list): Documents retrieved for the response
+    """
+    with st.sidebar:
+        st.subheader("📚 Sources")
+        for source, pages in context_sources(context).items():
+            st.write(f"**{source}**")
+            st.write(f"Pages: {', '.join(map(str, pages))}")
+
+def context_sources(context):
+    """
+    Source documents and pages of a response
+
+    Parameters:
+    - context (list): Documents retrieved for the response
+
+    Returns:
+    - sources (dict): Sorted page numbers by source document, in the order the documents were retrieved
+    """
+    metadata_dict = defaultdict(list)
+    for metadata in [doc.metadata for doc in context]:
+        metadata_dict[metadata['source']].append(metadata['page'])
+        # Pages with the same text, deduplicated into this chunk
+        for alias in get_aliases(metadata):
+            if 'source' in alias and 'page' in alias:
+                metadata_dict[alias['source']].append(alias['page'])
+    return {source: sorted(set(pages)) for source, pages in metadata_dict.items()}
+
+def error_response_for(error_msg):
+    """
+    Build the chat message shown for an error
+
+    Parameters:
+    - error_msg (str): The error message
+
+    Returns:
+    - str: Message to add to the chat history
+    """
+    # Check if it's a quota error
+    if "quota" in error_msg.lower() or "429" in error_msg or "exceeded" in error_msg.lower() or "timeout" in error_msg.lower() or "timed out" in error_msg.lower():
+        return """
+        **🚫 Quota Limit Reached or Request Timed Out**
+        
+        Your free tier quota has been exceeded, or the request timed out. Chat generation also requires API calls.
+        
+        **Options:**
+        1. **Wait 24 hours** for quota reset
+        2. **Upgrade to paid tier** at https://ai.google.dev/pricing
+        
+        Your documents are already processed and ready - once quota resets, you can chat immediately!
+        """
+    return f"**Error generating response:** {error_msg}"
+
+def display_message(message):
+    """
+    Display one chat message
+    """
+    with st.chat_message("AI" if isinstance(message, AIMessage) else "Human"):
+        if isinstance(message, AIMessage) and ("🚫" in message.content or "⏱️" in message.content):
+            st.error(message.content)
+        else:
+            st.write(message.content)
+
+def answer_question(question, chat_history, vectordb, db_path=None):
+    """
+    Answer a question in the chat area, with its sources on the sidebar
+
+    Parameters:
+    - question (str): The user's question
+    - chat_history (list): Previous chat messages (without the question)
+    - vectordb: Vector database used for context retrieval
+    - db_path (str, optional): Folder of the vector database (e.g. of the selected corpus). Defaults to VECTOR_DB_PATH
+
+    Returns:
+    - response (str): The answer that was displayed
+    - prompt_tokens (dict): Estimated tokens sent for the history, the context and the question (None for a cached answer)
+    """
+    if config.STREAM_RESPONSES:
+        cached, cache_key = find_cached_answer(question, chat_history, vectordb, db_path)
+        if cached is not None:
+            # Answered before: no retrieval and no LLM call
+            show_sources(cached.context)
+            display_message(AIMessage(content=cached.answer))
+            return cached.answer, None
+        # Sources are shown as soon as retrieval is done, then the answer is written as it arrives
+        stream = ResponseStream(question, chat_history, vectordb, db_path=db_path)
+        show_sources(stream.retrieve())
+        with st.chat_message("AI"):
+            response = st.write_stream(stream.tokens())
+        # A cancelled or timed out answer is partial (or empty): only complete answers are reused
+        if stream.completed:
+            remember_answer(cache_key, stream.answer, stream.context)
+        return response, stream.prompt_tokens
+    # Show spinner
+    with st.spinner("🤔 Thinking..."):
+        # Generate response based on user's query, chat history and vectorstore
+        response, context = get_response(question, chat_history, vectordb, db_path)
+    show_sources(context)
+    display_message(AIMessage(content=response))
+    prompt_tokens = {
+        "history": sum(message_tokens(message) for message in chat_history),
+        "context": sum(count_tokens(doc.page_content) for doc in context),
+        "question": count_tokens(question),
+    }
+    return response, prompt_tokens
+
+def chat(chat_history, vectordb, history_manager=None, db_path=None):
     """
     Handle the chat functionality of the application
 
     Parameters:
     - chat_history (list): List of previous chat messages
     - vectordb: Vector database used for context retrieval
+    - history_manager (ChatHistoryManager, optional): Chooses the part of the history sent with the question
+      (a summary plus the recent turns). Defaults to a new manager, which sends the recent turns that fit in the budget
+    - db_path (str, optional): Folder of the vector database (e.g. of the selected corpus). Defaults to VECTOR_DB_PATH
 
     Returns:
     - chat_history: Updated chat history
     """
+    if history_manager is None:
+        history_manager = ChatHistoryManager()
     user_query = st.chat_input("Ask a question:")
+    # Display chat history (all previous messages)
+    for message in chat_history:
+        display_message(message)
+
     if user_query is not None and user_query != "":
         # Add user message to history immediately (so it doesn't disappear)
         chat_history = chat_history + [HumanMessage(content=user_query)]
+        display_message(chat_history[-1])
         
         # Try to generate response with error handling
         try:
-            # Show spinner
-            with st.spinner("🤔 Thinking... (max 30 seconds)"):
-                # Generate response based on user's query, chat history and vectorstore
-                response, context = get_response(user_query, chat_history[:-1], vectordb)  # Exclude just-added user message
-            
-            # Add AI response to history
+            # The whole turn is timed (and profiled when PROFILE_DIR is set), retrieval and LLM call as child spans
+            with metrics.profile("chat_turn"), metrics.span("chat_turn", streaming=config.STREAM_RESPONSES):
+                # Only a summary and the recent turns are sent, so the prompt does not grow with the conversation
+                prompt_history = history_manager.prompt_messages(chat_history[:-1])  # Exclude just-added user message
+                response, prompt_tokens = answer_question(user_query, prompt_history, vectordb, db_path)
+            history_manager.record_turn(prompt_tokens)
+
+            # Add AI response to history, and fold the oldest turns into the summary once they outgrow the budget
             chat_history = chat_history + [AIMessage(content=response)]
-            
-            # Display source of the response on sidebar
-            with st.sidebar:
-                st.subheader("📚 Sources")
-                metadata_dict = defaultdict(list)
-                for metadata in [doc.metadata for doc in context]:
-                    metadata_dict[metadata['source']].append(metadata['page'])
-                for source, pages in metadata_dict.items():
-                    st.write(f"**{source}**")
-                    st.write(f"Pages: {', '.join(map(str, sorted(set(pages))))}")
+            history_manager.after_turn(chat_history)
                     
         except Exception as e:
-            error_msg = str(e)
-            
-            # Check if it's a quota error
-            if "quota" in error_msg.lower() or "429" in error_msg or "exceeded" in error_msg.lower() or "timeout" in error_msg.lower():
-                error_response = """
-                **🚫 Quota Limit Reached or Request Timed Out**
-                
-                Your free tier quota has been exceeded, or the request timed out. Chat generation also requires API calls.
-                
-                **Options:**
-                1. **Wait 24 hours** for quota reset
-                2. **Upgrade to paid tier** at https://ai.google.dev/pricing
-                
-                Your documents are already processed and ready - once quota resets, you can chat immediately!
-                """
-            else:
-                error_response = f"**Error generating response:** {error_msg}"
-            
             # Add error message to chat history
-            chat_history = chat_history + [AIMessage(content=error_response)]
-    
-    # Display chat history (all previous messages) - this is the only place messages are displayed
-    for message in chat_history:
-        with st.chat_message("AI" if isinstance(message, AIMessage) else "Human"):
-            if isinstance(message, AIMessage) and ("🚫" in message.content or "⏱️" in message.content):
-                st.error(message.content)
-            else:
-                st.write(message.content)
+            chat_history = chat_history + [AIMessage(content=error_response_for(str(e)))]
+            display_message(chat_history[-1])
     
-    return chat_history
\ No newline at end of file
+    return chat_history
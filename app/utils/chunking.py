@@ -0,0 +1,289 @@
+"""
+Token-aware chunking and near-duplicate elimination.
+
+Chunks are sized in tokens, within the input limit of the embedding model, instead of characters.
+Before chunking, lines repeated at the top or bottom of most pages of a file (running headers and footers)
+are removed. After chunking, duplicate chunks of a file are embedded once: exact duplicates are found
+by hashing the normalized text, near duplicates by comparing 64-bit SimHash signatures (a few differing
+bits = almost the same words). The chunk that is kept lists the source and page of the ones dropped in
+its "aliases" metadata, a JSON string since vector stores only accept scalar metadata values.
+"""
+import re
+import json
+import hashlib
+from collections import Counter
+import numpy as np
+from utils import config
+
+# Word pieces of at most 4 characters and single punctuation marks: a slight over-estimate of the
+# number of SentencePiece tokens for English text, which is the safe side for a hard input limit
+_TOKEN_PATTERN = re.compile(r"\w{1,4}|[^\w\s]")
+_WORD_PATTERN = re.compile(r"\w+")
+_DIGIT_PATTERN = re.compile(r"\d")
+# Lines looked at on each side of a page when searching for running headers and footers, and the
+# longest line (in characters) that can be one
+BOILERPLATE_EDGE_LINES = 3
+BOILERPLATE_MAX_CHARS = 120
+# Fewest words for a SimHash signature to be meaningful (shorter chunks are only deduplicated exactly)
+SIMHASH_MIN_WORDS = 8
+
+
+def count_tokens(text):
+    """
+    Estimate the number of tokens of a text for the embedding model
+
+    Parameters:
+    - text (str): Text to measure
+
+    Returns:
+    - int: Estimated token count
+    """
+    return len(_TOKEN_PATTERN.findall(text))
+
+
+def chunk_token_budget():
+    """
+    Tokens per chunk: CHUNK_TOKENS, capped below the input limit of the embedding model
+    (with a margin, since token counts are estimates)
+    """
+    return max(1, min(config.CHUNK_TOKENS, int(config.EMBEDDING_TOKEN_LIMIT * 0.9)))
+
+
+def _normalize_line(line):
+    # Page numbers and dates change from page to page: digits are ignored when comparing lines
+    return re.sub(r"\d+", "#", " ".join(line.split()).lower())
+
+
+def strip_boilerplate(pages, min_pages=3, min_share=0.5):
+    """
+    Remove running headers and footers: lines found at the top or bottom of most pages of a file.
+    They are kept on the first page where they appear. The pages are read twice and only their edge lines are kept
+    in between, so pages read lazily (e.g. from the page text cache) are never all held at once
+
+    Parameters:
+    - pages (sequence): Documents of one file, one per page
+    - min_pages (int, optional): Fewest pages a line must appear on. Defaults to 3
+    - min_share (float, optional): Smallest share of the pages a line must appear on. Defaults to 0.5
+
+    Returns:
+    - iterable: The pages, with the repeated lines removed (generated one at a time when there are some)
+    """
+    if len(pages) < min_pages:
+        return pages
+    edges = []
+    counts = Counter()
+    for page in pages:
+        lines = page.page_content.splitlines()
+        non_empty = [i for i, line in enumerate(lines) if line.strip()]
+        edge = {i: _normalize_line(lines[i]) for i in non_empty[:BOILERPLATE_EDGE_LINES] + non_empty[-BOILERPLATE_EDGE_LINES:] if len(lines[i].strip()) <= BOILERPLATE_MAX_CHARS}
+        edges.append(edge)
+        counts.update(set(edge.values()))
+    threshold = max(min_pages, min_share * len(pages))
+    repeated = {line for line, count in counts.items() if count >= threshold and line}
+    if not repeated:
+        return pages
+    return _strip_lines(pages, edges, repeated)
+
+
+def _strip_lines(pages, edges, repeated):
+    seen = set()
+    for page, edge in zip(pages, edges):
+        kept = []
+        for i, line in enumerate(page.page_content.splitlines()):
+            normalized = edge.get(i)
+            if normalized in repeated:
+                if normalized in seen:
+                    continue
+                seen.add(normalized)
+            kept.append(line)
+        yield type(page)(page_content="\n".join(kept), metadata=dict(page.metadata))
+
+
+def split_documents(docs, chunk_tokens=None, overlap_tokens=None):
+    """
+    Split pages into chunks of at most `chunk_tokens` estimated tokens
+
+    Parameters:
+    - docs (iterable): Documents to split (read once, in order)
+    - chunk_tokens (int, optional): Token budget per chunk. Defaults to chunk_token_budget()
+    - overlap_tokens (int, optional): Tokens shared by consecutive chunks. Defaults to CHUNK_OVERLAP_TOKENS from the config
+
+    Returns:
+    - list: Chunks, with the metadata of their page
+    """
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    chunk_tokens = chunk_tokens or chunk_token_budget()
+    overlap_tokens = config.CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_tokens,
+        chunk_overlap=min(overlap_tokens, chunk_tokens // 2),
+        length_function=count_tokens,
+        separators=["\n\n", "\n", ". ", " ", ""],
+    )
+    chunks = []
+    for doc in docs:
+        text = doc.page_content.strip()
+        if not text:
+            continue
+        if count_tokens(text) <= chunk_tokens:
+            # Most pages fit in one chunk: no need to run the splitter, which measures every piece
+            chunks.append(type(doc)(page_content=text, metadata=dict(doc.metadata)))
+        else:
+            chunks.extend(text_splitter.split_documents([doc]))
+    return chunks
+
+
+def normalize_text(text):
+    """
+    Lowercase words only, so that spacing, punctuation and case do not make two chunks different
+    """
+    return " ".join(_WORD_PATTERN.findall(text.lower()))
+
+
+def simhash(text, shingle_size=3):
+    """
+    64-bit SimHash of the word shingles of a (normalized) text. Similar texts get signatures
+    that differ in few bits. Signatures are the same in every process and run
+
+    Parameters:
+    - text (str): Normalized text
+    - shingle_size (int, optional): Words per shingle. Defaults to 3
+
+    Returns:
+    - int or None: The signature, or None if the text is too short to compare reliably
+    """
+    words = text.split()
+    if len(words) < SIMHASH_MIN_WORDS:
+        return None
+    shingles = {" ".join(words[i:i + shingle_size]) for i in range(len(words) - shingle_size + 1)}
+    # Not Python's hash(): it is salted per process, so which chunks are dropped as near duplicates (and so the text
+    # behind each positional chunk ID) would change between runs and between worker processes
+    digests = b"".join(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest() for shingle in shingles)
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8)).reshape(-1, 64)
+    # Each bit of the signature is the majority vote of that bit over the shingle hashes
+    majority = bits.sum(axis=0) * 2 > len(shingles)
+    return int.from_bytes(np.packbits(majority).tobytes(), "big")
+
+
+class DuplicateIndex:
+    """
+    Finds exact and near duplicates among texts added one by one. Near duplicates (SimHash signatures at most
+    `max_distance` bits apart) are looked up by bands: split into max_distance + 1 bands, two such signatures
+    share at least one band exactly, so only texts sharing a band are compared.
+    Texts that differ in a word containing digits (part numbers, error codes, values) are never near
+    duplicates, so pages that only differ by such identifiers all stay searchable
+    """
+
+    def __init__(self, max_distance=3):
+        self.max_distance = max_distance
+        self.bands = max_distance + 1 if max_distance >= 0 else 0
+        self.band_bits = 64 // self.bands if self.bands else 0
+        self._exact = {}
+        self._buckets = {}
+
+    def _band_keys(self, signature):
+        mask = (1 << self.band_bits) - 1
+        return [(band, (signature >> (band * self.band_bits)) & mask) for band in range(self.bands)]
+
+    def find(self, text):
+        """
+        Return the item that `text` duplicates (None if it is new), and what add() needs to index it
+        """
+        normalized = normalize_text(text)
+        digest = hashlib.sha1(normalized.encode("utf-8")).digest()
+        if digest in self._exact:
+            return self._exact[digest], (digest, None, None)
+        signature = simhash(normalized) if self.bands else None
+        identifiers = frozenset(word for word in normalized.split() if _DIGIT_PATTERN.search(word))
+        if signature is not None:
+            for key in self._band_keys(signature):
+                for item, other, other_identifiers in self._buckets.get(key, ()):
+                    if other_identifiers == identifiers and bin(signature ^ other).count("1") <= self.max_distance:
+                        return item, (digest, signature, identifiers)
+        return None, (digest, signature, identifiers)
+
+    def add(self, item, fingerprint):
+        digest, signature, identifiers = fingerprint
+        self._exact.setdefault(digest, item)
+        if signature is not None:
+            for key in self._band_keys(signature):
+                self._buckets.setdefault(key, []).append((item, signature, identifiers))
+
+
+def _alias_of(metadata):
+    return {key: metadata[key] for key in ("source", "page") if key in metadata}
+
+
+def get_aliases(metadata):
+    """
+    Source/page locations recorded in the "aliases" metadata of a chunk (empty if there are none)
+    """
+    try:
+        return json.loads(metadata.get("aliases") or "[]")
+    except (TypeError, ValueError):
+        return []
+
+
+def _add_aliases(doc, aliases):
+    own = _alias_of(doc.metadata)
+    merged = get_aliases(doc.metadata)
+    for alias in aliases:
+        if alias != own and alias not in merged:
+            merged.append(alias)
+    if merged:
+        doc.metadata["aliases"] = json.dumps(merged)
+
+
+def dedupe_chunks(chunks, max_distance=None):
+    """
+    Drop exact and near-duplicate chunks, keeping the first of each group. The source and page of the
+    dropped chunks (and of their own aliases) are added to the "aliases" metadata of the kept one
+
+    Parameters:
+    - chunks (list): Chunks of one file, in reading order
+    - max_distance (int, optional): Most SimHash bits two near duplicates may differ by (-1 for exact duplicates only).
+      Defaults to DEDUP_MAX_DISTANCE from the config
+
+    Returns:
+    - list: The chunks that are kept
+    """
+    max_distance = config.DEDUP_MAX_DISTANCE if max_distance is None else max_distance
+    index = DuplicateIndex(max_distance)
+    kept = []
+    for chunk in chunks:
+        original, fingerprint = index.find(chunk.page_content)
+        if original is None:
+            index.add(len(kept), fingerprint)
+            kept.append(chunk)
+        else:
+            _add_aliases(kept[original], [_alias_of(chunk.metadata)] + get_aliases(chunk.metadata))
+    return kept
+
+
+def collapse_duplicates(docs, k=None, max_distance=None):
+    """
+    Collapse near-duplicate retrieved documents (e.g. the same notice found in several files) into the best
+    ranked one, which lists the others as aliases. Documents are processed in rank order until `k` are kept
+
+    Parameters:
+    - docs (list): Retrieved documents, best first
+    - k (int, optional): Number of documents wanted. Defaults to all
+    - max_distance (int, optional): As in dedupe_chunks. Defaults to DEDUP_MAX_DISTANCE from the config
+
+    Returns:
+    - list: At most `k` distinct documents
+    """
+    max_distance = config.DEDUP_MAX_DISTANCE if max_distance is None else max_distance
+    index = DuplicateIndex(max_distance)
+    kept = []
+    for doc in docs:
+        original, fingerprint = index.find(doc.page_content)
+        if original is None:
+            if k is not None and len(kept) >= k:
+                break
+            index.add(len(kept), fingerprint)
+            # Copied, so that adding aliases does not change documents cached elsewhere
+            kept.append(type(doc)(page_content=doc.page_content, metadata=dict(doc.metadata)))
+        else:
+            _add_aliases(kept[original], [_alias_of(doc.metadata)] + get_aliases(doc.metadata))
+    return kept
@@ -0,0 +1,172 @@
+"""
+Central configuration for the app.
+Every value can be overridden with an environment variable (or in the .env file at the project root).
+"""
+import os
+from dotenv import load_dotenv
+
+# Load .env from project root, and also from the current directory as fallback
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+load_dotenv(dotenv_path=os.path.join(project_root, '.env'))
+load_dotenv()
+
+
+def _env_int(name, default):
+    """
+    Read an integer setting from the environment, falling back to the default when unset or invalid
+    """
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_float(name, default):
+    """
+    Read a decimal setting from the environment, falling back to the default when unset or invalid
+    """
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+# Embedding model used for documents and queries
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "models/text-embedding-004")
+
+# Folder where the persistent caches live (kept apart from the vector DB so they survive a rebuild)
+CACHE_DIR = os.getenv("CACHE_DIR", "Cache")
+
+# On-disk embedding cache (set EMBEDDING_CACHE_MAX_ENTRIES=0 to disable it)
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(CACHE_DIR, "embeddings.sqlite3"))
+EMBEDDING_CACHE_MAX_ENTRIES = _env_int("EMBEDDING_CACHE_MAX_ENTRIES", 200000)
+
+# On-disk cache of the text extracted from each PDF, keyed by content hash (set PAGE_TEXT_CACHE_MAX_MB=0 to disable it)
+PAGE_TEXT_CACHE_DIR = os.getenv("PAGE_TEXT_CACHE_DIR", os.path.join(CACHE_DIR, "page_text"))
+PAGE_TEXT_CACHE_MAX_MB = _env_int("PAGE_TEXT_CACHE_MAX_MB", 1024)
+
+# In-memory LRU of query embeddings, shared by every session of the process (0 disables it)
+QUERY_EMBEDDING_CACHE_SIZE = _env_int("QUERY_EMBEDDING_CACHE_SIZE", 5000)
+
+# Embedding API scheduling: parallel batch calls, quota limits (0 disables a limit) and retries
+EMBEDDING_BATCH_SIZE = _env_int("EMBEDDING_BATCH_SIZE", 100)  # Gemini supports up to 100 texts per batch
+EMBEDDING_CONCURRENCY = _env_int("EMBEDDING_CONCURRENCY", 4)
+EMBEDDING_RPM = _env_int("EMBEDDING_RPM", 1500)
+EMBEDDING_TPM = _env_int("EMBEDDING_TPM", 1000000)
+EMBEDDING_MAX_RETRIES = _env_int("EMBEDDING_MAX_RETRIES", 5)
+
+# Chat model and retrieval settings
+CHAT_MODEL = os.getenv("CHAT_MODEL", "gemini-2.5-flash")
+CHAT_TEMPERATURE = _env_float("CHAT_TEMPERATURE", 0.2)
+RETRIEVAL_K = _env_int("RETRIEVAL_K", 5)
+
+# Chat history sent with each question: at most HISTORY_TOKEN_BUDGET tokens, made of a summary of the older turns
+# (kept under HISTORY_SUMMARY_TOKENS) and the recent turns verbatim, always at least HISTORY_MIN_RECENT_TURNS of them
+HISTORY_TOKEN_BUDGET = _env_int("HISTORY_TOKEN_BUDGET", 2000)
+HISTORY_SUMMARY_TOKENS = _env_int("HISTORY_SUMMARY_TOKENS", 400)
+HISTORY_MIN_RECENT_TURNS = _env_int("HISTORY_MIN_RECENT_TURNS", 2)
+
+# Hybrid retrieval: vector and BM25 keyword results (RETRIEVAL_FETCH_K of each) fused with reciprocal rank fusion.
+# Set HYBRID_RETRIEVAL=0 to use vector similarity only
+HYBRID_RETRIEVAL = os.getenv("HYBRID_RETRIEVAL", "1") != "0"
+RETRIEVAL_FETCH_K = _env_int("RETRIEVAL_FETCH_K", 20)
+
+# Context compression (see context_compression.py): CONTEXT_CANDIDATES chunks are retrieved, reranked locally and
+# diversified down to RETRIEVAL_K, keeping only their passages relevant to the question, within CONTEXT_TOKEN_BUDGET
+# tokens in all. CONTEXT_MMR_LAMBDA trades relevance (1) for diversity (0). Set CONTEXT_COMPRESSION=0 to send whole chunks
+CONTEXT_COMPRESSION = os.getenv("CONTEXT_COMPRESSION", "1") != "0"
+CONTEXT_CANDIDATES = _env_int("CONTEXT_CANDIDATES", 20)
+CONTEXT_TOKEN_BUDGET = _env_int("CONTEXT_TOKEN_BUDGET", 1500)
+CONTEXT_MMR_LAMBDA = _env_float("CONTEXT_MMR_LAMBDA", 0.7)
+
+# Answers are streamed token by token (set STREAM_RESPONSES=0 to wait for the whole answer).
+# A request is cancelled when the first token, or the next one, takes longer than these deadlines (seconds)
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "1") != "0"
+FIRST_TOKEN_TIMEOUT = _env_float("FIRST_TOKEN_TIMEOUT", 30)
+TOKEN_IDLE_TIMEOUT = _env_float("TOKEN_IDLE_TIMEOUT", 30)
+
+# Semantic answer cache (answer_cache.py): a question whose embedding is within ANSWER_CACHE_THRESHOLD (cosine) of one
+# answered before on the same corpus, with the same documents and settings, gets the stored answer and sources. Entries
+# expire after ANSWER_CACHE_TTL seconds; at most ANSWER_CACHE_MAX_ENTRIES are kept (0 disables the cache)
+ANSWER_CACHE_MAX_ENTRIES = _env_int("ANSWER_CACHE_MAX_ENTRIES", 1000)
+ANSWER_CACHE_TTL = _env_int("ANSWER_CACHE_TTL", 3600)
+ANSWER_CACHE_THRESHOLD = _env_float("ANSWER_CACHE_THRESHOLD", 0.95)
+
+# Batch question answering (batch_qa.py, ask.py): questions answered in parallel, chat calls kept under CHAT_RPM
+# requests/minute (0 disables the limit) and retried up to CHAT_MAX_RETRIES times on rate limit and transient errors
+BATCH_QA_CONCURRENCY = _env_int("BATCH_QA_CONCURRENCY", 4)
+CHAT_RPM = _env_int("CHAT_RPM", 60)
+CHAT_MAX_RETRIES = _env_int("CHAT_MAX_RETRIES", 3)
+
+# Vector store backend: "chroma", or "numpy" for the compact memory-mapped store of numpy_vectorstore.py
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma").lower()
+# Storage of the numpy backend, fixed when the store is created: "float16" or "int8" (quantized, 4x smaller than float32).
+# NUMPY_VECTOR_RESCORE=1 also keeps float32 copies on disk to rescore the best candidates (default: on for int8 only)
+NUMPY_VECTOR_DTYPE = os.getenv("NUMPY_VECTOR_DTYPE", "float16")
+NUMPY_VECTOR_RESCORE = {"1": True, "0": False}.get(os.getenv("NUMPY_VECTOR_RESCORE", ""))
+# HNSW index of the chroma backend (the numpy backend is an exact cosine scan). VECTOR_METRIC ("l2", "cosine" or "ip"),
+# HNSW_M (links per node) and HNSW_EF_CONSTRUCTION are fixed when a collection is created: to change them, export a
+# snapshot, delete the vector DB folder of the corpus and import it again (see snapshot.py, no embedding calls). HNSW_EF_SEARCH
+# (candidates explored per query, at least the k asked for) is applied to existing collections when the app starts. Higher values trade
+# latency (and memory and build time for M) for recall; measure them with python app/tune_index.py
+VECTOR_METRIC = os.getenv("VECTOR_METRIC", "l2").lower()
+HNSW_M = _env_int("HNSW_M", 16)
+HNSW_EF_CONSTRUCTION = _env_int("HNSW_EF_CONSTRUCTION", 100)
+HNSW_EF_SEARCH = _env_int("HNSW_EF_SEARCH", 100)
+
+# Folders for the uploaded PDFs and the persistent vector DB (each backend has its own, with its own registry)
+DOCS_PATH = os.getenv("DOCS_PATH", "docs")
+VECTOR_DB_PATH = os.getenv("VECTOR_DB_PATH", "Vector_DB - Numpy" if VECTOR_BACKEND == "numpy" else "Vector_DB - Documents")
+# Named corpora (e.g. one per team or project, see corpora.py): each has its own PDF folder under CORPORA_PATH and its
+# own vector DB under CORPORA_DB_PATH, so a search only touches its corpus. The "default" corpus is DOCS_PATH and
+# VECTOR_DB_PATH themselves. CORPORA_DB_PATH sits next to VECTOR_DB_PATH, not inside it, so deleting the default vector
+# DB (e.g. to rebuild it) leaves the other corpora alone. CORPUS is the corpus selected when the app starts
+CORPORA_PATH = os.getenv("CORPORA_PATH", "corpora")
+CORPORA_DB_PATH = os.getenv("CORPORA_DB_PATH", "Vector_DB - Numpy Corpora" if VECTOR_BACKEND == "numpy" else "Vector_DB - Corpora")
+CORPUS = os.getenv("CORPUS", "default")
+
+# Chunking, in estimated tokens (see chunking.py). Chunks stay below EMBEDDING_TOKEN_LIMIT, the input limit
+# of the embedding model (2048 tokens for text-embedding-004)
+EMBEDDING_TOKEN_LIMIT = _env_int("EMBEDDING_TOKEN_LIMIT", 2048)
+CHUNK_TOKENS = _env_int("CHUNK_TOKENS", 1800)
+CHUNK_OVERLAP_TOKENS = _env_int("CHUNK_OVERLAP_TOKENS", 180)
+# Running headers/footers are removed before chunking (STRIP_BOILERPLATE=0 keeps them), and chunks of a file whose
+# SimHash signatures differ by at most DEDUP_MAX_DISTANCE bits of 64 are embedded once (-1: exact duplicates only)
+STRIP_BOILERPLATE = os.getenv("STRIP_BOILERPLATE", "1") != "0"
+DEDUP_MAX_DISTANCE = _env_int("DEDUP_MAX_DISTANCE", 3)
+
+# Worker processes used to parse PDFs (1 parses them one by one in the app process)
+PDF_EXTRACT_WORKERS = _env_int("PDF_EXTRACT_WORKERS", min(os.cpu_count() or 1, 8))
+
+# Maximum number of chunks written to the vector DB in one call
+UPSERT_BATCH_SIZE = _env_int("UPSERT_BATCH_SIZE", 500)
+
+# Background ingestion (see ingest_jobs.py): uploaded files are queued in this SQLite file and ingested by a worker
+# thread of the app process. Queued and interrupted files are picked up again when the app restarts. While files are
+# processed, the page reruns every INGEST_POLL_SECONDS to update the sidebar progress (0: a refresh button instead)
+INGEST_QUEUE_PATH = os.getenv("INGEST_QUEUE_PATH", os.path.join(CACHE_DIR, "ingest_jobs.sqlite3"))
+INGEST_POLL_SECONDS = _env_float("INGEST_POLL_SECONDS", 2)
+
+# Instrumentation (see metrics.py). METRICS_LOG is "stderr" or a file for JSON span logs, METRICS_PROM_FILE
+# a Prometheus text file, METRICS_PORT serves /metrics over HTTP, and PROFILE_DIR enables cProfile per chat turn
+METRICS_LOG = os.getenv("METRICS_LOG", "")
+METRICS_PROM_FILE = os.getenv("METRICS_PROM_FILE", "")
+METRICS_PORT = _env_int("METRICS_PORT", 0)
+PROFILE_DIR = os.getenv("PROFILE_DIR", "")
+
+
+def ingest_params():
+    """
+    Parameters that determine the chunks and vectors produced for a file.
+    When any of them changes, files are re-ingested on the next sync
+    """
+    return {
+        "chunk_tokens": CHUNK_TOKENS,
+        "embedding_token_limit": EMBEDDING_TOKEN_LIMIT,
+        "chunk_overlap_tokens": CHUNK_OVERLAP_TOKENS,
+        "strip_boilerplate": STRIP_BOILERPLATE,
+        "dedup_max_distance": DEDUP_MAX_DISTANCE,
+        # Near duplicates used to be found with Python's salted hash(), so files deduplicated that way are chunked again
+        "dedup_hash": "blake2b",
+        "embedding_model": EMBEDDING_MODEL,
+    }
@@ -0,0 +1,224 @@
+"""
+Post-retrieval reranking and compression of the context sent to the LLM.
+
+The base retriever overfetches candidates, which are then:
+1. reranked with a cheap local scorer: BM25 of the question over the candidates themselves, blended with
+   the rank the base retriever gave them (so semantic matches without shared words are not lost);
+2. diversified with maximal marginal relevance (MMR), using the word overlap of the candidates, so that
+   several chunks saying the same thing don't take every slot;
+3. compressed: only the sentences (or short passages) of each chunk that share terms with the question are
+   kept, best first, until the whole context fits in a token budget.
+Everything runs locally in a few milliseconds: no model call, no embedding. The documents keep their
+metadata, so the sources shown for an answer are unchanged.
+"""
+import math
+import re
+from typing import Any, List
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from utils import metrics
+from utils.bm25_index import term_counts, tokenize
+from utils.chunking import count_tokens
+
+# Sentence ends, and blank lines between paragraphs
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+|\n\s*\n")
+# Longer "sentences" (tables, lists, text without punctuation) are cut at line ends into passages of about this size
+MAX_PASSAGE_TOKENS = 80
+# Shown between passages of a chunk that were not next to each other
+GAP_MARKER = " … "
+# Share of the rerank score given to the question's words, the rest to the rank from the base retriever
+LEXICAL_WEIGHT = 0.6
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def split_passages(text, max_tokens=MAX_PASSAGE_TOKENS):
+    """
+    Split a chunk into sentences, cutting longer ones at line ends
+
+    Parameters:
+    - text (str): Chunk text
+    - max_tokens (int, optional): Size above which a sentence is cut at line ends. Defaults to MAX_PASSAGE_TOKENS
+
+    Returns:
+    - list: Passages, in reading order
+    """
+    passages = []
+    for sentence in _SENTENCE_END.split(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        if count_tokens(sentence) <= max_tokens:
+            passages.append(" ".join(sentence.split()))
+            continue
+        current, size = [], 0
+        for line in sentence.splitlines():
+            line = " ".join(line.split())
+            if not line:
+                continue
+            tokens = count_tokens(line)
+            if current and size + tokens > max_tokens:
+                passages.append(" ".join(current))
+                current, size = [], 0
+            current.append(line)
+            size += tokens
+        if current:
+            passages.append(" ".join(current))
+    return passages
+
+
+def bm25_scores(query_terms, documents_counts):
+    """
+    BM25 score of each document, with the term statistics of the given documents only
+
+    Parameters:
+    - query_terms (set): Terms of the question
+    - documents_counts (list): Term counts of the documents (see bm25_index.term_counts)
+
+    Returns:
+    - list: Scores, in the order of the documents
+    """
+    n_docs = len(documents_counts)
+    if not n_docs or not query_terms:
+        return [0.0] * n_docs
+    lengths = [sum(c.values()) for c in documents_counts]
+    avg_length = sum(lengths) / n_docs or 1.0
+    idf = {}
+    for term in query_terms:
+        df = sum(1 for c in documents_counts if term in c)
+        idf[term] = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+    scores = []
+    for length, c in zip(lengths, documents_counts):
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+        scores.append(sum(idf[term] * c[term] * (BM25_K1 + 1) / (c[term] + norm) for term in query_terms if term in c))
+    return scores
+
+
+def _jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    common = len(a & b)
+    return common / (len(a) + len(b) - common)
+
+
+def mmr_select(relevance, term_sets, k, lambda_mult=0.7):
+    """
+    Choose `k` documents balancing relevance and novelty (maximal marginal relevance)
+
+    Parameters:
+    - relevance (list): Relevance of each candidate, in [0, 1]
+    - term_sets (list): Set of terms of each candidate (or dict keys view), to measure how similar two candidates are
+    - k (int): Number of documents to choose
+    - lambda_mult (float, optional): 1 ranks by relevance only, 0 by novelty only. Defaults to 0.7
+
+    Returns:
+    - list: Indexes of the chosen candidates, in the order they were chosen
+    """
+    remaining = list(range(len(relevance)))
+    chosen = []
+    while remaining and len(chosen) < k:
+        best = max(remaining, key=lambda i: lambda_mult * relevance[i] - (1 - lambda_mult) * max((_jaccard(term_sets[i], term_sets[j]) for j in chosen), default=0.0))
+        chosen.append(best)
+        remaining.remove(best)
+    return chosen
+
+
+def compress_documents(query, docs, k, token_budget, lambda_mult=0.7):
+    """
+    Rerank, diversify and compress retrieved documents
+
+    Parameters:
+    - query (str): The question
+    - docs (list): Candidate documents, best first
+    - k (int): Most documents returned
+    - token_budget (int): Most estimated tokens of context, over all the returned documents (0: no compression)
+    - lambda_mult (float, optional): MMR trade-off between relevance and diversity. Defaults to 0.7
+
+    Returns:
+    - list: At most `k` documents, best first, with the passages relevant to the question and the metadata of the originals
+    """
+    if not docs:
+        return []
+    query_terms = set(tokenize(query))
+    doc_counts = [term_counts(doc.page_content) for doc in docs]
+
+    # 1. Rerank: the question's words in the candidate, blended with the rank from the base retriever
+    lexical = bm25_scores(query_terms, doc_counts)
+    top = max(lexical) or 1.0
+    relevance = [
+        LEXICAL_WEIGHT * score / top + (1 - LEXICAL_WEIGHT) * (1 - rank / len(docs))
+        for rank, score in enumerate(lexical)
+    ]
+    # 2. Diversify
+    chosen = mmr_select(relevance, [c.keys() for c in doc_counts], k, lambda_mult)
+    if token_budget <= 0:
+        return [docs[i] for i in chosen]
+
+    # 3. Compress: score every passage of the chosen documents against the question
+    passages = []
+    for i in chosen:
+        texts = split_passages(docs[i].page_content)
+        passages.append((texts, bm25_scores(query_terms, [term_counts(text) for text in texts])))
+    selected = [set() for _ in chosen]
+    used = 0
+
+    def take(slot, index):
+        nonlocal used
+        tokens = count_tokens(passages[slot][0][index])
+        if index in selected[slot] or used + tokens > token_budget:
+            return False
+        selected[slot].add(index)
+        used += tokens
+        return True
+
+    # Every chosen document first gets its best passage (its first one when no word of the question matches),
+    # then the remaining budget goes to the best matching passages overall, better ranked documents first on ties
+    for slot, (texts, scores) in enumerate(passages):
+        if texts:
+            take(slot, max(range(len(texts)), key=lambda j: (scores[j], -j)))
+    ranked = sorted(
+        ((score, -slot, -j, slot, j) for slot, (_, scores) in enumerate(passages) for j, score in enumerate(scores) if score > 0),
+        reverse=True,
+    )
+    for *_, slot, j in ranked:
+        take(slot, j)
+
+    compressed = []
+    for slot, i in enumerate(chosen):
+        if not selected[slot]:
+            # Out of budget before this document got a passage
+            continue
+        texts = passages[slot][0]
+        parts = []
+        previous = None
+        for j in sorted(selected[slot]):
+            if previous is not None and j != previous + 1:
+                parts.append(GAP_MARKER)
+            elif previous is not None:
+                parts.append(" ")
+            parts.append(texts[j])
+            previous = j
+        # The metadata is copied whole: source, page and aliases are what the sources sidebar shows
+        compressed.append(Document(page_content="".join(parts), metadata=dict(docs[i].metadata)))
+    return compressed
+
+
+class CompressingRetriever(BaseRetriever):
+    """
+    Wraps a retriever that returns many candidates (e.g. the hybrid retriever with k=CONTEXT_CANDIDATES) and
+    returns the best `k` of them, diversified and cut down to the passages relevant to the question, within
+    `token_budget` tokens. It is a regular LangChain retriever, so it drops into the retrieval chain as is
+    """
+
+    base_retriever: Any
+    k: int = 5
+    token_budget: int = 1500
+    lambda_mult: float = 0.7
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        candidates = self.base_retriever.invoke(query)
+        with metrics.span("context_compression", candidates=len(candidates)) as span:
+            docs = compress_documents(query, candidates, self.k, self.token_budget, self.lambda_mult)
+            span.set(documents=len(docs), chars_in=sum(len(doc.page_content) for doc in candidates), chars_out=sum(len(doc.page_content) for doc in docs))
+        return docs
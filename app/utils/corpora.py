@@ -0,0 +1,114 @@
+"""
+Named corpora: separate document sets (per team, per project, ...) searched independently.
+
+Each corpus has its own PDF folder and its own vector DB folder, with its own collection, document registry
+and BM25 index, so a search only touches the chunks of its corpus: it stays as fast on a small corpus as if
+the others did not exist, however many chunks they hold. The "default" corpus is the DOCS_PATH and
+VECTOR_DB_PATH folders the app always used, so existing installations keep their documents. The vector DBs of
+the other corpora live under CORPORA_DB_PATH, a sibling of VECTOR_DB_PATH, so removing one never removes another.
+"""
+import os
+import re
+from utils import config
+
+DEFAULT_CORPUS = "default"
+# Corpus names become folder names: letters, digits, spaces, dots, dashes and underscores only
+_NAME_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9 ._-]{0,63}$")
+
+
+def list_docs(docs_path):
+    """
+    Names of the files in a docs folder (empty if it does not exist yet). Hidden files are left out: uploads
+    are written under a hidden name until they are complete (see save_docs.py)
+    """
+    if not os.path.isdir(docs_path):
+        return []
+    return sorted(
+        name for name in os.listdir(docs_path)
+        if not name.startswith(".") and os.path.isfile(os.path.join(docs_path, name))
+    )
+
+
+class Corpus:
+    """
+    Name and folders of a corpus
+    """
+
+    def __init__(self, name=None):
+        """
+        Parameters:
+        - name (str, optional): Corpus name. Defaults to CORPUS from the config
+
+        Raises:
+        - ValueError: If the name can't be used as a folder name
+        """
+        name = (name or config.CORPUS).strip()
+        if not _NAME_PATTERN.match(name) or name.endswith("."):
+            raise ValueError(f"Invalid corpus name: {name!r} (use letters, digits, spaces, '.', '-' and '_')")
+        self.name = name
+
+    @property
+    def docs_path(self):
+        """
+        Folder of the corpus PDFs
+        """
+        if self.name == DEFAULT_CORPUS:
+            return config.DOCS_PATH
+        return os.path.join(config.CORPORA_PATH, self.name)
+
+    @property
+    def db_path(self):
+        """
+        Vector DB folder of the corpus (collection, registry and BM25 index)
+        """
+        if self.name == DEFAULT_CORPUS:
+            return config.VECTOR_DB_PATH
+        return os.path.join(config.CORPORA_DB_PATH, self.name)
+
+    def pdfs(self):
+        """
+        Names of the files in the corpus folder (empty if it does not exist yet)
+        """
+        return list_docs(self.docs_path)
+
+    def __eq__(self, other):
+        return isinstance(other, Corpus) and other.name == self.name
+
+    def __hash__(self):
+        return hash(self.name)
+
+    def __repr__(self):
+        return f"Corpus({self.name!r})"
+
+
+def list_corpora():
+    """
+    Names of the existing corpora: the default one, then every folder of CORPORA_PATH
+
+    Returns:
+    - list: Corpus names, the default one first
+    """
+    names = [DEFAULT_CORPUS]
+    if os.path.isdir(config.CORPORA_PATH):
+        for name in sorted(os.listdir(config.CORPORA_PATH)):
+            if name != DEFAULT_CORPUS and os.path.isdir(os.path.join(config.CORPORA_PATH, name)) and _NAME_PATTERN.match(name):
+                names.append(name)
+    return names
+
+
+def create_corpus(name):
+    """
+    Create the folders of a corpus (nothing happens if it exists)
+
+    Parameters:
+    - name (str): Corpus name
+
+    Returns:
+    - Corpus: The corpus
+
+    Raises:
+    - ValueError: If the name can't be used as a folder name
+    """
+    corpus = Corpus(name)
+    os.makedirs(corpus.docs_path, exist_ok=True)
+    return corpus
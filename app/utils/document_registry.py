@@ -0,0 +1,255 @@
+"""
+Registry of the documents ingested in the vector DB.
+A small SQLite database stored inside the vector DB folder records, for every ingested PDF, the content hash,
+the IDs of its chunks and the ingest parameters used. It answers "which sources are ingested, with how many
+chunks, at which hash" without reading the collection, and drives the incremental sync: new files are added,
+changed files have their chunks replaced and removed files have their chunks deleted.
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+REGISTRY_FILENAME = "registry.sqlite3"
+# JSON manifest used by earlier versions, imported into the registry on first open
+LEGACY_MANIFEST_FILENAME = "manifest.json"
+
+
+def file_content_hash(path, block_size=1024 * 1024):
+    """
+    Compute the SHA-256 of a file without loading it all in memory
+
+    Parameters:
+    - path (str): Path of the file
+    - block_size (int, optional): Bytes read per iteration. Defaults to 1 MiB
+
+    Returns:
+    - str: Hex digest of the file content
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def params_fingerprint(params):
+    """
+    Return a short, stable fingerprint of a dictionary of ingest parameters
+    """
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def make_chunk_ids(source, content_hash, params, count):
+    """
+    Build stable chunk IDs for a file. The same file content ingested with the same parameters
+    always gets the same IDs, so re-ingesting is idempotent
+
+    Parameters:
+    - source (str): File name of the document
+    - content_hash (str): Hash of the file content
+    - params (dict): Ingest parameters
+    - count (int): Number of chunks
+
+    Returns:
+    - list: One ID per chunk
+    """
+    prefix = hashlib.sha256(f"{source}\x00{content_hash}\x00{params_fingerprint(params)}".encode("utf-8")).hexdigest()[:24]
+    return [f"{prefix}-{i}" for i in range(count)]
+
+
+class DocumentRegistry:
+    """
+    SQLite-backed index of the ingested documents and their chunk IDs.
+    Every change is committed immediately, so an interrupted ingest resumes where it stopped
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS documents (
+                source TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                chunk_count INTEGER NOT NULL,
+                params TEXT NOT NULL,
+                file_size INTEGER,
+                file_mtime REAL,
+                ingested_at REAL NOT NULL,
+                path TEXT
+            );
+            CREATE TABLE IF NOT EXISTS chunks (
+                chunk_id TEXT PRIMARY KEY,
+                source TEXT NOT NULL,
+                position INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS chunks_source ON chunks(source);
+            CREATE INDEX IF NOT EXISTS documents_hash ON documents(content_hash);
+            """
+        )
+        # Registries created before file paths were recorded get the column added
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(documents)")]
+        if "path" not in columns:
+            self._conn.execute("ALTER TABLE documents ADD COLUMN path TEXT")
+        self._conn.commit()
+
+    @classmethod
+    def load(cls, db_path):
+        """
+        Open the registry of a vector DB folder, importing the old JSON manifest if there is one
+        """
+        registry = cls(os.path.join(db_path, REGISTRY_FILENAME))
+        manifest_path = os.path.join(db_path, LEGACY_MANIFEST_FILENAME)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                entries = json.load(f).get("files", {})
+            for source, entry in entries.items():
+                registry.record(source, entry["hash"], entry["chunk_ids"], entry["params"])
+            os.remove(manifest_path)
+        return registry
+
+    def is_empty(self):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM documents LIMIT 1").fetchone() is None
+
+    def get(self, source):
+        """
+        Return the entry of a document (hash, chunk IDs, params, ...) or None if it was never ingested
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content_hash, chunk_count, params, file_size, file_mtime, ingested_at FROM documents WHERE source = ?",
+                (source,),
+            ).fetchone()
+            if row is None:
+                return None
+            chunk_ids = [r[0] for r in self._conn.execute(
+                "SELECT chunk_id FROM chunks WHERE source = ? ORDER BY position", (source,)
+            )]
+        return {
+            "hash": row[0],
+            "chunk_count": row[1],
+            "params": json.loads(row[2]),
+            "file_size": row[3],
+            "file_mtime": row[4],
+            "ingested_at": row[5],
+            "chunk_ids": chunk_ids,
+        }
+
+    def sources(self):
+        """
+        Summary of every ingested document, without touching the chunk table
+
+        Returns:
+        - dict: {source: {"hash": ..., "chunk_count": ..., "ingested_at": ...}}
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT source, content_hash, chunk_count, ingested_at FROM documents").fetchall()
+        return {source: {"hash": h, "chunk_count": count, "ingested_at": at} for source, h, count, at in rows}
+
+    def sources_with_hash(self, content_hash):
+        """
+        Names of the ingested documents with this content (e.g. to skip an upload of a file already ingested under another name)
+        """
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                "SELECT source FROM documents WHERE content_hash = ? ORDER BY source", (content_hash,)
+            )]
+
+    def all_chunk_ids(self):
+        """
+        Return the IDs of every registered chunk
+        """
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT chunk_id FROM chunks")]
+
+    def record(self, source, content_hash, chunk_ids, params, file_size=None, file_mtime=None, path=None):
+        """
+        Register (or replace) the chunks of a document. `path` is where the file was read from, used
+        to notice when it is deleted (files without one are looked up in the docs folder)
+        """
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM chunks WHERE source = ?", (source,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO documents (source, content_hash, chunk_count, params, file_size, file_mtime, ingested_at, path)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (source, content_hash, len(chunk_ids), json.dumps(params, sort_keys=True), file_size, file_mtime, time.time(), path),
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks (chunk_id, source, position) VALUES (?, ?, ?)",
+                [(chunk_id, source, i) for i, chunk_id in enumerate(chunk_ids)],
+            )
+
+    def update_file_stat(self, source, file_size, file_mtime):
+        """
+        Remember the size and modification time of a file whose content did not change
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE documents SET file_size = ?, file_mtime = ? WHERE source = ?", (file_size, file_mtime, source)
+            )
+
+    def remove(self, source):
+        """
+        Unregister a document and return its previous entry (None if it was not registered)
+        """
+        entry = self.get(source)
+        if entry is not None:
+            with self._lock, self._conn:
+                self._conn.execute("DELETE FROM chunks WHERE source = ?", (source,))
+                self._conn.execute("DELETE FROM documents WHERE source = ?", (source,))
+        return entry
+
+    def plan(self, pdfs, docs_path, params):
+        """
+        Compare the files on disk with the registry and work out what needs to change.
+        Files whose size and modification time match the registry are not hashed again
+
+        Parameters:
+        - pdfs (list): Names of the PDF files to ingest
+        - docs_path (str): Folder where the PDF files are stored
+        - params (dict): Current ingest parameters
+
+        Returns:
+        - dict: Lists of file names under "new", "changed", "removed" and "unchanged" ("touched" lists the
+          unchanged files whose modification time moved), and the content hash and (size, mtime) of each
+          file under "hashes" and "stats"
+        """
+        plan = {"new": [], "changed": [], "removed": [], "unchanged": [], "touched": [], "hashes": {}, "stats": {}}
+        params_json = json.dumps(params, sort_keys=True)
+        with self._lock:
+            known = {
+                row[0]: row[1:]
+                for row in self._conn.execute("SELECT source, content_hash, params, file_size, file_mtime, path FROM documents")
+            }
+        for pdf in pdfs:
+            stat = os.stat(os.path.join(docs_path, pdf))
+            plan["stats"][pdf] = (stat.st_size, stat.st_mtime)
+            entry = known.get(pdf)
+            stat_matches = entry is not None and (entry[2], entry[3]) == (stat.st_size, stat.st_mtime)
+            if stat_matches:
+                content_hash = entry[0]
+            else:
+                content_hash = file_content_hash(os.path.join(docs_path, pdf))
+            plan["hashes"][pdf] = content_hash
+            if entry is None:
+                plan["new"].append(pdf)
+            elif entry[0] != content_hash or entry[1] != params_json:
+                plan["changed"].append(pdf)
+            else:
+                plan["unchanged"].append(pdf)
+                if not stat_matches:
+                    plan["touched"].append(pdf)
+        # A file is removed when it no longer exists where it was read from (not merely absent from `pdfs`,
+        # which may only list the newly uploaded files)
+        for source, entry in known.items():
+            if not os.path.exists(entry[4] or os.path.join(docs_path, source)):
+                plan["removed"].append(source)
+        return plan
@@ -0,0 +1,211 @@
+"""
+Persistent, content-addressed cache for embedding vectors.
+Vectors are stored in a local SQLite file keyed by a hash of (model, task type, text), so rebuilding
+the vector DB only calls the embedding API for chunks that have never been embedded before.
+The cache is bounded by number of entries and evicts the least recently used ones first. Hits only
+refresh their LRU position in memory; the timestamps are written in batches, so mostly-cached ingests stay reads.
+"""
+import os
+import atexit
+import sqlite3
+import hashlib
+import threading
+import time
+from array import array
+from typing import Dict, List, Optional
+from utils import config
+
+# SQLite limits the number of parameters in a single statement, so lookups are done in slices
+_SQL_BATCH = 500
+# LRU timestamps of cache hits are written once this many are pending, or this many seconds after the last write
+TOUCH_FLUSH_ENTRIES = 5000
+TOUCH_FLUSH_SECONDS = 30.0
+
+
+def embedding_cache_key(model: str, task_type: str, text: str) -> str:
+    """
+    Build the cache key for a text embedded with a given model and task type.
+
+    Args:
+        model: Embedding model name
+        task_type: Gemini task type (e.g. "retrieval_document")
+        text: Text that is embedded
+
+    Returns:
+        Hex digest identifying the embedding
+    """
+    digest = hashlib.sha256()
+    for part in (model, task_type, text):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class EmbeddingCache:
+    """
+    SQLite-backed LRU cache of embedding vectors.
+    Vectors are packed as float32 blobs. Hit/miss/eviction counters are kept for the lifetime of the object.
+    """
+
+    def __init__(self, path: str, max_entries: int = 200000):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # The connection is shared between Streamlit script threads, so all access goes through the lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)")
+        self._conn.commit()
+        # Key -> last use of the hits whose timestamp is not written yet
+        self._touched: Dict[str, float] = {}
+        self._flushed_at = time.monotonic()
+        self._recount()
+
+    def _recount(self) -> None:
+        self._size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _write_touches(self) -> None:
+        # Caller holds the lock and commits
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                [(used, key) for key, used in self._touched.items()],
+            )
+            self._touched.clear()
+        self._flushed_at = time.monotonic()
+
+    def flush(self) -> None:
+        """
+        Write the pending LRU timestamps of cache hits
+        """
+        with self._lock:
+            if self._touched:
+                self._write_touches()
+                self._conn.commit()
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        """
+        Look up several keys at once and refresh their LRU position.
+
+        Args:
+            keys: Cache keys to look up
+
+        Returns:
+            Dictionary with the vectors found, by key (missing keys are left out)
+        """
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            for i in range(0, len(unique_keys), _SQL_BATCH):
+                batch = unique_keys[i:i + _SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+            if found:
+                now = time.time()
+                for key in found:
+                    self._touched[key] = now
+                if len(self._touched) >= TOUCH_FLUSH_ENTRIES or time.monotonic() - self._flushed_at >= TOUCH_FLUSH_SECONDS:
+                    self._write_touches()
+                    self._conn.commit()
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]) -> None:
+        """
+        Store vectors in the cache, evicting the least recently used entries if it grows past max_entries.
+
+        Args:
+            items: Dictionary of vectors by cache key
+        """
+        if not items:
+            return
+        now = time.time()
+        rows = [(key, array("f", vector).tobytes(), now) for key, vector in items.items() if vector]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", rows
+            )
+            # Counted again rather than tracked: other processes may add or evict entries of the same file
+            self._recount()
+            excess = self._size - self.max_entries
+            if excess > 0:
+                # Recent hits must be on disk before choosing the least recently used entries
+                self._write_touches()
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (excess,)
+                )
+                self._size -= excess
+                self.evictions += excess
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Return the cache counters (entries, hits, misses and evictions)
+        """
+        return {
+            "entries": self._size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def clear(self) -> None:
+        """
+        Remove every entry from the cache
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self._touched.clear()
+            self._size = 0
+
+
+# One cache object per file, shared by every embedding client in the process
+_caches: Dict[str, EmbeddingCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(path: Optional[str] = None, max_entries: Optional[int] = None) -> Optional[EmbeddingCache]:
+    """
+    Return the process-wide embedding cache for a file, creating it on first use.
+
+    Args:
+        path: Cache file (defaults to EMBEDDING_CACHE_PATH from the config)
+        max_entries: Maximum number of vectors kept (defaults to EMBEDDING_CACHE_MAX_ENTRIES)
+
+    Returns:
+        The shared EmbeddingCache, or None if caching is disabled (max_entries <= 0)
+    """
+    path = path or config.EMBEDDING_CACHE_PATH
+    max_entries = config.EMBEDDING_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+    if max_entries <= 0:
+        return None
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = EmbeddingCache(path, max_entries=max_entries)
+            # The LRU timestamps still pending are written when the process exits
+            atexit.register(_caches[path].flush)
+        return _caches[path]
@@ -0,0 +1,332 @@
+"""
+Concurrent, rate-limited scheduler for embedding API calls.
+Batches are sent by a small pool of threads, throttled by token buckets for requests/minute and
+tokens/minute, and retried with exponential backoff and jitter on rate-limit and server errors.
+The batch size adapts: it shrinks when the API pushes back and grows again after successful calls.
+A text that cannot be embedded raises EmbeddingError instead of producing an empty vector.
+"""
+import re
+import time
+import random
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+from utils import config
+from utils import metrics
+
+# HTTP status codes worth retrying: rate limited, or a transient server-side error
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+# Rough characters-per-token ratio used to estimate the tokens of a request
+CHARS_PER_TOKEN = 4
+# Messages of API errors about the size of a request, e.g. Gemini's "Request payload size exceeds the limit" or
+# "at most 100 requests can be in one batch"
+TOO_LARGE_PATTERN = re.compile(r"payload size|too large|at most \d+ (?:requests|texts|inputs|instances) can be in (?:one|a single) (?:batch|request)")
+
+
+class EmbeddingError(Exception):
+    """
+    Raised when some texts could not be embedded, so no incomplete vector ends up in the vector DB
+    """
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def error_status_code(error: Exception) -> Optional[int]:
+    """
+    Return the HTTP status code of an API error, if it can be found
+    """
+    for attribute in ("code", "status_code"):
+        code = getattr(error, attribute, None)
+        if callable(code):
+            # gRPC errors expose code() returning a StatusCode enum; the HTTP code is not available
+            continue
+        if isinstance(code, int):
+            return code
+    message = str(error)
+    for code in RETRYABLE_STATUS_CODES:
+        if message.startswith(f"{code} ") or f" {code} " in message:
+            return code
+    return None
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Whether an embedding call failed for a transient reason (rate limit, server error, timeout)
+    """
+    if error_status_code(error) in RETRYABLE_STATUS_CODES:
+        return True
+    message = str(error).lower()
+    return any(hint in message for hint in ("quota", "rate limit", "resource exhausted", "unavailable", "deadline", "timed out"))
+
+
+def is_too_large(error: Exception) -> bool:
+    """
+    Whether an embedding call failed because the request was too big (so it may succeed when split)
+    """
+    return error_status_code(error) == 413 or TOO_LARGE_PATTERN.search(str(error).lower()) is not None
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at `rate_per_minute`.
+    A rate of 0 or less disables the limit
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1) -> float:
+        """
+        Take `amount` tokens, waiting for the bucket to refill if needed
+
+        Returns:
+            Seconds spent waiting
+        """
+        if self.rate <= 0:
+            return 0.0
+        # A request bigger than the whole bucket would never fit, so it only waits for a full bucket
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = self._clock()
+                self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+                delay = (amount - self.tokens) / self.rate
+            self._sleep(delay)
+            waited += delay
+
+
+class RateLimiter:
+    """
+    Requests/minute and tokens/minute limits applied together to every API call
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float, **kwargs):
+        self.requests = TokenBucket(requests_per_minute, **kwargs)
+        self.tokens = TokenBucket(tokens_per_minute, **kwargs)
+
+    def acquire(self, tokens: int) -> float:
+        return self.requests.acquire(1) + self.tokens.acquire(tokens)
+
+
+def gemini_embed_batch(model: str) -> Callable[[List[str], str], List[List[float]]]:
+    """
+    Build the default backend: one Gemini batch embedding call per batch of texts
+
+    Args:
+        model: Embedding model name
+
+    Returns:
+        Function taking (texts, task_type) and returning one vector per text
+    """
+    import google.generativeai as genai
+
+    def embed_batch(texts, task_type):
+        result = genai.embed_content(model=model, content=texts, task_type=task_type)
+        if isinstance(result, dict) and 'embedding' in result:
+            return result['embedding']
+        raise EmbeddingError(f"Unexpected result format: {type(result)}")
+    return embed_batch
+
+
+class EmbeddingScheduler:
+    """
+    Embeds lists of texts through a backend function, with bounded concurrency, rate limiting,
+    retries and adaptive batch sizing.
+
+    The backend takes (texts, task_type) and returns one vector per text. Any callable works,
+    which makes it easy to point the scheduler at a local fake endpoint in tests and benchmarks.
+    """
+
+    def __init__(
+        self,
+        embed_batch: Callable[[List[str], str], List[List[float]]],
+        rate_limiter: Optional[RateLimiter] = None,
+        max_concurrency: int = 4,
+        max_batch_size: int = 100,
+        min_batch_size: int = 1,
+        max_retries: int = 5,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        sleep=time.sleep,
+    ):
+        self.embed_batch = embed_batch
+        self.rate_limiter = rate_limiter
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_batch_size = max_batch_size
+        self.min_batch_size = min_batch_size
+        self.batch_size = max_batch_size
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        # Counters kept for the lifetime of the scheduler
+        self.stats = {"requests": 0, "retries": 0, "splits": 0, "throttled_seconds": 0.0, "texts": 0}
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.stats[name] += amount
+
+    def _backoff(self, attempt: int) -> float:
+        # Exponential backoff with full jitter, so concurrent workers do not retry in lockstep
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def _shrink(self):
+        with self._lock:
+            self.batch_size = max(self.min_batch_size, self.batch_size // 2)
+
+    def _grow(self):
+        with self._lock:
+            self.batch_size = min(self.max_batch_size, self.batch_size + max(1, self.batch_size // 4))
+
+    def embed(self, texts: List[str], task_type: str = "retrieval_document", on_batch: Optional[Callable] = None) -> List[List[float]]:
+        """
+        Embed a list of texts.
+
+        Args:
+            texts: Texts to embed
+            task_type: Gemini task type ("retrieval_document" or "retrieval_query")
+            on_batch: Called with (start, end, vectors) as soon as each API batch succeeds (from the worker
+                threads), e.g. to store its vectors before the whole list is done
+
+        Returns:
+            One vector per text, in the same order
+
+        Raises:
+            EmbeddingError: If any text could not be embedded after all retries
+        """
+        if not texts:
+            return []
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        pending = deque()  # (start, end) ranges that were split and still need embedding
+        cursor = [0]
+        stop = threading.Event()
+
+        def next_range():
+            with self._lock:
+                if stop.is_set():
+                    return None
+                if pending:
+                    return pending.popleft()
+                if cursor[0] >= len(texts):
+                    return None
+                start = cursor[0]
+                cursor[0] = min(len(texts), start + self.batch_size)
+                return start, cursor[0]
+
+        def worker():
+            try:
+                while True:
+                    batch_range = next_range()
+                    if batch_range is None:
+                        return
+                    self._embed_range(texts, batch_range, task_type, results, pending, on_batch)
+            except Exception:
+                stop.set()
+                raise
+
+        workers = min(self.max_concurrency, -(-len(texts) // max(1, self.batch_size)))
+        if workers <= 1:
+            worker()
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                # Each thread runs in a copy of the caller's context, so its spans nest under the caller's span
+                futures = [executor.submit(contextvars.copy_context().run, worker) for _ in range(workers)]
+                for future in futures:
+                    future.result()
+
+        missing = [i for i, vector in enumerate(results) if not vector]
+        if missing:
+            raise EmbeddingError(f"{len(missing)} of {len(texts)} texts were not embedded")
+        return results
+
+    def _embed_range(self, texts, batch_range, task_type, results, pending, on_batch=None):
+        """
+        Embed texts[start:end] with retries, splitting the range when the request is too large
+        """
+        start, end = batch_range
+        batch = texts[start:end]
+        with metrics.span("embedding_batch", size=len(batch), task_type=task_type) as span:
+            self._embed_batch_with_retries(texts, batch_range, batch, task_type, results, pending, span)
+        # A range that was split has no vectors yet: its halves are reported when they are done
+        if on_batch is not None and results[start] is not None:
+            on_batch(start, end, results[start:end])
+
+    def _embed_batch_with_retries(self, texts, batch_range, batch, task_type, results, pending, span):
+        start, end = batch_range
+        for attempt in range(self.max_retries + 1):
+            span.set(retries=attempt)
+            if self.rate_limiter is not None:
+                waited = self.rate_limiter.acquire(sum(estimate_tokens(text) for text in batch))
+                self._count("throttled_seconds", waited)
+            self._count("requests")
+            metrics.count("embedding_requests", task_type=task_type)
+            try:
+                vectors = self.embed_batch(batch, task_type)
+            except Exception as e:
+                if is_too_large(e) and len(batch) > 1:
+                    self._split(batch_range, pending)
+                    return
+                if not is_retryable(e) or attempt == self.max_retries:
+                    raise EmbeddingError(f"Embedding failed after {attempt + 1} attempt(s): {e}") from e
+                if error_status_code(e) == 429 or "quota" in str(e).lower():
+                    self._shrink()
+                self._count("retries")
+                metrics.count("embedding_retries", task_type=task_type)
+                self._sleep(self._backoff(attempt))
+                continue
+
+            if len(vectors) != len(batch):
+                # Treat a short answer like an oversized request: smaller requests usually come back complete
+                if len(batch) > 1:
+                    self._split(batch_range, pending)
+                    return
+                raise EmbeddingError(f"Expected {len(batch)} embeddings, got {len(vectors)}")
+            for offset, vector in enumerate(vectors):
+                if not vector:
+                    raise EmbeddingError(f"Empty embedding returned for text {start + offset}")
+                results[start + offset] = list(vector)
+            self._count("texts", len(batch))
+            self._grow()
+            return
+
+    def _split(self, batch_range, pending):
+        start, end = batch_range
+        metrics.count("embedding_splits")
+        middle = (start + end) // 2
+        self._count("splits")
+        self._shrink()
+        with self._lock:
+            pending.append((start, middle))
+            pending.append((middle, end))
+
+
+# Quotas apply per API key, so every scheduler in the process shares the same limiter
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """
+    Return the process-wide rate limiter configured with EMBEDDING_RPM and EMBEDDING_TPM
+    """
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = RateLimiter(config.EMBEDDING_RPM, config.EMBEDDING_TPM)
+        return _rate_limiter
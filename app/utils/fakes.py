@@ -0,0 +1,51 @@
+"""
+Deterministic offline stand-ins for the Gemini embedding and chat models.
+Set EMBEDDING_MODEL and/or CHAT_MODEL to a name starting with "fake" (e.g. "fake-embedding") to run the
+app, the ingest CLI or the benchmarks without network access or API quota.
+"""
+import re
+import hashlib
+import math
+
+FAKE_MODEL_PREFIX = "fake"
+FAKE_EMBEDDING_DIM = 256
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def is_fake_model(model):
+    return model.split("/")[-1].startswith(FAKE_MODEL_PREFIX)
+
+
+def fake_embed_batch(texts, task_type=None, dim=FAKE_EMBEDDING_DIM):
+    """
+    Embed texts as hashed bag-of-words vectors (L2-normalized). Texts sharing words get similar
+    vectors, so retrieval over fake embeddings still returns sensible results
+
+    Parameters:
+    - texts (list): Texts to embed
+    - task_type (str, optional): Ignored, accepted for compatibility with the real backend
+    - dim (int, optional): Vector size
+
+    Returns:
+    - list: One vector per text
+    """
+    vectors = []
+    for text in texts:
+        vector = [0.0] * dim
+        for word in _WORD_RE.findall(text.lower()):
+            digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % dim
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        # An empty text still gets a valid (non-empty) vector
+        vectors.append([value / norm for value in vector] if any(vector) else [1.0 / math.sqrt(dim)] * dim)
+    return vectors
+
+
+def fake_chat_model(answer="This is a fake answer generated offline from the retrieved context."):
+    """
+    Chat model that always streams the same answer, character by character
+    """
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+    return FakeListChatModel(responses=[answer])
@@ -0,0 +1,70 @@
+"""
+Hybrid retriever combining vector similarity and BM25 keyword search with reciprocal rank fusion.
+It is a regular LangChain retriever, so it drops into the retrieval chain in place of vectordb.as_retriever().
+"""
+import hashlib
+from typing import Any, List
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from utils.bm25_index import get_bm25_index
+from utils.chunking import collapse_duplicates
+
+
+def document_key(doc):
+    """
+    Identify a retrieved chunk: its chunk ID, or a hash of its text for chunks ingested without one
+    """
+    chunk_id = doc.metadata.get("chunk_id")
+    if chunk_id:
+        return chunk_id
+    return hashlib.sha256(doc.page_content.encode("utf-8")).hexdigest()
+
+
+def reciprocal_rank_fusion(rankings, rrf_k=60):
+    """
+    Merge several rankings into one with reciprocal rank fusion
+
+    Parameters:
+    - rankings (list): Lists of keys, best first
+    - rrf_k (int, optional): Damping constant, 60 as in the original paper
+
+    Returns:
+    - list: Keys ordered by fused score, best first
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retrieves `fetch_k` candidates from the vector store and from the BM25 index of `db_path`, fuses both
+    rankings and returns the best `k` documents. Near duplicates (e.g. the same notice in several files) take
+    a single slot, with the others listed as aliases. The index is looked up on every query, so an index
+    rewritten by another process is picked up
+    """
+
+    vectordb: Any
+    db_path: str
+    k: int = 5
+    fetch_k: int = 20
+    rrf_k: int = 60
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        vector_docs = self.vectordb.similarity_search(query, k=self.fetch_k)
+        lexical_ids = [chunk_id for chunk_id, _ in get_bm25_index(self.db_path).search(query, k=self.fetch_k)]
+
+        docs_by_key = {document_key(doc): doc for doc in vector_docs}
+        # Twice as many candidates as needed, so that collapsed duplicates leave room for other documents
+        fused = reciprocal_rank_fusion([list(docs_by_key), lexical_ids], rrf_k=self.rrf_k)[:self.k * 2]
+
+        # Chunks only found by keyword search are read from the vector store by ID
+        missing = [key for key in fused if key not in docs_by_key]
+        if missing:
+            items = self.vectordb.get(ids=missing, include=["documents", "metadatas"])
+            for chunk_id, text, metadata in zip(items["ids"], items["documents"], items["metadatas"]):
+                docs_by_key[chunk_id] = Document(page_content=text, metadata=metadata or {})
+        return collapse_duplicates([docs_by_key[key] for key in fused if key in docs_by_key], k=self.k)
@@ -0,0 +1,446 @@
+"""
+Portable snapshots of an ingested corpus, so a new node starts serving without ingesting the documents again.
+
+A snapshot is a single file with everything the vector DB folder of a corpus holds: the embeddings, the chunk
+texts and metadata, the document registry (content hashes, chunk IDs, ingest parameters) and the BM25 index.
+Importing it bulk-loads the configured vector store (Chroma or the NumPy store) with the stored vectors, without
+any embedding call, and registers the documents: the next sync only ingests what changed since the export.
+
+Layout (little-endian): a 64-byte header with the magic, the format version and the offset, size and SHA-256 of
+the JSON manifest at the end of the file, then the sections, each aligned on 64 bytes: the float32 matrix of the
+vectors, the chunk IDs, texts and metadata (UTF-8 values back to back, with an int64 end offset per row) and the
+BM25 index (an .npz file of plain arrays, see bm25_index.py). The manifest lists the offset, size and SHA-256 of every section, so a damaged or truncated
+file is refused before anything is loaded. Export writes the sections through temporary files and import reads
+them through memory maps, PAGE_ROWS chunks at a time: memory stays bounded whatever the size of the corpus.
+"""
+import os
+import json
+import mmap
+import logging
+import time
+import shutil
+import struct
+import hashlib
+import tempfile
+import numpy as np
+from utils import config
+from utils import metrics
+from utils.bm25_index import BM25_FILENAME, BM25Index, get_bm25_index
+from utils.document_registry import DocumentRegistry
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"RAGSNAP\x00"
+FORMAT_VERSION = 1
+# Magic, format version, two reserved fields, manifest offset and size, manifest SHA-256: 64 bytes
+_HEADER = struct.Struct("<8sHHIQQ32s")
+ALIGNMENT = 64
+# Chunks read from the vector DB (export) or written to it (import) at a time
+PAGE_ROWS = 2000
+COPY_BLOCK_SIZE = 1024 * 1024
+VECTOR_DTYPE = np.dtype("<f4")
+OFFSET_DTYPE = np.dtype("<i8")
+# Sections holding one UTF-8 value per chunk (with an "<name>.ends" offsets section)
+BLOB_SECTIONS = ("ids", "texts", "metadatas")
+
+
+class SnapshotError(Exception):
+    """
+    Raised when a snapshot can't be written or imported (damaged file, other format, inconsistent vector DB, ...)
+    """
+
+
+class _Spool:
+    """
+    A section being exported: a temporary file, with the size and running SHA-256 of what was written
+    """
+
+    def __init__(self, directory):
+        self.file = tempfile.TemporaryFile(dir=directory)
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.file.write(data)
+        self.digest.update(data)
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        self.file.flush()
+
+    def append_values(self, values, ends):
+        """
+        Append UTF-8 values to this spool, and their end offsets to the `ends` spool
+        """
+        encoded = [value.encode("utf-8") for value in values]
+        offsets = self.size + np.cumsum([len(item) for item in encoded], dtype=np.int64)
+        self.write(b"".join(encoded))
+        ends.write(offsets.astype(OFFSET_DTYPE).tobytes())
+
+    def close(self):
+        self.file.close()
+
+
+def _progress_update(progress, fraction, message):
+    if progress is not None:
+        progress(fraction, message)
+
+
+def export_snapshot(vectordb, path, db_path=None, progress=None):
+    """
+    Write a snapshot of an ingested corpus
+
+    Parameters:
+    - vectordb: Vectorstore of the corpus (Chroma or NumpyVectorStore)
+    - path (str): Snapshot file to write (replaced atomically if it exists)
+    - db_path (str, optional): Vector DB folder of the corpus (registry and BM25 index). Defaults to VECTOR_DB_PATH
+    - progress (callable, optional): Called with (fraction_done, message)
+
+    Returns:
+    - summary (dict): Documents, chunks, vector dimension, file size in bytes and seconds taken
+
+    Raises:
+    - SnapshotError: If nothing is ingested, or registered chunks are missing from the vector DB
+    """
+    db_path = db_path or config.VECTOR_DB_PATH
+    started = time.perf_counter()
+    registry = DocumentRegistry.load(db_path)
+    ingested = registry.sources()
+    sources = sorted(ingested)
+    rows = sum(entry["chunk_count"] for entry in ingested.values())
+    if not rows:
+        raise SnapshotError(f"Nothing to export: no chunks are registered in '{db_path}'")
+    directory = os.path.dirname(os.path.abspath(path))
+    spools = {"vectors": _Spool(directory)}
+    for name in BLOB_SECTIONS:
+        spools[name] = _Spool(directory)
+        spools[f"{name}.ends"] = _Spool(directory)
+    documents = []
+    dim = None
+    written = 0
+    with metrics.span("snapshot_export", documents=len(sources), chunks=rows) as span:
+        try:
+            # Chunks are written document by document, in the order of the registry, a page at a time
+            page = []
+            for source in sources:
+                entry = registry.get(source)
+                documents.append(dict(source=source, **{key: entry[key] for key in ("hash", "chunk_count", "params", "file_size", "file_mtime")}))
+                for chunk_id in entry["chunk_ids"]:
+                    page.append(chunk_id)
+                    if len(page) == PAGE_ROWS:
+                        dim = _export_page(vectordb, page, spools, dim)
+                        written += len(page)
+                        page = []
+                        _progress_update(progress, written / rows, f"Exported {written}/{rows} chunks")
+            if page:
+                dim = _export_page(vectordb, page, spools, dim)
+                written += len(page)
+            bm25 = get_bm25_index(db_path)
+            # An index that does not cover the exported chunks is left out: the import rebuilds it from the texts
+            if len(bm25) == rows:
+                spools["bm25"] = _Spool(directory)
+                bm25.dump(spools["bm25"])
+            manifest = {
+                "format": FORMAT_VERSION,
+                "created_at": time.time(),
+                "rows": rows,
+                "dim": dim,
+                "vector_backend": config.VECTOR_BACKEND,
+                "ingest_params": config.ingest_params(),
+                "documents": documents,
+                "sections": {},
+            }
+            _progress_update(progress, 1.0, "Writing the snapshot file")
+            size = _assemble(path, spools, manifest)
+        finally:
+            for spool in spools.values():
+                spool.close()
+        span.set(bytes=size)
+    return {"documents": len(documents), "chunks": rows, "dim": dim, "bytes": size, "seconds": round(time.perf_counter() - started, 3)}
+
+
+def _export_page(vectordb, chunk_ids, spools, dim):
+    """
+    Read a page of chunks from the vector DB and append them to the section spools. Returns the vector dimension
+    """
+    items = vectordb.get(ids=chunk_ids, include=["embeddings", "documents", "metadatas"])
+    # The vector DB returns the chunks in its own order
+    position = {chunk_id: i for i, chunk_id in enumerate(items["ids"])}
+    missing = [chunk_id for chunk_id in chunk_ids if chunk_id not in position]
+    if missing:
+        raise SnapshotError(f"{len(missing)} registered chunks are missing from the vector DB (e.g. {missing[0]}): run a sync before exporting")
+    order = [position[chunk_id] for chunk_id in chunk_ids]
+    vectors = np.asarray(items["embeddings"], dtype=VECTOR_DTYPE)[order]
+    if dim is not None and vectors.shape[1] != dim:
+        raise SnapshotError(f"Vectors of dimension {vectors.shape[1]} and {dim} in the same vector DB")
+    spools["vectors"].write(np.ascontiguousarray(vectors).tobytes())
+    spools["ids"].append_values(chunk_ids, spools["ids.ends"])
+    spools["texts"].append_values([items["documents"][i] or "" for i in order], spools["texts.ends"])
+    spools["metadatas"].append_values([json.dumps(items["metadatas"][i] or {}) for i in order], spools["metadatas.ends"])
+    return int(vectors.shape[1])
+
+
+def _assemble(path, spools, manifest):
+    """
+    Copy the section spools into the snapshot file, then the manifest and the header. Returns the file size
+    """
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, "wb") as out:
+            out.write(b"\x00" * _HEADER.size)
+            for name, spool in spools.items():
+                out.write(b"\x00" * (-out.tell() % ALIGNMENT))
+                manifest["sections"][name] = {"offset": out.tell(), "size": spool.size, "sha256": spool.digest.hexdigest()}
+                spool.file.seek(0)
+                shutil.copyfileobj(spool.file, out, COPY_BLOCK_SIZE)
+            data = json.dumps(manifest, sort_keys=True).encode("utf-8")
+            manifest_offset = out.tell()
+            out.write(data)
+            size = out.tell()
+            # The header goes in last: a file cut short has no valid header
+            out.seek(0)
+            out.write(_HEADER.pack(MAGIC, FORMAT_VERSION, 0, 0, manifest_offset, len(data), hashlib.sha256(data).digest()))
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return size
+
+
+class Snapshot:
+    """
+    Read-only, memory-mapped view of a snapshot file
+    """
+
+    def __init__(self, path):
+        """
+        Parameters:
+        - path (str): Snapshot file
+
+        Raises:
+        - SnapshotError: If the file is not a snapshot, has another format version, or its manifest is damaged
+        """
+        self.path = path
+        with open(path, "rb") as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise SnapshotError(f"Empty snapshot file: {path}")
+        try:
+            self.manifest = self._read_manifest()
+        except BaseException:
+            self._map.close()
+            raise
+        # Memory-mapped arrays by section name
+        self._arrays = {}
+
+    def _read_manifest(self):
+        if len(self._map) < _HEADER.size:
+            raise SnapshotError(f"Not a snapshot file: {self.path}")
+        magic, version, _, _, offset, size, digest = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise SnapshotError(f"Not a snapshot file: {self.path}")
+        if version != FORMAT_VERSION:
+            raise SnapshotError(f"Unsupported snapshot format {version} in {self.path} (expected {FORMAT_VERSION})")
+        data = self._map[offset:offset + size]
+        if len(data) != size or hashlib.sha256(data).digest() != digest:
+            raise SnapshotError(f"Damaged or truncated snapshot file: {self.path}")
+        manifest = json.loads(data)
+        for name, section in manifest["sections"].items():
+            if section["offset"] + section["size"] > offset:
+                raise SnapshotError(f"Section {name} out of bounds in {self.path}")
+        return manifest
+
+    @property
+    def rows(self):
+        return self.manifest["rows"]
+
+    @property
+    def dim(self):
+        return self.manifest["dim"]
+
+    @property
+    def documents(self):
+        return self.manifest["documents"]
+
+    def has_section(self, name):
+        return name in self.manifest["sections"]
+
+    def verify(self):
+        """
+        Check the SHA-256 of every section, reading the file sequentially
+
+        Raises:
+        - SnapshotError: On the first section whose content does not match the manifest
+        """
+        for name, section in self.manifest["sections"].items():
+            digest = hashlib.sha256()
+            end = section["offset"] + section["size"]
+            for start in range(section["offset"], end, COPY_BLOCK_SIZE):
+                digest.update(self._map[start:min(start + COPY_BLOCK_SIZE, end)])
+            if digest.hexdigest() != section["sha256"]:
+                raise SnapshotError(f"Checksum mismatch in section {name} of {self.path}: the file is damaged")
+
+    def _array(self, name, dtype, shape):
+        if name not in self._arrays:
+            section = self.manifest["sections"][name]
+            if not section["size"]:
+                self._arrays[name] = np.zeros(shape, dtype=dtype)
+            else:
+                self._arrays[name] = np.memmap(self.path, dtype=dtype, mode="r", offset=section["offset"], shape=shape)
+        return self._arrays[name]
+
+    def vectors(self):
+        """
+        Memory-mapped float32 matrix of the vectors, one row per chunk
+        """
+        return self._array("vectors", VECTOR_DTYPE, (self.rows, self.dim))
+
+    def values(self, name, start, end):
+        """
+        Values of rows start to end of a blob section ("ids", "texts" or "metadatas")
+        """
+        if end <= start:
+            return []
+        ends = self._array(f"{name}.ends", OFFSET_DTYPE, (self.rows,))
+        base = self.manifest["sections"][name]["offset"]
+        offsets = [int(ends[start - 1]) if start else 0] + [int(value) for value in ends[start:end]]
+        data = self._map[base + offsets[0]:base + offsets[-1]]
+        return [data[a - offsets[0]:b - offsets[0]].decode("utf-8") for a, b in zip(offsets, offsets[1:])]
+
+    def pages(self, page_rows=PAGE_ROWS):
+        """
+        Iterate over the chunks a page at a time
+
+        Returns:
+        - generator: (start row, ids, vectors, texts, metadatas) of each page
+        """
+        vectors = self.vectors()
+        for start in range(0, self.rows, page_rows):
+            end = min(start + page_rows, self.rows)
+            metadatas = [json.loads(value) for value in self.values("metadatas", start, end)]
+            yield start, self.values("ids", start, end), np.asarray(vectors[start:end]), self.values("texts", start, end), metadatas
+
+    def copy_section(self, name, file):
+        """
+        Write the content of a section to an open binary file
+        """
+        section = self.manifest["sections"][name]
+        end = section["offset"] + section["size"]
+        for start in range(section["offset"], end, COPY_BLOCK_SIZE):
+            file.write(self._map[start:min(start + COPY_BLOCK_SIZE, end)])
+
+    def close(self):
+        self._arrays.clear()
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _bulk_load(vectordb, ids, vectors, texts, metadatas):
+    """
+    Write chunks with their stored vectors (no embedding call) to the vector DB
+    """
+    if hasattr(vectordb, "upsert_vectors"):
+        vectordb.upsert_vectors(ids, vectors, texts, metadatas)
+    else:
+        # Chroma: straight to the collection, which accepts precomputed embeddings (and no empty metadata)
+        vectordb._collection.upsert(ids=ids, embeddings=vectors, documents=texts, metadatas=[metadata or None for metadata in metadatas])
+
+
+def import_snapshot(path, vectordb, db_path=None, docs_path=None, verify=True, progress=None):
+    """
+    Load a snapshot into an empty vector DB folder
+
+    Parameters:
+    - path (str): Snapshot file
+    - vectordb: Vectorstore of the target folder (Chroma or NumpyVectorStore, empty)
+    - db_path (str, optional): Target vector DB folder (registry and BM25 index). Defaults to VECTOR_DB_PATH
+    - docs_path (str, optional): Folder where the PDFs of the corpus are (or will be) on this node. Defaults to DOCS_PATH
+    - verify (bool, optional): Check the checksums of every section before loading anything. Defaults to True
+    - progress (callable, optional): Called with (fraction_done, message)
+
+    Returns:
+    - summary (dict): Documents, chunks, whether the BM25 index was rebuilt, whether the ingest parameters of the
+      snapshot match the config (when they don't, the next sync ingests the documents again) and seconds taken
+
+    Raises:
+    - SnapshotError: If the file is damaged, was embedded with another model, or the target is not empty
+    """
+    # Imported here: the pipeline loads LangChain
+    from utils.ingest_pipeline import count_chunks, rebuild_bm25_index
+    from utils.bm25_index import save_bm25_index
+    db_path = db_path or config.VECTOR_DB_PATH
+    docs_path = docs_path or config.DOCS_PATH
+    started = time.perf_counter()
+    with Snapshot(path) as snapshot, metrics.span("snapshot_import", documents=len(snapshot.documents), chunks=snapshot.rows) as span:
+        if verify:
+            with metrics.span("snapshot_verify"):
+                snapshot.verify()
+        # Vectors of another model would be compared with query vectors they have nothing in common with
+        models = {document["params"].get("embedding_model") for document in snapshot.documents}
+        if models - {config.EMBEDDING_MODEL}:
+            raise SnapshotError(f"The snapshot was embedded with {', '.join(sorted(map(str, models)))}, not {config.EMBEDDING_MODEL} (EMBEDDING_MODEL)")
+        registry = DocumentRegistry.load(db_path)
+        if not registry.is_empty() or count_chunks(vectordb):
+            raise SnapshotError(f"The vector DB in '{db_path}' is not empty: import into a new folder (or delete this one first)")
+
+        documents = snapshot.documents
+        next_document = 0
+        document_start = 0
+        for start, ids, vectors, texts, metadatas in snapshot.pages():
+            with metrics.span("snapshot_load", chunks=len(ids)):
+                _bulk_load(vectordb, ids, vectors, texts, metadatas)
+            end = start + len(ids)
+            # Documents are registered once all their chunks are stored, like after an ingest
+            while next_document < len(documents) and document_start + documents[next_document]["chunk_count"] <= end:
+                document = documents[next_document]
+                chunk_ids = snapshot.values("ids", document_start, document_start + document["chunk_count"])
+                registry.record(document["source"], document["hash"], chunk_ids, document["params"], document["file_size"],
+                                document["file_mtime"], path=os.path.join(docs_path, document["source"]))
+                document_start += document["chunk_count"]
+                next_document += 1
+            metrics.count("snapshot_chunks_loaded", len(ids))
+            _progress_update(progress, end / snapshot.rows, f"Loaded {end}/{snapshot.rows} chunks")
+        # Documents without chunks (e.g. scanned PDFs without text) after the last chunk
+        for document in documents[next_document:]:
+            registry.record(document["source"], document["hash"], [], document["params"], document["file_size"],
+                            document["file_mtime"], path=os.path.join(docs_path, document["source"]))
+
+        bm25_path = os.path.join(db_path, BM25_FILENAME)
+        rebuilt = not snapshot.has_section("bm25")
+        if not rebuilt:
+            temp_path = bm25_path + ".tmp"
+            with open(temp_path, "wb") as f:
+                snapshot.copy_section("bm25", f)
+            # The checksums only prove the file is intact, not where it comes from: the index is read as plain arrays,
+            # and one that can't be (e.g. pickled by an earlier version, never unpickled) is rebuilt from the texts
+            try:
+                BM25Index.read(temp_path)
+            except ValueError as e:
+                logger.warning("Rebuilding the BM25 index of the snapshot: %s", e)
+                os.remove(temp_path)
+                rebuilt = True
+            else:
+                os.replace(temp_path, bm25_path)
+        if rebuilt:
+            bm25 = get_bm25_index(db_path)
+            rebuild_bm25_index(vectordb, registry, bm25)
+            save_bm25_index(bm25)
+        params_match = all(document["params"] == config.ingest_params() for document in documents)
+        span.set(bm25_rebuilt=rebuilt, params_match=params_match)
+    return {
+        "documents": len(documents),
+        "chunks": snapshot.rows,
+        "bm25_rebuilt": rebuilt,
+        "params_match": params_match,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
@@ -0,0 +1,429 @@
+"""
+Background ingestion with a persistent job queue.
+
+Uploaded files are recorded in a small SQLite queue (INGEST_QUEUE_PATH) and ingested by a worker thread of
+the app process, so a Streamlit rerun returns right away and a closed browser tab does not stop the work.
+Each file has its own state (queued → running → done or failed) and a count of the chunks already written,
+updated after every embedding/upsert batch. The queue survives restarts: files that were queued, or running
+in a process that died, are picked up by the next worker. The ingest itself resumes at the batch level:
+slices already in the vector DB are skipped (chunk IDs are stable) and vectors of the API calls that
+succeeded are served by the embedding cache.
+The sidebar shows status(), read again on every rerun; the page reruns every INGEST_POLL_SECONDS while files are
+being processed (see prepare_vectordb.poll_ingest_status).
+"""
+import os
+import time
+import socket
+import sqlite3
+import threading
+from utils import config
+from utils import metrics
+from utils.ingest_pipeline import IngestProgress
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+ACTIVE_STATES = (QUEUED, RUNNING)
+# Seconds an idle worker waits before looking at the queue again (a submit from this process wakes it at once)
+POLL_SECONDS = 5.0
+# Finished files kept in the queue for the status display
+MAX_FINISHED_FILES = 1000
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobQueue:
+    """
+    SQLite-backed queue of files to ingest. A job is the group of files submitted together; every file
+    is claimed, run and finished on its own. Several processes can share the queue file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # The connection is shared between the worker and the Streamlit script threads, so all access goes through the lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS job_files (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id INTEGER NOT NULL,
+                source TEXT NOT NULL,
+                docs_path TEXT NOT NULL,
+                state TEXT NOT NULL,
+                chunks_done INTEGER NOT NULL DEFAULT 0,
+                chunks_total INTEGER,
+                error TEXT,
+                worker TEXT,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS job_files_state ON job_files(state);
+            CREATE INDEX IF NOT EXISTS job_files_source ON job_files(source);
+            """
+        )
+        # Queues created before corpora existed get the vector DB folder of each file (NULL: the default one)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(job_files)")]
+        if "db_path" not in columns:
+            self._conn.execute("ALTER TABLE job_files ADD COLUMN db_path TEXT")
+        self._conn.commit()
+
+    def submit(self, pdfs, docs_path, db_path=None):
+        """
+        Queue files for ingestion. Files already queued or running are not queued twice
+
+        Parameters:
+        - pdfs (list): Names of the PDF files, relative to docs_path
+        - docs_path (str): Folder of the files
+        - db_path (str, optional): Vector DB folder they go to (e.g. Corpus.db_path). Defaults to VECTOR_DB_PATH when they are run
+
+        Returns:
+        - int or None: ID of the new job, or None when every file was already waiting
+        """
+        docs_path = os.path.abspath(docs_path)
+        db_path = os.path.abspath(db_path) if db_path else None
+        now = time.time()
+        with self._lock, self._conn:
+            waiting = {row[0] for row in self._conn.execute(
+                "SELECT source FROM job_files WHERE docs_path = ? AND state IN (?, ?)", (docs_path, *ACTIVE_STATES)
+            )}
+            new = [pdf for pdf in dict.fromkeys(pdfs) if pdf not in waiting]
+            if not new:
+                return None
+            job_id = self._conn.execute("INSERT INTO jobs (created_at) VALUES (?)", (now,)).lastrowid
+            self._conn.executemany(
+                "INSERT INTO job_files (job_id, source, docs_path, db_path, state, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [(job_id, pdf, docs_path, db_path, QUEUED, now) for pdf in new],
+            )
+            # Old finished files are dropped so the queue stays small
+            self._conn.execute(
+                "DELETE FROM job_files WHERE state NOT IN (?, ?) AND id NOT IN "
+                "(SELECT id FROM job_files WHERE state NOT IN (?, ?) ORDER BY id DESC LIMIT ?)",
+                (*ACTIVE_STATES, *ACTIVE_STATES, MAX_FINISHED_FILES),
+            )
+        return job_id
+
+    def claim(self, worker):
+        """
+        Mark every queued file as running for a worker
+
+        Parameters:
+        - worker (str): Worker ID
+
+        Returns:
+        - dict: Claimed file names by (docs folder, vector DB folder or None)
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            # Taken in one write transaction, so two processes never claim the same file
+            self._conn.execute("UPDATE job_files SET state = ?, worker = ?, updated_at = ? WHERE state = ?", (RUNNING, worker, now, QUEUED))
+            rows = self._conn.execute("SELECT source, docs_path, db_path FROM job_files WHERE state = ? AND worker = ? ORDER BY id", (RUNNING, worker)).fetchall()
+        claimed = {}
+        for source, docs_path, db_path in rows:
+            claimed.setdefault((docs_path, db_path), []).append(source)
+        return claimed
+
+    def update(self, source, docs_path=None, add_chunks=0, **fields):
+        """
+        Update the active (queued or running) entries of a file
+
+        Parameters:
+        - source (str): File name
+        - docs_path (str, optional): Folder of the file. Defaults to any folder
+        - add_chunks (int, optional): Chunks to add to chunks_done
+        - fields: Columns to set (state, chunks_done, chunks_total, error, worker)
+        """
+        assignments = ["updated_at = ?", "chunks_done = chunks_done + ?"]
+        values = [time.time(), add_chunks]
+        for column, value in fields.items():
+            if column not in ("state", "chunks_done", "chunks_total", "error", "worker"):
+                raise ValueError(f"Unknown job file column: {column}")
+            assignments.append(f"{column} = ?")
+            values.append(value)
+        query = f"UPDATE job_files SET {', '.join(assignments)} WHERE source = ? AND state IN (?, ?)"
+        values += [source, *ACTIVE_STATES]
+        if docs_path is not None:
+            query += " AND docs_path = ?"
+            values.append(os.path.abspath(docs_path))
+        with self._lock, self._conn:
+            self._conn.execute(query, values)
+
+    def finish_worker(self, worker, state, error=None, folder=None):
+        """
+        Set the state of the files a worker still has running (e.g. after the whole sync failed)
+
+        Parameters:
+        - worker (str): Worker ID
+        - state (str): New state (DONE or FAILED)
+        - error (str, optional): Error to record
+        - folder (tuple, optional): Only the files of this (docs folder, vector DB folder or None), a key of claim().
+          Defaults to every folder: the files claimed for the other folders are not synced yet, so a worker
+          running several folders must give it
+        """
+        query = "UPDATE job_files SET state = ?, error = ?, updated_at = ? WHERE state = ? AND worker = ?"
+        values = [state, error, time.time(), RUNNING, worker]
+        if folder is not None:
+            docs_path, db_path = folder
+            # IS rather than =: files of the default vector DB have a NULL db_path
+            query += " AND docs_path = ? AND db_path IS ?"
+            values += [os.path.abspath(docs_path), os.path.abspath(db_path) if db_path else None]
+        with self._lock, self._conn:
+            self._conn.execute(query, values)
+
+    def requeue_orphans(self, worker):
+        """
+        Queue again the files left running by a process of this host that is gone (crash, restart)
+
+        Returns:
+        - int: Number of files queued again
+        """
+        host = worker.rsplit(":", 1)[0]
+        with self._lock, self._conn:
+            rows = self._conn.execute("SELECT id, worker FROM job_files WHERE state = ?", (RUNNING,)).fetchall()
+            orphans = []
+            for row_id, owner in rows:
+                owner_host, _, pid = (owner or "").rpartition(":")
+                if owner == worker or (owner_host == host and pid.isdigit() and not _pid_alive(int(pid))):
+                    orphans.append((QUEUED, time.time(), row_id))
+            self._conn.executemany("UPDATE job_files SET state = ?, worker = NULL, updated_at = ? WHERE id = ?", orphans)
+        return len(orphans)
+
+    def retry_failed(self):
+        """
+        Queue the failed files again (their finished batches are not redone)
+
+        Returns:
+        - int: Number of files queued again
+        """
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE job_files SET state = ?, error = NULL, worker = NULL, updated_at = ? WHERE state = ? AND id IN "
+                "(SELECT MAX(id) FROM job_files GROUP BY docs_path, source)",
+                (QUEUED, time.time(), FAILED),
+            )
+            return cursor.rowcount
+
+    def status(self, docs_path=None):
+        """
+        Progress of the current work: the files of every job with files still waiting or running, or else of the last job
+
+        Parameters:
+        - docs_path (str, optional): Only the files of this folder (e.g. of one corpus). Defaults to every folder
+
+        Returns:
+        - dict: "active" (bool), "fraction" (0 to 1), "counts" (files by state) and "files", a list of dicts with the
+          source, state, chunks_done, chunks_total, error and updated_at of each file, in submission order
+        """
+        folder, values = ("", []) if docs_path is None else (" AND docs_path = ?", [os.path.abspath(docs_path)])
+        with self._lock:
+            jobs = [row[0] for row in self._conn.execute(
+                f"SELECT DISTINCT job_id FROM job_files WHERE state IN (?, ?){folder}", [*ACTIVE_STATES, *values]
+            )]
+            if not jobs:
+                jobs = [row[0] for row in self._conn.execute(f"SELECT MAX(job_id) FROM job_files WHERE 1{folder}", values) if row[0] is not None]
+            rows = self._conn.execute(
+                f"SELECT source, state, chunks_done, chunks_total, error, updated_at FROM job_files "
+                f"WHERE job_id IN ({','.join('?' * len(jobs))}){folder} ORDER BY id",
+                jobs + values,
+            ).fetchall() if jobs else []
+        files = [
+            {"source": source, "state": state, "chunks_done": done, "chunks_total": total, "error": error, "updated_at": updated_at}
+            for source, state, done, total, error, updated_at in rows
+        ]
+        counts = {}
+        progress = 0.0
+        for entry in files:
+            counts[entry["state"]] = counts.get(entry["state"], 0) + 1
+            if entry["state"] in (DONE, FAILED):
+                progress += 1.0
+            elif entry["state"] == RUNNING and entry["chunks_total"]:
+                progress += min(1.0, entry["chunks_done"] / entry["chunks_total"])
+        return {
+            "active": any(entry["state"] in ACTIVE_STATES for entry in files),
+            "fraction": progress / len(files) if files else 1.0,
+            "counts": counts,
+            "files": files,
+        }
+
+
+class JobProgress(IngestProgress):
+    """
+    Records the progress events of the pipeline in the queue
+    """
+
+    def __init__(self, queue, docs_path, worker):
+        self.queue = queue
+        self.docs_path = docs_path
+        self.worker = worker
+
+    def file_started(self, pdf, chunk_count):
+        # A file queued after the claim is taken over by this worker too, so it is finished with the others.
+        # chunks_done starts over: the batches written before an interruption are counted again as they are skipped
+        self.queue.update(pdf, self.docs_path, state=RUNNING, worker=self.worker, chunks_done=0, chunks_total=chunk_count)
+
+    def chunks_written(self, pdf, count):
+        self.queue.update(pdf, self.docs_path, add_chunks=count)
+
+    def file_done(self, pdf, chunk_count):
+        self.queue.update(pdf, self.docs_path, state=DONE, chunks_done=chunk_count, chunks_total=chunk_count)
+
+    def file_failed(self, pdf, error):
+        self.queue.update(pdf, self.docs_path, state=FAILED, error=str(error)[:500])
+
+
+class IngestWorker:
+    """
+    Thread that ingests the queued files, one sync of the shared vectorstore per docs folder at a time
+    """
+
+    def __init__(self, queue, poll_seconds=POLL_SECONDS):
+        self.queue = queue
+        self.poll_seconds = poll_seconds
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Start the thread (once); files left by a previous run of the app are queued again first
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            requeued = self.queue.requeue_orphans(self.worker_id)
+            if requeued:
+                metrics.count("ingest_jobs_resumed", requeued)
+            self._thread = threading.Thread(target=self._run, name="ingest-worker", daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        """
+        Look at the queue now instead of at the next poll
+        """
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.clear()
+            try:
+                claimed = self.queue.claim(self.worker_id)
+                for (docs_path, db_path), sources in claimed.items():
+                    self.run_files(docs_path, sources, db_path)
+            except Exception as e:
+                # The queue file itself failed (disk full, locked for too long): try again at the next poll
+                metrics.count("ingest_worker_errors", error=type(e).__name__)
+                claimed = None
+            if not claimed:
+                self._wake.wait(self.poll_seconds)
+
+    def run_files(self, docs_path, sources, db_path=None):
+        """
+        Sync the vectorstore with a docs folder, recording the progress of the claimed files
+
+        Parameters:
+        - docs_path (str): Folder of the files
+        - sources (list): Claimed file names
+        - db_path (str, optional): Vector DB folder. Defaults to VECTOR_DB_PATH from the config
+        """
+        # Imported here: the vectorstore, and LangChain behind it, is only loaded when there is work
+        from utils.corpora import list_docs
+        from utils.vectorstore_handle import get_handle
+        # The whole folder is synced: files submitted meanwhile are ingested in the same pass (their queue entries
+        # are updated too), and the chunks of files deleted from the folder are removed
+        pdfs = list_docs(docs_path)
+        # Only the files of this folder are finished here: the worker may have claimed files of other folders too
+        folder = (docs_path, db_path)
+        with metrics.span("ingest_job", files=len(sources)) as span:
+            try:
+                plan = get_handle(db_path).sync(pdfs, progress=JobProgress(self.queue, docs_path, self.worker_id), docs_path=docs_path)
+            except Exception as e:
+                # e.g. quota exhausted: the files can be retried, and the batches already written are kept
+                self.queue.finish_worker(self.worker_id, FAILED, f"{type(e).__name__}: {e}"[:500], folder)
+                span.set(failed=str(e)[:200])
+                return
+            # Files with nothing to do (unchanged, or ingested by an earlier pass) are done as well
+            self.queue.finish_worker(self.worker_id, DONE, folder=folder)
+            if plan is not None:
+                span.set(ingested=len(plan["new"]) + len(plan["changed"]) - len(plan["failed"]), failed=len(plan["failed"]))
+
+
+# One queue per file and one worker per process, shared by every session
+_queues = {}
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def get_job_queue(path=None):
+    """
+    Return the process-wide job queue of a file
+
+    Parameters:
+    - path (str, optional): Queue file. Defaults to INGEST_QUEUE_PATH from the config
+
+    Returns:
+    - JobQueue: The shared queue
+    """
+    path = os.path.abspath(path or config.INGEST_QUEUE_PATH)
+    with _worker_lock:
+        if path not in _queues:
+            _queues[path] = JobQueue(path)
+        return _queues[path]
+
+
+def get_ingest_worker():
+    """
+    Return the worker of the process, started on first use
+
+    Returns:
+    - IngestWorker: The running worker
+    """
+    global _worker
+    queue = get_job_queue()
+    with _worker_lock:
+        if _worker is None or _worker.queue is not queue:
+            _worker = IngestWorker(queue)
+        worker = _worker
+    worker.start()
+    return worker
+
+
+def submit_ingest(pdfs, docs_path=None, db_path=None):
+    """
+    Queue files for background ingestion and return right away
+
+    Parameters:
+    - pdfs (list): Names of the PDF files
+    - docs_path (str, optional): Folder of the files. Defaults to DOCS_PATH from the config
+    - db_path (str, optional): Vector DB folder they go to. Defaults to VECTOR_DB_PATH from the config
+
+    Returns:
+    - int or None: ID of the job, or None when the files were already waiting
+    """
+    worker = get_ingest_worker()
+    job_id = worker.queue.submit(pdfs, docs_path or config.DOCS_PATH, db_path)
+    worker.wake()
+    return job_id
+
+
+def ingest_status(docs_path=None):
+    """
+    Progress of the background ingestion, for every folder or the given one (see JobQueue.status)
+    """
+    return get_job_queue().status(docs_path)
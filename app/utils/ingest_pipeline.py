@@ -0,0 +1,449 @@
+"""
+UI-independent ingestion pipeline: extract → chunk → embed → upsert.
+It reports progress through pluggable IngestProgress objects and does not import Streamlit, so it runs
+the same from the web app, a batch worker or the command line (see app/ingest.py).
+Files stream through in bounded batches: a few files are parsed ahead, and chunks are embedded and
+written in slices of UPSERT_BATCH_SIZE, so memory does not grow with the size of the corpus.
+"""
+import os
+import warnings
+import logging
+from collections import Counter
+from utils import config
+from utils.batch_embeddings import BatchGoogleGenerativeAIEmbeddings
+from utils.document_registry import DocumentRegistry, make_chunk_ids
+from utils.pdf_extract import iter_pdf_pages
+from utils.bm25_index import get_bm25_index, save_bm25_index
+from utils.fakes import is_fake_model
+from utils.chunking import dedupe_chunks, split_documents, strip_boilerplate
+from utils import metrics
+
+# Suppress ChromaDB tenant warnings (harmless when using local PersistentClient)
+chromadb_logger = logging.getLogger("chromadb")
+chromadb_logger.setLevel(logging.ERROR)  # Only show errors, not warnings
+warnings.filterwarnings("ignore", category=UserWarning, module="chromadb")
+logger = logging.getLogger(__name__)
+
+# Distances of the HNSW index of the chroma backend (see VECTOR_METRIC)
+HNSW_METRICS = ("l2", "cosine", "ip")
+
+
+class IngestProgress:
+    """
+    Receives progress events from the pipeline. The default implementation ignores them;
+    subclasses override the events they want to show (progress bar, log lines, metrics, ...)
+    """
+
+    def update(self, fraction, message):
+        """
+        Overall progress, with fraction between 0 and 1
+        """
+
+    def file_started(self, pdf, chunk_count):
+        """
+        A file was chunked; its chunks are about to be embedded and written
+        """
+
+    def chunks_written(self, pdf, count):
+        """
+        `count` more chunks of a file are in the vector DB (one embedding/upsert batch)
+        """
+
+    def file_done(self, pdf, chunk_count):
+        """
+        A file was chunked, embedded and written to the vector DB
+        """
+
+    def file_failed(self, pdf, error):
+        """
+        A file could not be ingested (it is retried on the next sync)
+        """
+
+
+def _emit(progress, event, *args):
+    """
+    Send an event to a progress object, which may only implement some of the IngestProgress methods
+    """
+    handler = getattr(progress, event, None)
+    if handler is not None:
+        handler(*args)
+
+
+class CallbackProgress(IngestProgress):
+    """
+    Adapts a plain function taking (fraction, message) to IngestProgress
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def update(self, fraction, message):
+        self.callback(fraction, message)
+
+
+def create_embedding():
+    """
+    Create the embedding client used for ingestion and queries
+
+    Returns:
+    - embedding: BatchGoogleGenerativeAIEmbeddings for the configured model
+    """
+    # Get API key from environment (loaded from the .env file by the config module)
+    api_key = os.getenv('GOOGLE_API_KEY')
+    if not api_key and not is_fake_model(config.EMBEDDING_MODEL):
+        raise ValueError("GOOGLE_API_KEY not found in environment. Please add it to your .env file.")
+    # Use batch embedding to reduce API calls and stay within free tier quota
+    # This processes 100 chunks per API call instead of 1 chunk per call
+    return BatchGoogleGenerativeAIEmbeddings(
+        model=config.EMBEDDING_MODEL,  # Use newer embedding model (text-embedding-004 by default)
+        google_api_key=api_key
+    )
+
+
+def extract_pdf_text(pdfs, max_workers=1, docs_path=None, use_cache=True):
+    """
+    Extract text from PDF documents
+
+    Parameters:
+    - pdfs (list): List of PDF documents
+    - max_workers (int, optional): Number of processes used to parse the files in parallel. Defaults to 1 (no pool)
+    - docs_path (str, optional): Folder of the PDF files. Defaults to DOCS_PATH from the config
+    - use_cache (bool, optional): Read the texts of files parsed before from the page text cache. Defaults to True
+
+    Returns:
+    - docs: List of text extracted from PDF documents
+    """
+    docs = []
+    for pdf, pages, error in iter_pdf_pages(pdfs, docs_path or config.DOCS_PATH, max_workers=max_workers, use_cache=use_cache):
+        if error is not None:
+            raise error
+        # Extend the list of documents with the pages of the PDF
+        docs.extend(pages)
+    return docs
+
+
+def get_text_chunks(docs):
+    """
+    Split text into chunks sized in tokens for the embedding model. Each file's running headers and footers
+    are removed first, and its duplicate chunks are dropped (their pages become aliases of the chunk kept)
+
+    Parameters:
+    - docs (list): List of text documents (pages, with their source in the metadata)
+
+    Returns:
+    - chunks: List of text chunks
+    """
+    pages_by_source = {}
+    for doc in docs:
+        pages_by_source.setdefault(doc.metadata.get("source"), []).append(doc)
+    chunks = []
+    for pages in pages_by_source.values():
+        chunks.extend(get_file_chunks(pages))
+    return chunks
+
+
+def get_file_chunks(pages):
+    """
+    Chunks of the pages of one file (see get_text_chunks). The pages are read in order, page by page, so a file
+    read lazily from the page text cache is never decompressed whole
+
+    Parameters:
+    - pages (sequence): Documents of the pages of the file
+
+    Returns:
+    - chunks: List of text chunks
+    """
+    if config.STRIP_BOILERPLATE:
+        pages = strip_boilerplate(pages)
+    file_chunks = split_documents(pages)
+    kept = dedupe_chunks(file_chunks)
+    metrics.count("chunks_deduplicated", len(file_chunks) - len(kept))
+    return kept
+
+
+def open_vectordb(embedding, db_path=None):
+    """
+    Open the persistent vector DB (it is created empty if it does not exist yet)
+
+    Parameters:
+    - embedding: Embedding function used by the vectorstore
+    - db_path (str, optional): Vector DB folder (e.g. the one of a corpus). Defaults to VECTOR_DB_PATH from the config
+
+    Returns:
+    - vectordb: Vectorstore backed by the folder (Chroma, or NumpyVectorStore when VECTOR_BACKEND is "numpy")
+    """
+    db_path = db_path or config.VECTOR_DB_PATH
+    # Backends are imported on first use, so importing the pipeline stays cheap
+    if config.VECTOR_BACKEND == "numpy":
+        from utils.numpy_vectorstore import NumpyVectorStore
+        return NumpyVectorStore(os.path.join(db_path, "vectors"), embedding, dtype=config.NUMPY_VECTOR_DTYPE, rescore=config.NUMPY_VECTOR_RESCORE)
+    import chromadb
+    from langchain_community.vectorstores import Chroma
+    # Use PersistentClient for local persistence (fixes tenant error)
+    # Suppress tenant warnings - they're harmless for local file storage
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        client = chromadb.PersistentClient(path=db_path)
+    # The HNSW settings are used when the collection is created; an existing one keeps its own, except ef_search
+    vectordb = Chroma(client=client, embedding_function=embedding, collection_metadata=hnsw_metadata())
+    settings = index_settings(vectordb._collection)
+    if (settings["metric"], settings["m"], settings["ef_construction"]) != (config.VECTOR_METRIC, config.HNSW_M, config.HNSW_EF_CONSTRUCTION):
+        logger.warning(
+            "The collection in '%s' was built with metric=%s, M=%s, ef_construction=%s: the configured ones only apply to new "
+            "collections (rebuild it with a snapshot export and import, see snapshot.py)",
+            db_path, settings["metric"], settings["m"], settings["ef_construction"],
+        )
+    if not set_ef_search(vectordb._collection, config.HNSW_EF_SEARCH):
+        logger.warning("This Chroma version can't change ef_search of an existing collection: HNSW_EF_SEARCH only applies to new ones")
+    return vectordb
+
+
+def hnsw_metadata(metric=None, m=None, ef_construction=None, ef_search=None):
+    """
+    Metadata of a new Chroma collection setting its HNSW index (each value defaults to the config)
+
+    Parameters:
+    - metric (str, optional): Distance, "l2", "cosine" or "ip". Defaults to VECTOR_METRIC
+    - m (int, optional): Links per node. Defaults to HNSW_M
+    - ef_construction (int, optional): Candidates explored when inserting. Defaults to HNSW_EF_CONSTRUCTION
+    - ef_search (int, optional): Candidates explored per query. Defaults to HNSW_EF_SEARCH
+
+    Returns:
+    - dict: The "hnsw:*" metadata (LangChain also reads "hnsw:space" to turn distances into relevance scores)
+
+    Raises:
+    - ValueError: If the metric is not supported
+    """
+    metric = metric or config.VECTOR_METRIC
+    if metric not in HNSW_METRICS:
+        raise ValueError(f"Unsupported vector metric {metric!r}, expected one of {HNSW_METRICS}")
+    return {
+        "hnsw:space": metric,
+        "hnsw:M": m or config.HNSW_M,
+        "hnsw:construction_ef": ef_construction or config.HNSW_EF_CONSTRUCTION,
+        "hnsw:search_ef": ef_search or config.HNSW_EF_SEARCH,
+    }
+
+
+def index_settings(collection):
+    """
+    HNSW settings of an existing Chroma collection
+
+    Returns:
+    - dict: "metric", "m", "ef_construction" and "ef_search" (None when this Chroma version does not report one)
+    """
+    # Chroma 1.x reports the live configuration; earlier versions only the metadata given at creation
+    hnsw = (getattr(collection, "configuration_json", None) or {}).get("hnsw") or {}
+    metadata = collection.metadata or {}
+    return {
+        "metric": hnsw.get("space", metadata.get("hnsw:space", "l2")),
+        "m": hnsw.get("max_neighbors", metadata.get("hnsw:M", 16)),
+        "ef_construction": hnsw.get("ef_construction", metadata.get("hnsw:construction_ef", 100)),
+        "ef_search": hnsw.get("ef_search", metadata.get("hnsw:search_ef", 10)),
+    }
+
+
+def set_ef_search(collection, ef_search):
+    """
+    Change the candidates explored per query of an existing Chroma collection (kept with the collection)
+
+    Returns:
+    - bool: False if this Chroma version can't change it after creation
+    """
+    if index_settings(collection)["ef_search"] == ef_search:
+        return True
+    try:
+        collection.modify(configuration={"hnsw": {"ef_search": ef_search}})
+    except TypeError:
+        # Chroma before 1.0: no configuration argument
+        return False
+    return True
+
+
+def count_chunks(vectordb):
+    """
+    Number of chunks stored in the vectorstore, whatever its backend
+    """
+    if hasattr(vectordb, "count"):
+        return vectordb.count()
+    return vectordb._collection.count()
+
+
+def adopt_legacy_collection(vectordb, registry, pdfs, docs_path, page_size=5000):
+    """
+    Register the chunks of a collection built before the document registry existed, so those
+    documents are not embedded again. Their chunk IDs are the random ones Chroma assigned back then.
+    This reads the collection metadata once, page by page; later startups only read the registry
+
+    Parameters:
+    - vectordb: Vectorstore
+    - registry (DocumentRegistry): Registry to fill in
+    - pdfs (list): Names of the PDF files in the docs folder
+    - docs_path (str): Folder of the PDF files
+    - page_size (int, optional): Number of chunks read per call. Defaults to 5000
+    """
+    ids_by_source = {}
+    total = count_chunks(vectordb)
+    for offset in range(0, total, page_size):
+        items = vectordb.get(limit=page_size, offset=offset, include=["metadatas"])
+        for chunk_id, metadata in zip(items["ids"], items["metadatas"]):
+            if (metadata or {}).get("chunk_id"):
+                # Written by this pipeline but not registered: a file whose ingest was interrupted, resumed by the sync
+                continue
+            source = (metadata or {}).get('source', '')
+            # Extract filename from path (e.g., "docs\file.pdf" -> "file.pdf")
+            filename = os.path.basename(source.replace('\\', '/'))
+            ids_by_source.setdefault(filename, []).append(chunk_id)
+    params = config.ingest_params()
+    adopted = [pdf for pdf in pdfs if pdf in ids_by_source]
+    plan = registry.plan(adopted, docs_path, params)
+    for pdf in adopted:
+        registry.record(pdf, plan["hashes"][pdf], ids_by_source[pdf], params, *plan["stats"][pdf], path=os.path.join(docs_path, pdf))
+
+
+def rebuild_bm25_index(vectordb, registry, bm25, page_size=5000):
+    """
+    Rebuild the BM25 index from the registered chunks stored in the vector DB
+
+    Parameters:
+    - vectordb: Vectorstore
+    - registry (DocumentRegistry): Registry listing the chunks to index
+    - bm25 (BM25Index): Index to fill (it is emptied first)
+    - page_size (int, optional): Number of chunks read per call. Defaults to 5000
+    """
+    bm25.remove(list(bm25.id_to_doc))
+    chunk_ids = registry.all_chunk_ids()
+    for start in range(0, len(chunk_ids), page_size):
+        items = vectordb.get(ids=chunk_ids[start:start + page_size], include=["documents"])
+        bm25.add_many(items["ids"], items["documents"])
+
+
+def sync_vectorstore(vectordb, pdfs, progress=None, docs_path=None, db_path=None):
+    """
+    Bring the vector DB in line with the PDF files, touching only what changed:
+    new files are chunked and added, changed files have their chunks replaced and
+    files that were deleted have their chunks deleted
+
+    Parameters:
+    - vectordb: Vectorstore to update
+    - pdfs (list): Names of the PDF files to ingest, relative to docs_path
+    - progress (IngestProgress or callable, optional): Receives progress events (any object with the IngestProgress
+      methods works). A plain function is called with (fraction_done, message)
+    - docs_path (str, optional): Folder of the PDF files. Defaults to DOCS_PATH from the config
+    - db_path (str, optional): Folder of the vector DB, where its registry and BM25 index live. Defaults to VECTOR_DB_PATH from the config
+
+    Returns:
+    - plan (dict): The files found under "new", "changed", "removed" and "unchanged", and under "failed"
+      the error message of each file that could not be ingested (it is retried on the next sync)
+    """
+    docs_path = docs_path or config.DOCS_PATH
+    db_path = db_path or config.VECTOR_DB_PATH
+    if progress is None:
+        progress = IngestProgress()
+    elif not hasattr(progress, "update"):
+        progress = CallbackProgress(progress)
+    params = config.ingest_params()
+    registry = DocumentRegistry.load(db_path)
+    if registry.is_empty() and count_chunks(vectordb) > 0:
+        adopt_legacy_collection(vectordb, registry, pdfs, docs_path)
+    plan = registry.plan(pdfs, docs_path, params)
+    plan["failed"] = {}
+
+    # The keyword index must cover the same chunks as the registry; if it does not (first run, or a
+    # previous sync stopped before saving it) it is rebuilt from the stored chunks
+    bm25 = get_bm25_index(db_path)
+    if len(bm25) != sum(entry["chunk_count"] for entry in registry.sources().values()):
+        rebuild_bm25_index(vectordb, registry, bm25)
+        save_bm25_index(bm25)
+    with metrics.span("ingest_sync", new=len(plan["new"]), changed=len(plan["changed"]), removed=len(plan["removed"])) as span:
+        try:
+            _apply_plan(vectordb, registry, bm25, plan, params, progress, docs_path)
+        finally:
+            if plan["removed"] or plan["new"] or plan["changed"]:
+                with metrics.span("bm25_save", chunks=len(bm25)):
+                    save_bm25_index(bm25)
+        span.set(failed=len(plan["failed"]))
+    return plan
+
+
+def _apply_plan(vectordb, registry, bm25, plan, params, progress, docs_path):
+    """
+    Apply the changes found by DocumentRegistry.plan to the vector DB, the registry and the BM25 index
+    """
+    for pdf in plan["touched"]:
+        registry.update_file_stat(pdf, *plan["stats"][pdf])
+
+    for source in plan["removed"]:
+        entry = registry.remove(source)
+        if entry["chunk_ids"]:
+            vectordb.delete(ids=entry["chunk_ids"])
+            bm25.remove(entry["chunk_ids"])
+
+    to_ingest = plan["new"] + plan["changed"]
+    # Chunks of small files are pooled until there are enough to fill the embedding/upsert batches
+    pending = []
+    pending_chunks = 0
+    # Files are parsed in worker processes (or read from the page text cache) and handled here as each one finishes
+    pages_by_file = iter_pdf_pages(to_ingest, docs_path, max_workers=config.PDF_EXTRACT_WORKERS, hashes=plan["hashes"])
+    for i, (pdf, pages, error) in enumerate(pages_by_file):
+        progress.update(i / len(to_ingest), f"📄 Processing {pdf} ({i + 1}/{len(to_ingest)})...")
+        if error is not None:
+            # Not registered, so the file is tried again on the next sync
+            plan["failed"][pdf] = str(error)
+            _emit(progress, "file_failed", pdf, error)
+            continue
+        with metrics.span("chunking", file=pdf, pages=len(pages)) as span:
+            chunks = get_file_chunks(pages)
+            span.set(chunks=len(chunks))
+        chunk_ids = make_chunk_ids(pdf, plan["hashes"][pdf], params, len(chunks))
+        for chunk, chunk_id in zip(chunks, chunk_ids):
+            chunk.metadata["chunk_id"] = chunk_id
+        _emit(progress, "file_started", pdf, len(chunks))
+        pending.append((pdf, chunks, chunk_ids))
+        pending_chunks += len(chunks)
+        if pending_chunks >= config.UPSERT_BATCH_SIZE:
+            _write_files(vectordb, registry, bm25, pending, plan, params, progress, docs_path)
+            pending = []
+            pending_chunks = 0
+    _write_files(vectordb, registry, bm25, pending, plan, params, progress, docs_path)
+    if to_ingest or plan["removed"]:
+        ingested = len(to_ingest) - len(plan["failed"])
+        progress.update(1.0, f"✅ Complete! {ingested} file(s) ingested, {len(plan['removed'])} removed, {len(plan['failed'])} failed")
+
+
+def _write_files(vectordb, registry, bm25, files, plan, params, progress, docs_path):
+    """
+    Embed and write the chunks of a group of files, then register each file
+    """
+    chunks = [chunk for _, file_chunks, _ in files for chunk in file_chunks]
+    chunk_ids = [chunk_id for _, _, file_chunk_ids in files for chunk_id in file_chunk_ids]
+    owners = [pdf for pdf, file_chunks, _ in files for _ in file_chunks]
+    # Chunk IDs are stable, so the slices written by an ingest that was interrupted (restart, crash) are found
+    # in the vector DB and skipped. Slices are written in order: once one is missing, the next ones are too
+    resuming = True
+    # Upsert in slices to stay under Chroma's maximum batch size
+    for start in range(0, len(chunks), config.UPSERT_BATCH_SIZE):
+        batch = chunks[start:start + config.UPSERT_BATCH_SIZE]
+        batch_ids = chunk_ids[start:start + config.UPSERT_BATCH_SIZE]
+        if resuming and len(vectordb.get(ids=batch_ids, include=[])["ids"]) == len(batch_ids):
+            metrics.count("chunks_resumed", len(batch))
+        else:
+            resuming = False
+            # Embedding happens inside add_documents; its batches are recorded as their own spans
+            with metrics.span("chroma_upsert", chunks=len(batch)):
+                vectordb.add_documents(batch, ids=batch_ids)
+            metrics.count("chunks_ingested", len(batch))
+        for pdf, count in Counter(owners[start:start + config.UPSERT_BATCH_SIZE]).items():
+            _emit(progress, "chunks_written", pdf, count)
+    bm25.add_many(chunk_ids, [chunk.page_content for chunk in chunks])
+    for pdf, _, file_chunk_ids in files:
+        # New chunks are in place, so the old ones of a changed file can go now
+        old_entry = registry.get(pdf)
+        if old_entry:
+            stale_ids = list(set(old_entry["chunk_ids"]) - set(file_chunk_ids))
+            if stale_ids:
+                vectordb.delete(ids=stale_ids)
+                bm25.remove(stale_ids)
+        # Registered as soon as its chunks are stored, so an interrupted ingest resumes where it stopped
+        registry.record(pdf, plan["hashes"][pdf], file_chunk_ids, params, *plan["stats"][pdf], path=os.path.join(docs_path, pdf))
+        _emit(progress, "file_done", pdf, len(file_chunk_ids))
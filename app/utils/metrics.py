@@ -0,0 +1,325 @@
+"""
+Lightweight instrumentation: span timers, counters and histograms for ingestion and chat.
+
+Spans are nested through a context variable, so every span of a chat turn or an ingest run shares a
+trace ID and can be grouped afterwards. Finished spans go to pluggable sinks:
+- JsonLogSink: one structured JSON line per span (METRICS_LOG=stderr or a file path)
+- Prometheus text exposition, written to a file (METRICS_PROM_FILE) and/or served over HTTP (METRICS_PORT)
+- profile(): optional cProfile hook for single requests (PROFILE_DIR)
+With none of these configured, metrics are still aggregated in memory and cost a few microseconds per span.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import atexit
+import pstats
+import cProfile
+import threading
+import contextvars
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from utils import config
+
+METRIC_PREFIX = "aiforsm"
+# Histogram buckets in seconds, from a fast BM25 lookup to a slow LLM answer
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Span:
+    """
+    A timed operation. Attributes can be attached while it runs with set()
+    """
+
+    def __init__(self, name, parent=None, **attributes):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex[:16]
+        self.span_id = uuid.uuid4().hex[:8]
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = attributes
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.seconds = None
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self):
+        return {
+            "span": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "started_at": round(self.started_at, 6),
+            "seconds": round(self.seconds, 6) if self.seconds is not None else None,
+            "error": self.error,
+            **self.attributes,
+        }
+
+
+class Metrics:
+    """
+    In-memory registry of counters and duration histograms, plus the sinks that receive finished spans
+    """
+
+    def __init__(self):
+        self.counters = {}     # (name, labels) -> value
+        self.histograms = {}   # (name, labels) -> [bucket counts..., sum, count]
+        self.sinks = []
+        self._lock = threading.Lock()
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def count(self, name, amount=1, **labels):
+        """
+        Increase a counter
+        """
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        """
+        Record a duration in a histogram
+        """
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * len(DURATION_BUCKETS) + [0.0, 0]
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """
+        Time a block of code as a span nested in the current one (if any)
+
+        Parameters:
+        - name (str): Stage name, e.g. "pdf_parse" or "retrieval"
+        - attributes: Extra fields recorded with the span (not used as metric labels)
+
+        Yields:
+        - Span: The running span, to attach more attributes with set()
+        """
+        span = Span(name, parent=_current_span.get(), **attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"[:300]
+            raise
+        finally:
+            span.seconds = time.perf_counter() - span._start
+            _current_span.reset(token)
+            self.record_span(span)
+
+    def record(self, name, seconds, parent=None, error=None, **attributes):
+        """
+        Record a span that was timed elsewhere (e.g. in a worker process or across a generator)
+
+        Parameters:
+        - name (str): Stage name
+        - seconds (float): Duration
+        - parent (Span, optional): Enclosing span. Defaults to the current span
+        - error (str, optional): Error message if the operation failed
+        - attributes: Extra fields recorded with the span
+        """
+        span = Span(name, parent=parent or _current_span.get(), **attributes)
+        span.started_at -= seconds
+        span.seconds = seconds
+        span.error = error
+        self.record_span(span)
+
+    def record_span(self, span):
+        """
+        Aggregate a finished span and hand it to the sinks
+        """
+        self.observe(f"{span.name}_seconds", span.seconds)
+        if span.error:
+            self.count(f"{span.name}_errors")
+        for sink in self.sinks:
+            try:
+                sink.emit(span)
+            except Exception:
+                # Instrumentation must never break the request it measures
+                pass
+
+    def prometheus_text(self):
+        """
+        Render every metric in the Prometheus text exposition format
+        """
+        lines = []
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = {key: list(value) for key, value in self.histograms.items()}
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name}_total counter")
+            for (metric, labels), value in counters.items():
+                if metric == name:
+                    lines.append(f"{METRIC_PREFIX}_{name}_total{_format_labels(labels)} {value}")
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} histogram")
+            for (metric, labels), values in histograms.items():
+                if metric != name:
+                    continue
+                for bound, bucket in zip(DURATION_BUCKETS, values):
+                    lines.append(f"{METRIC_PREFIX}_{name}_bucket{_format_labels(labels + (('le', str(bound)),))} {bucket}")
+                lines.append(f"{METRIC_PREFIX}_{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {values[-1]}")
+                lines.append(f"{METRIC_PREFIX}_{name}_sum{_format_labels(labels)} {values[-2]:.6f}")
+                lines.append(f"{METRIC_PREFIX}_{name}_count{_format_labels(labels)} {values[-1]}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """
+        Counters and histogram totals as a plain dictionary (for tests, benchmarks and debugging)
+        """
+        with self._lock:
+            return {
+                "counters": {f"{name}{dict(labels) or ''}": value for (name, labels), value in self.counters.items()},
+                "histograms": {
+                    f"{name}{dict(labels) or ''}": {"count": values[-1], "sum": round(values[-2], 6)}
+                    for (name, labels), values in self.histograms.items()
+                },
+            }
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class JsonLogSink:
+    """
+    Writes one JSON line per finished span to a stream or a file
+    """
+
+    def __init__(self, target="stderr"):
+        self._lock = threading.Lock()
+        self._stream = sys.stderr if target == "stderr" else open(target, "a", encoding="utf-8")
+
+    def emit(self, span):
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock:
+            self._stream.write(line + "\n")
+            self._stream.flush()
+
+
+class PrometheusFileSink:
+    """
+    Rewrites a Prometheus text file (e.g. for node_exporter's textfile collector) at most every `interval` seconds
+    """
+
+    def __init__(self, registry, path, interval=5.0):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self._last_write = 0.0
+        # Spans recorded in the last interval are written when the process exits
+        atexit.register(self.flush)
+
+    def emit(self, span):
+        if time.monotonic() - self._last_write >= self.interval:
+            self.flush()
+
+    def flush(self):
+        self._last_write = time.monotonic()
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.registry.prometheus_text())
+        os.replace(tmp_path, self.path)
+
+
+def start_metrics_server(registry, port, host="0.0.0.0"):
+    """
+    Serve the metrics in Prometheus text format on http://host:port/metrics from a daemon thread
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip("/") != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@contextmanager
+def profile(name, enabled=None):
+    """
+    Profile a single request with cProfile and save the stats to PROFILE_DIR
+
+    Parameters:
+    - name (str): Label used in the file name
+    - enabled (bool, optional): Force profiling on or off. Defaults to on when PROFILE_DIR is set
+
+    Yields:
+    - str or None: Path the stats will be written to (None when profiling is off)
+    """
+    if enabled is None:
+        enabled = bool(config.PROFILE_DIR)
+    if not enabled:
+        yield None
+        return
+    directory = config.PROFILE_DIR or "profiles"
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}.prof")
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield path
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        # A readable summary next to the binary stats (open the .prof with snakeviz or pstats for more)
+        with open(path + ".txt", "w", encoding="utf-8") as f:
+            pstats.Stats(profiler, stream=f).sort_stats("cumulative").print_stats(40)
+
+
+# Process-wide registry, with the sinks selected in the configuration
+metrics = Metrics()
+span = metrics.span
+record = metrics.record
+count = metrics.count
+observe = metrics.observe
+
+
+def current_span():
+    """
+    Return the span running in this context (None outside any span)
+    """
+    return _current_span.get()
+
+if config.METRICS_LOG:
+    metrics.add_sink(JsonLogSink(config.METRICS_LOG))
+if config.METRICS_PROM_FILE:
+    metrics.add_sink(PrometheusFileSink(metrics, config.METRICS_PROM_FILE))
+if config.METRICS_PORT:
+    try:
+        start_metrics_server(metrics, config.METRICS_PORT)
+    except OSError:
+        # Another process (e.g. a second Streamlit worker) already serves the port
+        pass
@@ -0,0 +1,669 @@
+"""
+Compact vector store kept in plain NumPy files, an alternative to Chroma for mid-sized corpora.
+
+Embeddings are normalized and stored as a float16 or int8-quantized matrix (2x or 4x smaller than float32).
+Searches memory-map the files read-only instead of loading them, so every process that opens the same
+store (e.g. several Streamlit workers) shares one copy in the OS page cache. A search is an exact,
+vectorized scan over the matrix; with rescoring, the best candidates of the quantized scan are scored
+again against float32 copies read from disk (only the candidate rows are paged in).
+
+Metadata is kept in columns next to the matrix: "source" as codes into a dictionary of file names,
+"page" as integers, and any other fields as JSON. Chunk texts sit in one blob with an offsets column.
+
+Files are append-only. A write appends rows to every column and then replaces the small manifest.json
+that holds the row count, so readers never see a half-written batch and a crash at worst leaves unused
+bytes at the end of the files (cut on the next write). Deleted rows are cleared in a "live" mask; once
+they are a large part of the store, the live rows are copied into a new generation of files.
+"""
+import os
+import json
+import uuid
+import threading
+from typing import Any, Iterable, List, Optional, Tuple
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+from langchain_community.vectorstores.utils import maximal_marginal_relevance
+
+try:
+    import fcntl
+except ImportError:  # Windows: writes are only serialized within a process
+    fcntl = None
+
+FORMAT_VERSION = 1
+SUPPORTED_DTYPES = ("float16", "int8")
+# Rows scored per step of a search (bounds the float32 copy made of the matrix block)
+BLOCK_ROWS = 8192
+# Candidates rescored per requested result when rescoring is on
+RESCORE_FACTOR = 4
+# Compact when deleted rows are more than this share of the store (and at least COMPACT_MIN_ROWS)
+COMPACT_RATIO = 0.3
+COMPACT_MIN_ROWS = 1000
+
+
+class _ArrayColumn:
+    """
+    Fixed-width rows appended to a raw binary file and read through a read-only memory map
+    """
+
+    def __init__(self, path, dtype, width=None):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.width = width
+        self.row_bytes = self.dtype.itemsize * (width or 1)
+
+    def append(self, values):
+        with open(self.path, "ab") as f:
+            f.write(np.ascontiguousarray(values, dtype=self.dtype).tobytes())
+
+    def truncate(self, rows):
+        with open(self.path, "ab") as f:
+            f.truncate(rows * self.row_bytes)
+
+    def view(self, rows, mode="r"):
+        shape = (rows, self.width) if self.width else (rows,)
+        if rows == 0:
+            return np.zeros(shape, dtype=self.dtype)
+        return np.memmap(self.path, dtype=self.dtype, mode=mode, shape=shape)
+
+
+class _BlobColumn:
+    """
+    Variable-length values (UTF-8 texts) stored back to back, with the end offset of each row in a second file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.ends = _ArrayColumn(path + ".end", np.int64)
+
+    def append(self, values, rows):
+        data = [value.encode("utf-8") for value in values]
+        start = int(self.ends.view(rows)[-1]) if rows else 0
+        with open(self.path, "ab") as f:
+            f.write(b"".join(data))
+        self.ends.append(start + np.cumsum([len(item) for item in data], dtype=np.int64))
+
+    def truncate(self, rows):
+        size = int(self.ends.view(rows)[-1]) if rows else 0
+        self.ends.truncate(rows)
+        with open(self.path, "ab") as f:
+            f.truncate(size)
+
+    def reader(self, rows):
+        ends = self.ends.view(rows)
+        size = int(ends[-1]) if rows else 0
+        blob = np.memmap(self.path, dtype=np.uint8, mode="r", shape=(size,)) if size else np.zeros(0, dtype=np.uint8)
+
+        def read(row):
+            start = int(ends[row - 1]) if row else 0
+            return bytes(blob[start:int(ends[row])]).decode("utf-8")
+        return read
+
+
+class _LineColumn:
+    """
+    JSON values, one per line. The manifest keeps the committed size, so reads only parse the lines added since the last read
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def append(self, values, size):
+        """
+        Append values after the first `size` bytes. Returns the new size
+        """
+        data = "".join(json.dumps(value) + "\n" for value in values).encode("utf-8")
+        with open(self.path, "ab") as f:
+            f.truncate(size)
+            f.write(data)
+        return size + len(data)
+
+    def read(self, start, end):
+        """
+        Read the values stored between two byte offsets
+        """
+        if end <= start:
+            return []
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            data = f.read(end - start)
+        return [json.loads(line) for line in data.splitlines()]
+
+
+def _column_paths(column):
+    """
+    Files of a column (blob columns have a second file for the offsets)
+    """
+    ends = getattr(column, "ends", None)
+    return [column.path] + ([ends.path] if ends is not None else [])
+
+
+class _WriteLock:
+    """
+    Serializes the writers of a store: its thread lock, plus an exclusive file lock between processes where available
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.file = None
+
+    def __enter__(self):
+        self.store._lock.acquire()
+        self.file = None
+        try:
+            os.makedirs(self.store.path, exist_ok=True)
+            if fcntl is not None:
+                self.file = open(os.path.join(self.store.path, "write.lock"), "a")
+                fcntl.flock(self.file, fcntl.LOCK_EX)
+            self.store._refresh()
+        except BaseException:
+            self.__exit__(None, None, None)
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.store._lock.release()
+
+
+class _StoreView:
+    """
+    Read-only state of a store at one manifest: its memory maps, row count and lookup tables. A view is taken under
+    the store lock and then read without it, so concurrent searches are scored in parallel (NumPy releases the GIL).
+    Rows written later are not seen, and the files of a compacted generation stay readable through the view's maps
+    """
+
+    def __init__(self, store):
+        self.rows = store._manifest["rows"]
+        self.dim = store._manifest["dim"]
+        self.live = store._live
+        self.vectors = getattr(store, "_vectors", None)
+        self.scales = getattr(store, "_scales", None)
+        self.full = getattr(store, "_full", None)
+        self.source_codes = getattr(store, "_source_codes", None)
+        self.pages = getattr(store, "_pages", None)
+        self.read_text = getattr(store, "_read_text", None)
+        self.read_meta = getattr(store, "_read_meta", None)
+        # Only ever appended to (a compaction makes new ones), so entries of the rows of this view do not change
+        self.ids = store._ids
+        self.sources = store._sources
+        self.source_code = store._source_code
+
+    def metadata(self, row):
+        metadata = json.loads(self.read_meta(row))
+        code = int(self.source_codes[row])
+        if code >= 0:
+            metadata["source"] = self.sources[code]
+        page = int(self.pages[row])
+        if page >= 0:
+            metadata["page"] = page
+        return metadata
+
+    def document(self, row):
+        return Document(page_content=self.read_text(row), metadata=self.metadata(row))
+
+    def row_vectors(self, rows):
+        """
+        float32 embeddings of the given rows (exact when rescoring copies exist, dequantized otherwise)
+        """
+        if self.full is not None:
+            return np.asarray(self.full[rows])
+        vectors = np.asarray(self.vectors[rows], dtype=np.float32)
+        if self.scales is not None:
+            vectors *= self.scales[rows][:, None]
+        return vectors
+
+    def filter_mask(self, where):
+        """
+        Boolean mask of the rows whose metadata equals every value of the filter
+        """
+        mask = np.asarray(self.live).astype(bool)
+        if not self.rows:
+            return mask
+        for key, value in where.items():
+            if key == "source" and isinstance(value, str):
+                mask &= np.asarray(self.source_codes) == self.source_code.get(value, -2)
+            elif key == "page" and isinstance(value, int):
+                mask &= np.asarray(self.pages) == value
+            else:
+                # Other fields live in the JSON column: only the rows still matching are decoded
+                for row in np.flatnonzero(mask):
+                    if self.metadata(row).get(key) != value:
+                        mask[row] = False
+        return mask
+
+    def search(self, query, k, filter=None, fetch_rows=None):
+        """
+        Exact top-k search for a normalized query embedding
+
+        Returns:
+        - rows (np.ndarray), similarities (np.ndarray): Best rows first
+        """
+        if self.rows == 0 or k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        if len(query) != self.dim:
+            raise ValueError(f"Query dimension {len(query)} does not match the store ({self.dim})")
+        mask = self.filter_mask(filter) if filter else np.asarray(self.live).astype(bool)
+        scores = np.empty(self.rows, dtype=np.float32)
+        # Scan block by block: only one block is ever converted to float32
+        for start in range(0, self.rows, BLOCK_ROWS):
+            end = min(start + BLOCK_ROWS, self.rows)
+            block_scores = self.vectors[start:end].astype(np.float32) @ query
+            if self.scales is not None:
+                block_scores *= self.scales[start:end]
+            scores[start:end] = block_scores
+        scores[~mask] = -np.inf
+        candidates = min(int(mask.sum()), fetch_rows or (k * RESCORE_FACTOR if self.full is not None else k))
+        if candidates == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        top = np.argpartition(-scores, candidates - 1)[:candidates]
+        if self.full is not None:
+            # Rescore the candidates of the quantized scan with the float32 embeddings (read in file order)
+            top = np.sort(top)
+            scores_top = np.asarray(self.full[top]) @ query
+        else:
+            scores_top = scores[top]
+        order = np.argsort(-scores_top, kind="stable")
+        return top[order], scores_top[order]
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    LangChain vector store over memory-mapped NumPy files (see the module docstring).
+    Similarity is cosine; scores returned by *_with_score methods are cosine distances (lower is closer), like Chroma
+    """
+
+    def __init__(self, path, embedding, dtype="float16", rescore=None):
+        """
+        Open the store in the given folder, creating it on first write
+
+        Parameters:
+        - path (str): Folder of the store files
+        - embedding: Embedding function used for texts and queries
+        - dtype (str, optional): "float16" or "int8", used when the store is created (an existing store keeps its own). Defaults to "float16"
+        - rescore (bool, optional): Keep float32 copies to rescore the candidates of a search. Defaults to on for int8 only
+        """
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"Unsupported vector dtype {dtype!r}, expected one of {SUPPORTED_DTYPES}")
+        self.path = path
+        self._embedding = embedding
+        self._default_dtype = dtype
+        self._default_rescore = (dtype == "int8") if rescore is None else bool(rescore)
+        self._lock = threading.RLock()
+        self._manifest_stat = None
+        self._reset({"format": FORMAT_VERSION, "dtype": dtype, "rescore": self._default_rescore, "dim": None,
+                     "generation": 0, "rows": 0, "deleted": 0, "ids_bytes": 0, "sources_bytes": 0})
+        self._refresh()
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    # ----- files and state -----
+
+    def _columns(self, manifest):
+        generation = manifest["generation"]
+        dim = manifest["dim"]
+        name = lambda column: os.path.join(self.path, f"{column}-{generation}.bin")
+        columns = {
+            "vectors": _ArrayColumn(name("vectors"), manifest["dtype"], dim),
+            "live": _ArrayColumn(name("live"), np.uint8),
+            "source": _ArrayColumn(name("source"), np.int32),
+            "page": _ArrayColumn(name("page"), np.int32),
+            "text": _BlobColumn(name("text")),
+            "meta": _BlobColumn(name("meta")),
+            "ids": _LineColumn(name("ids")),
+            "sources": _LineColumn(name("sources")),
+        }
+        if manifest["dtype"] == "int8":
+            columns["scales"] = _ArrayColumn(name("scales"), np.float32)
+        if manifest["rescore"]:
+            columns["full"] = _ArrayColumn(name("full"), np.float32, dim)
+        return columns
+
+    def _reset(self, manifest):
+        self._manifest = manifest
+        self._ids = []
+        self._ids_bytes = 0
+        self._row_of = {}
+        self._sources = []
+        self._sources_bytes = 0
+        self._source_code = {}
+        self._map(manifest)
+
+    def _map(self, manifest):
+        """
+        Memory-map the first manifest["rows"] rows of every column and read the new ids and sources
+        """
+        rows = manifest["rows"]
+        if manifest["dim"] is None:
+            self._columns_by_name = None
+            self._live = np.zeros(0, dtype=np.uint8)
+            return
+        columns = self._columns_by_name = self._columns(manifest)
+        for row, chunk_id in enumerate(columns["ids"].read(self._ids_bytes, manifest["ids_bytes"]), start=len(self._ids)):
+            self._row_of[chunk_id] = row
+            self._ids.append(chunk_id)
+        self._ids_bytes = manifest["ids_bytes"]
+        for code, source in enumerate(columns["sources"].read(self._sources_bytes, manifest["sources_bytes"]), start=len(self._sources)):
+            self._source_code[source] = code
+            self._sources.append(source)
+        self._sources_bytes = manifest["sources_bytes"]
+        self._vectors = columns["vectors"].view(rows)
+        self._live = columns["live"].view(rows)
+        self._source_codes = columns["source"].view(rows)
+        self._pages = columns["page"].view(rows)
+        self._scales = columns["scales"].view(rows) if "scales" in columns else None
+        self._full = columns["full"].view(rows) if "full" in columns else None
+        self._read_text = columns["text"].reader(rows)
+        self._read_meta = columns["meta"].reader(rows)
+
+    def _refresh(self):
+        """
+        Pick up writes made by other processes (or other instances) since the last call
+        """
+        manifest_path = os.path.join(self.path, "manifest.json")
+        for attempt in range(3):
+            try:
+                stat = os.stat(manifest_path)
+            except FileNotFoundError:
+                return
+            key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if key == self._manifest_stat:
+                return
+            try:
+                with open(manifest_path, encoding="utf-8") as f:
+                    manifest = json.load(f)
+                if manifest.get("format") != FORMAT_VERSION:
+                    raise ValueError(f"Unsupported vector store format {manifest.get('format')} in {self.path}")
+                if manifest["generation"] != self._manifest["generation"] or manifest["dim"] != self._manifest["dim"]:
+                    self._reset(manifest)
+                else:
+                    self._map(manifest)
+                self._manifest = manifest
+                self._manifest_stat = key
+                return
+            except FileNotFoundError:
+                # A compaction removed the files of the generation just read: read the manifest again
+                self._manifest_stat = None
+                if attempt == 2:
+                    raise
+
+    def _write_manifest(self, manifest):
+        manifest_path = os.path.join(self.path, "manifest.json")
+        tmp_path = manifest_path + f".{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, manifest_path)
+        self._manifest_stat = None
+        self._refresh()
+
+    def _write_lock(self):
+        """
+        Serialize writers (see _WriteLock)
+        """
+        return _WriteLock(self)
+
+    # ----- writes -----
+
+    def _prepare_vectors(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2:
+            raise ValueError("Expected a 2D array of embeddings")
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms > 0, norms, 1.0)
+
+    def upsert_vectors(self, ids, vectors, texts, metadatas=None):
+        """
+        Insert precomputed embeddings, replacing the rows of IDs that already exist
+
+        Parameters:
+        - ids (list): Chunk IDs
+        - vectors (list or np.ndarray): One embedding per ID
+        - texts (list): Chunk texts
+        - metadatas (list, optional): Metadata dict of each chunk
+        """
+        if not ids:
+            return
+        metadatas = metadatas or [{} for _ in ids]
+        # Last occurrence wins when an ID is repeated within the batch
+        last = {chunk_id: i for i, chunk_id in enumerate(ids)}
+        keep = sorted(last.values())
+        ids = [ids[i] for i in keep]
+        texts = [texts[i] for i in keep]
+        metadatas = [metadatas[i] or {} for i in keep]
+        vectors = self._prepare_vectors(vectors)[keep]
+
+        with self._write_lock():
+            manifest = dict(self._manifest)
+            if manifest["dim"] is None:
+                manifest["dim"] = int(vectors.shape[1])
+            elif vectors.shape[1] != manifest["dim"]:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match the store ({manifest['dim']})")
+            rows = manifest["rows"]
+            columns = self._columns(manifest)
+            os.makedirs(self.path, exist_ok=True)
+            # Drop whatever a writer that crashed left after the last committed row
+            for column in columns.values():
+                if hasattr(column, "truncate"):
+                    column.truncate(rows)
+
+            source_codes = []
+            new_sources = []
+            known = dict(self._source_code)
+            for metadata in metadatas:
+                source = metadata.get("source")
+                if not isinstance(source, str):
+                    source_codes.append(-1)
+                    continue
+                if source not in known:
+                    known[source] = len(self._sources) + len(new_sources)
+                    new_sources.append(source)
+                source_codes.append(known[source])
+            pages = [metadata["page"] if isinstance(metadata.get("page"), int) and not isinstance(metadata.get("page"), bool) else -1 for metadata in metadatas]
+            extras = [json.dumps({key: value for key, value in metadata.items()
+                                  if not (key == "source" and code >= 0) and not (key == "page" and page >= 0)})
+                      for metadata, code, page in zip(metadatas, source_codes, pages)]
+
+            if manifest["dtype"] == "int8":
+                scales = np.abs(vectors).max(axis=1) / 127.0
+                scales[scales == 0] = 1.0
+                columns["vectors"].append(np.round(vectors / scales[:, None]).astype(np.int8))
+                columns["scales"].append(scales)
+            else:
+                columns["vectors"].append(vectors.astype(np.float16))
+            if "full" in columns:
+                columns["full"].append(vectors)
+            columns["live"].append(np.ones(len(ids), dtype=np.uint8))
+            columns["source"].append(source_codes)
+            columns["page"].append(pages)
+            columns["text"].append(texts, rows)
+            columns["meta"].append(extras, rows)
+            ids_bytes = columns["ids"].append(ids, manifest["ids_bytes"])
+            sources_bytes = columns["sources"].append(new_sources, manifest["sources_bytes"])
+
+            # The new rows become visible with the manifest; the rows they replace are cleared right after
+            replaced = [self._row_of[chunk_id] for chunk_id in ids if chunk_id in self._row_of]
+            manifest.update(rows=rows + len(ids), ids_bytes=ids_bytes, sources_bytes=sources_bytes)
+            self._write_manifest(manifest)
+            self._clear_rows(replaced)
+
+    def _clear_rows(self, rows):
+        """
+        Mark rows as deleted (the caller holds the write lock), compacting the store when many are
+        """
+        rows = [row for row in rows if self._live[row]]
+        if not rows:
+            return
+        live = self._columns_by_name["live"].view(self._manifest["rows"], mode="r+")
+        live[rows] = 0
+        live.flush()
+        manifest = dict(self._manifest)
+        manifest["deleted"] += len(rows)
+        if manifest["deleted"] >= max(COMPACT_MIN_ROWS, COMPACT_RATIO * manifest["rows"]):
+            self._compact(manifest)
+        else:
+            self._write_manifest(manifest)
+
+    def _compact(self, manifest):
+        """
+        Copy the live rows into a new generation of files, then drop the old ones
+        """
+        old_columns = self._columns_by_name
+        keep = np.flatnonzero(np.asarray(self._live))
+        new_manifest = dict(manifest, generation=manifest["generation"] + 1, rows=int(len(keep)), deleted=0)
+        columns = self._columns(new_manifest)
+        for column in columns.values():
+            for path in _column_paths(column):
+                if os.path.exists(path):
+                    os.remove(path)
+        ids_bytes = 0
+        for start in range(0, len(keep), BLOCK_ROWS):
+            rows = keep[start:start + BLOCK_ROWS]
+            columns["vectors"].append(self._vectors[rows])
+            if self._scales is not None:
+                columns["scales"].append(self._scales[rows])
+            if self._full is not None:
+                columns["full"].append(self._full[rows])
+            columns["live"].append(np.ones(len(rows), dtype=np.uint8))
+            columns["source"].append(self._source_codes[rows])
+            columns["page"].append(self._pages[rows])
+            columns["text"].append([self._read_text(row) for row in rows], start)
+            columns["meta"].append([self._read_meta(row) for row in rows], start)
+            ids_bytes = columns["ids"].append([self._ids[row] for row in rows], ids_bytes)
+        new_manifest.update(ids_bytes=ids_bytes, sources_bytes=columns["sources"].append(self._sources, 0))
+        self._write_manifest(new_manifest)
+        # Processes that still map the old files keep reading them until their next refresh
+        for column in old_columns.values():
+            for path in _column_paths(column):
+                try:
+                    os.remove(path)
+                except OSError:
+                    # Still open elsewhere on Windows: left behind
+                    pass
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        """
+        Embed and store texts (existing IDs are replaced, like Chroma's upsert)
+
+        Returns:
+        - ids (list): IDs of the stored texts
+        """
+        texts = list(texts)
+        ids = list(ids) if ids is not None else [uuid.uuid4().hex for _ in texts]
+        if texts:
+            self.upsert_vectors(ids, self._embedding.embed_documents(texts), texts, metadatas)
+        return ids
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        """
+        Delete chunks by ID (unknown IDs are ignored)
+        """
+        if not ids:
+            return True
+        with self._write_lock():
+            self._clear_rows([self._row_of[chunk_id] for chunk_id in ids if chunk_id in self._row_of])
+        return True
+
+    # ----- reads -----
+
+    def count(self):
+        """
+        Number of chunks in the store
+        """
+        with self._lock:
+            self._refresh()
+            return int(self._manifest["rows"] - self._manifest["deleted"])
+
+    def _view(self):
+        """
+        Take a consistent view of the rows written so far, read without holding the lock
+        """
+        with self._lock:
+            self._refresh()
+            return _StoreView(self)
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=None, **kwargs):
+        """
+        Read stored chunks, with the same arguments and result shape as Chroma's get()
+
+        Parameters:
+        - ids (list, optional): IDs to read (missing ones are skipped). Defaults to all chunks
+        - where (dict, optional): Metadata equality filter
+        - limit (int, optional): Maximum number of chunks
+        - offset (int, optional): Number of chunks to skip
+        - include (list, optional): Any of "documents", "metadatas", "embeddings". Defaults to documents and metadatas
+
+        Returns:
+        - dict: "ids" and the included fields, as lists in the same order
+        """
+        include = ["documents", "metadatas"] if include is None else include
+        with self._lock:
+            self._refresh()
+            view = _StoreView(self)
+            if ids is not None:
+                # Looked up under the lock: a concurrent upsert moves the row of an ID
+                ids = [ids] if isinstance(ids, str) else ids
+                rows = [self._row_of[chunk_id] for chunk_id in ids if chunk_id in self._row_of]
+                rows = [row for row in rows if view.live[row]]
+        if ids is None:
+            rows = np.flatnonzero(np.asarray(view.live)).tolist()
+        if where:
+            mask = view.filter_mask(where)
+            rows = [row for row in rows if mask[row]]
+        start = offset or 0
+        rows = rows[start:start + limit if limit is not None else None]
+        result = {"ids": [view.ids[row] for row in rows]}
+        if "documents" in include:
+            result["documents"] = [view.read_text(row) for row in rows]
+        if "metadatas" in include:
+            result["metadatas"] = [view.metadata(row) for row in rows]
+        if "embeddings" in include:
+            result["embeddings"] = view.row_vectors(rows).tolist() if rows else []
+        return result
+
+    def _search(self, query, k, filter=None, fetch_rows=None):
+        """
+        Exact top-k search for a query embedding, scored outside the lock
+
+        Returns:
+        - view (_StoreView), rows (np.ndarray), similarities (np.ndarray): The view searched (to read the rows from), best rows first
+        """
+        query = self._prepare_vectors([query])[0]
+        view = self._view()
+        rows, similarities = view.search(query, k, filter=filter, fetch_rows=fetch_rows)
+        return view, rows, similarities
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4, filter: Optional[dict] = None) -> List[Tuple[Document, float]]:
+        view, rows, similarities = self._search(embedding, k, filter=filter)
+        return [(view.document(row), float(1.0 - similarity)) for row, similarity in zip(rows[:k], similarities[:k])]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, filter: Optional[dict] = None, **kwargs: Any) -> List[Document]:
+        return [document for document, _ in self.similarity_search_by_vector_with_score(embedding, k, filter=filter)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: Optional[dict] = None, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self._embedding.embed_query(query), k, filter=filter)
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[dict] = None, **kwargs: Any) -> List[Document]:
+        return [document for document, _ in self.similarity_search_with_score(query, k, filter=filter)]
+
+    def _select_relevance_score_fn(self):
+        return self._cosine_relevance_score_fn
+
+    def max_marginal_relevance_search_by_vector(self, embedding: List[float], k: int = 4, fetch_k: int = 20, lambda_mult: float = 0.5, filter: Optional[dict] = None, **kwargs: Any) -> List[Document]:
+        view, rows, _ = self._search(embedding, fetch_k, filter=filter, fetch_rows=fetch_k)
+        if len(rows) == 0:
+            return []
+        selected = maximal_marginal_relevance(np.asarray(embedding, dtype=np.float32), view.row_vectors(rows), lambda_mult=lambda_mult, k=k)
+        return [view.document(rows[i]) for i in selected]
+
+    def max_marginal_relevance_search(self, query: str, k: int = 4, fetch_k: int = 20, lambda_mult: float = 0.5, filter: Optional[dict] = None, **kwargs: Any) -> List[Document]:
+        return self.max_marginal_relevance_search_by_vector(self._embedding.embed_query(query), k, fetch_k, lambda_mult, filter=filter)
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding, metadatas: Optional[List[dict]] = None, ids: Optional[List[str]] = None, path: str = "numpy_vectorstore", **kwargs: Any) -> "NumpyVectorStore":
+        store = cls(path, embedding, **kwargs)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
@@ -0,0 +1,248 @@
+"""
+Persistent cache of the text extracted from PDF files, so that re-chunking, re-embedding or rebuilding the vector DB
+does not parse the files again (pypdf is the slowest CPU stage of the ingestion).
+
+Entries are keyed by the SHA-256 of the file content and the parser version: a renamed or copied file is found too,
+and a new pypdf version parses again. Each PDF is stored as one compact file: a table of page offsets followed by
+the zlib-compressed text of each page. It is memory-mapped, and a page is only decompressed when it is read. The
+cache is bounded in size; the least recently used files are deleted first. Its size is kept up to date as files
+are added, so the folder is only walked when it is over the limit (or now and then, for other processes' files).
+"""
+import mmap
+import os
+import struct
+import threading
+import zlib
+from pypdf import __version__ as PYPDF_VERSION
+from utils import config
+
+# Bumped when the extraction itself changes (e.g. other pypdf options), so the cached texts are parsed again
+EXTRACTION_VERSION = 1
+PARSER_VERSION = f"pypdf-{PYPDF_VERSION}-{EXTRACTION_VERSION}"
+# File layout: magic, format version, page count, then page count + 1 offsets (from the end of the offset table)
+_MAGIC = b"PGTX"
+_FORMAT_VERSION = 1
+_HEADER = struct.Struct("<4sHI")
+_SUFFIX = ".pages"
+COMPRESSION_LEVEL = 6
+# A prune brings the cache down to this share of its limit, so the next files do not trigger another one at once
+PRUNE_TARGET = 0.9
+# The folder is counted again after this many puts, for the files written by other processes sharing it
+RECOUNT_PUTS = 1000
+
+
+class CachedPages:
+    """
+    Read-only sequence of the page texts of a cached PDF, decompressed one page at a time
+    """
+
+    def __init__(self, path):
+        """
+        Parameters:
+        - path (str): Cache file
+
+        Raises:
+        - ValueError: If the file is not a valid cache file (e.g. truncated)
+        """
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, count = _HEADER.unpack_from(self._map, 0)
+            if magic != _MAGIC or version != _FORMAT_VERSION:
+                raise ValueError(f"Not a page text cache file: {path}")
+            self._offsets = struct.unpack_from(f"<{count + 1}Q", self._map, _HEADER.size)
+            self._data_start = _HEADER.size + 8 * (count + 1)
+            if self._data_start + self._offsets[-1] != len(self._map):
+                raise ValueError(f"Truncated page text cache file: {path}")
+        except (struct.error, ValueError) as e:
+            self._map.close()
+            raise ValueError(str(e))
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("page index out of range")
+        start = self._data_start + self._offsets[index]
+        end = self._data_start + self._offsets[index + 1]
+        return zlib.decompress(self._map[start:end]).decode("utf-8")
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_pages(path, texts):
+    """
+    Write page texts in the cache file format (atomically: readers never see a partial file)
+
+    Parameters:
+    - path (str): Cache file
+    - texts (list): Text of each page
+    """
+    blobs = [zlib.compress(text.encode("utf-8"), COMPRESSION_LEVEL) for text in texts]
+    offsets = [0]
+    for blob in blobs:
+        offsets.append(offsets[-1] + len(blob))
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, _FORMAT_VERSION, len(texts)))
+        f.write(struct.pack(f"<{len(offsets)}Q", *offsets))
+        for blob in blobs:
+            f.write(blob)
+    os.replace(temp_path, path)
+
+
+class PageTextCache:
+    """
+    Folder of cached page texts, one file per PDF content hash and parser version
+    """
+
+    def __init__(self, directory, max_bytes):
+        """
+        Parameters:
+        - directory (str): Folder of the cache files
+        - max_bytes (int): Total size above which the least recently used files are deleted
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # Bytes in the folder: counted on the first put, then updated by each put
+        self._total = None
+        self._puts = 0
+
+    def path(self, content_hash):
+        """
+        Cache file of a PDF content hash, for the current parser version
+        """
+        return os.path.join(self.directory, content_hash[:2], f"{content_hash}-{PARSER_VERSION}{_SUFFIX}")
+
+    def get(self, content_hash):
+        """
+        Open the cached pages of a PDF
+
+        Parameters:
+        - content_hash (str): SHA-256 of the PDF file
+
+        Returns:
+        - CachedPages or None: The page texts (close them after use), None if the file was never parsed
+        """
+        path = self.path(content_hash)
+        try:
+            pages = CachedPages(path)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            # A damaged file is parsed again and rewritten
+            self._remove(path)
+            return None
+        try:
+            # The modification time marks the last use, for the eviction
+            os.utime(path)
+        except OSError:
+            pass
+        return pages
+
+    def put(self, content_hash, texts):
+        """
+        Keep the page texts of a PDF
+
+        Parameters:
+        - content_hash (str): SHA-256 of the PDF file
+        - texts (list): Text of each page
+        """
+        path = self.path(content_hash)
+        write_pages(path, texts)
+        with self._lock:
+            self._puts += 1
+            if self._total is None or self._puts % RECOUNT_PUTS == 0:
+                self._total = self._scan()[1]
+            else:
+                try:
+                    # A rewritten entry is counted twice until the next count, which only prunes a little early
+                    self._total += os.path.getsize(path)
+                except OSError:
+                    pass
+            if self._total > self.max_bytes:
+                self._prune()
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _scan(self):
+        """
+        List the cache files with their last use and size
+
+        Returns:
+        - tuple: List of (mtime, size, path) and the total size in bytes
+        """
+        files = []
+        total = 0
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if not name.endswith(_SUFFIX):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        return files, total
+
+    def _prune(self):
+        # Called with the lock held, once the cache is over its limit
+        files, total = self._scan()
+        target = self.max_bytes * PRUNE_TARGET
+        for _, size, path in sorted(files):
+            if total <= target:
+                break
+            self._remove(path)
+            total -= size
+        self._total = total
+
+
+# One cache object per folder, shared by every ingestion of the process
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_page_text_cache(directory=None, max_mb=None):
+    """
+    Return the process-wide page text cache of a folder, creating it on first use
+
+    Parameters:
+    - directory (str, optional): Folder of the cache files. Defaults to PAGE_TEXT_CACHE_DIR from the config
+    - max_mb (int, optional): Size limit in megabytes. Defaults to PAGE_TEXT_CACHE_MAX_MB from the config
+
+    Returns:
+    - PageTextCache or None: The cache, or None if caching is disabled (max_mb <= 0)
+    """
+    directory = directory or config.PAGE_TEXT_CACHE_DIR
+    max_mb = config.PAGE_TEXT_CACHE_MAX_MB if max_mb is None else max_mb
+    if max_mb <= 0:
+        return None
+    with _caches_lock:
+        if directory not in _caches:
+            _caches[directory] = PageTextCache(directory, max_mb * 1024 * 1024)
+        _caches[directory].max_bytes = max_mb * 1024 * 1024
+        return _caches[directory]
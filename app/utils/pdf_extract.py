@@ -0,0 +1,298 @@
+"""
+PDF text extraction, optionally spread over a pool of worker processes.
+pypdf is CPU-bound and single-threaded, so large document drops are parsed in parallel, one file per task,
+and the pages of each file are handed back as soon as that file is done.
+Workers only import pypdf, and the pool is created once per process and reused, so its start-up
+cost is not paid again on every sync. Texts already extracted are read back from the page text cache
+(page_text_cache.py) instead of being parsed again, one page at a time as chunking reads them.
+"""
+import os
+import time
+import zlib
+import threading
+import multiprocessing
+from collections import deque
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from pypdf import PdfReader
+from utils import metrics
+from utils.document_registry import file_content_hash
+from utils.page_text_cache import get_page_text_cache
+
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def parse_pdf(pdf_path):
+    """
+    Extract the text of every page of a PDF file (runs in the worker processes)
+
+    Parameters:
+    - pdf_path (str): Path of the PDF file
+
+    Returns:
+    - list: Text of each page
+    """
+    return [page.extract_text() for page in PdfReader(pdf_path).pages]
+
+
+def parse_pdf_timed(pdf_path):
+    """
+    parse_pdf that also returns how long the parsing took, so workers can report it to the parent
+    """
+    started = time.perf_counter()
+    texts = parse_pdf(pdf_path)
+    return texts, time.perf_counter() - started
+
+
+def pages_to_documents(pdf_path, texts):
+    """
+    Wrap page texts into Documents with the same metadata as LangChain's PyPDFLoader
+    """
+    from langchain_core.documents import Document
+    return [Document(page_content=text, metadata={"source": pdf_path, "page": page}) for page, text in enumerate(texts)]
+
+
+class PageDocuments(Sequence):
+    """
+    Pages of a PDF file as Documents (same metadata as pages_to_documents), each built when it is read, so texts
+    read lazily from the page text cache are only held while they are used
+    """
+
+    def __init__(self, pdf_path, texts):
+        """
+        Parameters:
+        - pdf_path (str): Path of the PDF file (the "source" of the pages)
+        - texts (sequence): Text of each page
+        """
+        self.pdf_path = pdf_path
+        self.texts = texts
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __getitem__(self, index):
+        from langchain_core.documents import Document
+        page = range(len(self))[index]
+        return Document(page_content=self.texts[page], metadata={"source": self.pdf_path, "page": page})
+
+
+class _CachedTexts(Sequence):
+    """
+    Page texts of a file in the page text cache, decompressed as they are read. If a cached page turns out to be
+    damaged, the file is parsed again here and its cache entry rewritten
+    """
+
+    def __init__(self, cached, pdf_path, cache, content_hash):
+        self._cached = cached
+        self._texts = None
+        self._pdf_path = pdf_path
+        self._cache = cache
+        self._content_hash = content_hash
+
+    def __len__(self):
+        return len(self._cached) if self._texts is None else len(self._texts)
+
+    def __getitem__(self, index):
+        if self._texts is None:
+            try:
+                return self._cached[index]
+            except (zlib.error, UnicodeDecodeError):
+                metrics.count("pdf_text_cache", result="damaged")
+                self._texts = parse_pdf(self._pdf_path)
+                try:
+                    self._cache.put(self._content_hash, self._texts)
+                except OSError as e:
+                    metrics.count("pdf_text_cache_errors", error=type(e).__name__)
+        return self._texts[index]
+
+
+def load_pdf(pdf_path):
+    """
+    Load the pages of a single PDF file
+
+    Parameters:
+    - pdf_path (str): Path of the PDF file
+
+    Returns:
+    - list: One Document per page
+    """
+    return pages_to_documents(pdf_path, parse_pdf(pdf_path))
+
+
+def get_pool(max_workers):
+    """
+    Return the process-wide pool of PDF workers, (re)creating it if the size changed or it broke
+    """
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != max_workers or getattr(_pool, "_broken", False):
+            if _pool is not None:
+                _pool.shutdown(wait=False, cancel_futures=True)
+            # "spawn" avoids forking a process that already runs gRPC/Streamlit threads
+            _pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+            _pool_workers = max_workers
+        return _pool
+
+
+def iter_pdf_pages(pdfs, docs_path, max_workers=1, hashes=None, use_cache=True):
+    """
+    Extract the pages of several PDF files, yielding each file as soon as it is parsed.
+    Files already in the page text cache are not parsed again, and files with the same content (e.g. one
+    uploaded under two names) are parsed once. A file that fails to parse is reported with its error and
+    does not stop the others
+
+    Parameters:
+    - pdfs (list): Names of the PDF files
+    - docs_path (str): Folder where the PDF files are stored
+    - max_workers (int, optional): Number of worker processes. With 1 (the default) files are parsed in this process, in order
+    - hashes (dict, optional): Content hash of each file (e.g. from the registry plan); missing ones are computed
+    - use_cache (bool, optional): Read and fill the page text cache. Defaults to True
+
+    Yields:
+    - tuple: (pdf, pages, error) where pages is a sequence of Documents (None on failure) and error the exception (None
+      on success). Pages read from the page text cache are decompressed as they are read, until the next file is asked for
+    """
+    pdfs = list(pdfs)
+    cache = get_page_text_cache() if use_cache else None
+    hashes = dict(hashes or {})
+    if cache is not None or len(pdfs) > 1:
+        for pdf in pdfs:
+            if pdf not in hashes:
+                try:
+                    hashes[pdf] = file_content_hash(os.path.join(docs_path, pdf))
+                except OSError:
+                    # Reported by the parser
+                    pass
+    # The first file of each content is parsed, its copies get the same texts right after it
+    copies = {}
+    originals = []
+    first_by_hash = {}
+    for pdf in pdfs:
+        content_hash = hashes.get(pdf)
+        if content_hash is not None and content_hash in first_by_hash:
+            copies[first_by_hash[content_hash]].append(pdf)
+            continue
+        if content_hash is not None:
+            first_by_hash[content_hash] = pdf
+        copies[pdf] = []
+        originals.append(pdf)
+    for pdf, texts, error in _iter_pdf_texts(originals, docs_path, max_workers, hashes, cache):
+        for name in [pdf] + copies[pdf]:
+            if name != pdf:
+                metrics.count("pdf_duplicates")
+            yield name, None if error is not None else PageDocuments(os.path.join(docs_path, name), texts), error
+
+
+def _iter_pdf_texts(pdfs, docs_path, max_workers, hashes, cache):
+    """
+    Page texts of each file: from the cache when it has them (read lazily, the cached file stays open until the
+    next file is asked for), else parsed (and then cached)
+
+    Yields:
+    - tuple: (pdf, texts, error)
+    """
+    to_parse = []
+    for pdf in pdfs:
+        cached = cache.get(hashes[pdf]) if cache is not None and pdf in hashes else None
+        if cached is None:
+            to_parse.append(pdf)
+            continue
+        with cached:
+            # Nothing is parsed: the pages are decompressed by chunking, and timed with it
+            metrics.count("pdf_text_cache", result="hit")
+            yield pdf, _CachedTexts(cached, os.path.join(docs_path, pdf), cache, hashes[pdf]), None
+    for pdf, texts, error in _parse_pdfs(to_parse, docs_path, max_workers):
+        if error is None and cache is not None and pdf in hashes:
+            metrics.count("pdf_text_cache", result="miss")
+            try:
+                cache.put(hashes[pdf], texts)
+            except OSError as e:
+                # A full or read-only disk only costs the cache
+                metrics.count("pdf_text_cache_errors", error=type(e).__name__)
+        yield pdf, texts, error
+
+
+def _parse_pdfs(pdfs, docs_path, max_workers):
+    """
+    Parse PDF files, in this process or in the worker pool
+
+    Yields:
+    - tuple: (pdf, texts, error)
+    """
+    if max_workers <= 1 or len(pdfs) <= 1:
+        for pdf in pdfs:
+            try:
+                with metrics.span("pdf_parse", file=pdf, mode="inline") as span:
+                    texts = parse_pdf(os.path.join(docs_path, pdf))
+                    span.set(pages=len(texts))
+                metrics.count("pdf_pages", len(texts))
+            except Exception as e:
+                yield pdf, None, e
+            else:
+                yield pdf, texts, None
+        return
+
+    executor = get_pool(max_workers)
+    # Only a few files are in flight at a time, so parsed pages never pile up in memory
+    # when the caller (embedding) is slower than the parsing
+    max_in_flight = max_workers * 2
+    remaining = iter(pdfs)
+    # Files that were in flight when a worker died: parsed again one at a time, to find the one that kills it
+    suspects = deque()
+    futures = {}
+    try:
+        while True:
+            if suspects:
+                if not futures:
+                    pdf = suspects.popleft()
+                    futures[executor.submit(parse_pdf_timed, os.path.join(docs_path, pdf))] = (pdf, time.perf_counter(), True)
+            else:
+                while len(futures) < max_in_flight:
+                    pdf = next(remaining, None)
+                    if pdf is None:
+                        break
+                    futures[executor.submit(parse_pdf_timed, os.path.join(docs_path, pdf))] = (pdf, time.perf_counter(), False)
+            if not futures:
+                return
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            broken = any(isinstance(future.exception(), BrokenProcessPool) for future in done)
+            if broken:
+                # A worker died (e.g. out of memory, or a crash in the parser): every file in flight is lost with it
+                metrics.count("pdf_worker_crashes")
+                wait(futures)
+                done = list(futures)
+            for future in done:
+                pdf, submitted, alone = futures.pop(future)
+                texts, error = _pool_result(future, pdf, submitted)
+                if isinstance(error, BrokenProcessPool) and not alone:
+                    # Only a file that kills a worker by itself is reported as failed
+                    suspects.append(pdf)
+                    continue
+                yield pdf, texts, error
+            if broken:
+                executor = get_pool(max_workers)
+    finally:
+        # If the caller stops early, do not wait for files nobody will read
+        for future in futures:
+            future.cancel()
+
+
+def _pool_result(future, pdf, submitted):
+    """
+    Page texts of a file parsed in the pool, recording its parse time
+
+    Returns:
+    - tuple: (texts, error)
+    """
+    try:
+        texts, seconds = future.result()
+    except Exception as e:
+        metrics.record("pdf_parse", time.perf_counter() - submitted, error=str(e)[:300], file=pdf, mode="pool")
+        return None, e
+    # Parse time measured in the worker, queue wait included in the wall time
+    metrics.record("pdf_parse", seconds, file=pdf, mode="pool", pages=len(texts), wall_seconds=round(time.perf_counter() - submitted, 6))
+    metrics.count("pdf_pages", len(texts))
+    return texts, None
@@ -1,27 +1,196 @@
+"""
+Upload path of the app: uploaded PDFs are saved to the docs folder of the corpus and queued for ingestion.
+
+Each upload is copied to disk one block at a time while it is hashed, under a hidden name that is renamed once
+the copy is complete: the file is never duplicated in memory, and the ingestion never sees half a file. A file
+whose content is already in the corpus (ingested, waiting in the folder, or earlier in the same batch) is not
+saved again, whatever its name. The session keeps a small record of each uploaded file, not the file itself.
+"""
 import streamlit as st
 import os
-from utils.prepare_vectordb import get_vectorstore
+import time
+import uuid
+import hashlib
+from utils import metrics
+from utils.corpora import Corpus
+from utils.document_registry import DocumentRegistry, file_content_hash
+from utils.prepare_vectordb import open_vectorstore
+
+# Bytes copied (and hashed) at a time
+UPLOAD_BLOCK_SIZE = 1024 * 1024
+# Partial uploads left behind by an interrupted copy (e.g. a restarted node) are deleted after this many seconds
+STALE_UPLOAD_SECONDS = 24 * 3600
+_PART_PREFIX = ".upload-"
+_PART_SUFFIX = ".part"
+
+
+def stream_to_disk(upload, directory, block_size=UPLOAD_BLOCK_SIZE):
+    """
+    Copy an uploaded file to a hidden file of a folder, hashing it on the way
+
+    Parameters:
+    - upload (file-like): The uploaded file (read from the start)
+    - directory (str): Folder the file is written to
+    - block_size (int, optional): Bytes copied at a time. Defaults to 1 MiB
+
+    Returns:
+    - tuple: Path of the hidden file, SHA-256 of the content (as file_content_hash) and size in bytes
+    """
+    os.makedirs(directory, exist_ok=True)
+    part_path = os.path.join(directory, f"{_PART_PREFIX}{uuid.uuid4().hex}{_PART_SUFFIX}")
+    digest = hashlib.sha256()
+    size = 0
+    upload.seek(0)
+    try:
+        with open(part_path, "wb") as f:
+            for block in iter(lambda: upload.read(block_size), b""):
+                digest.update(block)
+                f.write(block)
+                size += len(block)
+    except BaseException:
+        _remove(part_path)
+        raise
+    return part_path, digest.hexdigest(), size
+
+
+def remove_stale_uploads(directory, max_age=STALE_UPLOAD_SECONDS):
+    """
+    Delete the partial uploads of a folder older than max_age seconds
+    """
+    if not os.path.isdir(directory):
+        return
+    now = time.time()
+    for name in os.listdir(directory):
+        if name.startswith(_PART_PREFIX) and name.endswith(_PART_SUFFIX):
+            path = os.path.join(directory, name)
+            try:
+                if now - os.path.getmtime(path) > max_age:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class CorpusContents:
+    """
+    Tells whether some content is already in a corpus: ingested (looked up by hash in the document registry), in
+    its folder waiting to be ingested, or saved earlier in the same batch. The files the registry does not know
+    yet are only hashed when their size matches the upload
+    """
+
+    def __init__(self, corpus, names):
+        """
+        Parameters:
+        - corpus (Corpus): The corpus
+        - names (list): Names of the files in its docs folder
+        """
+        self.docs_path = corpus.docs_path
+        self.registry = DocumentRegistry.load(corpus.db_path)
+        ingested = self.registry.sources()
+        # Files whose content the registry does not know: not ingested yet, or saved by this batch
+        self._unregistered = [name for name in names if name not in ingested]
+        # Name -> content hash of those files, filled as they are hashed or saved
+        self._hashes = {}
+
+    def find(self, content_hash, size):
+        """
+        Name of a file of the corpus with this content, or None if there is none
+        """
+        for source in self.registry.sources_with_hash(content_hash):
+            # A file replaced by this batch is checked with its new hash below
+            if source not in self._hashes and os.path.exists(os.path.join(self.docs_path, source)):
+                return source
+        for name in self._unregistered:
+            if name not in self._hashes:
+                path = os.path.join(self.docs_path, name)
+                try:
+                    if os.path.getsize(path) != size:
+                        continue
+                    self._hashes[name] = file_content_hash(path)
+                except OSError:
+                    continue
+            if self._hashes[name] == content_hash:
+                return name
+        return None
+
+    def add(self, name, content_hash):
+        """
+        Record a file saved to the folder
+        """
+        if name not in self._unregistered:
+            self._unregistered.append(name)
+        self._hashes[name] = content_hash
+
+
+def save_upload(upload, contents):
+    """
+    Save an uploaded file to the docs folder of a corpus, unless its content is already there
+
+    Parameters:
+    - upload (UploadedFile): The uploaded file
+    - contents (CorpusContents): What the corpus already holds
+
+    Returns:
+    - record (dict): "name", "size", "hash", "file_id" (of the upload widget) and "duplicate_of" (name of the file
+      of the corpus with the same content, None if the upload was saved)
+    """
+    name = os.path.basename(upload.name)
+    part_path, content_hash, size = stream_to_disk(upload, contents.docs_path)
+    record = {"name": name, "size": size, "hash": content_hash, "file_id": getattr(upload, "file_id", name), "duplicate_of": None}
+    copy = contents.find(content_hash, size)
+    if copy is not None:
+        _remove(part_path)
+        record["duplicate_of"] = copy
+        metrics.count("upload_duplicates")
+        return record
+    # A file with the same name and other content is replaced: the ingestion sees it as changed
+    os.replace(part_path, os.path.join(contents.docs_path, name))
+    contents.add(name, content_hash)
+    metrics.count("upload_bytes", size)
+    return record
+
 
-def save_docs_to_vectordb(pdf_docs, upload_docs):
+def save_docs_to_vectordb(pdf_docs, upload_docs, corpus=None):
     """
-    Save uploaded PDF documents to the 'docs' folder and create or update the vectorstore
+    Save uploaded PDF documents to the docs folder of the corpus and queue them for ingestion in the background.
+    The page stays usable meanwhile, and the ingestion goes on if the session ends
 
     Parameters:
     - pdf_docs (list): List of uploaded PDF documents
-    - upload_docs (list): List of names of previously uploaded documents
+    - upload_docs (list): Names of the files already in the docs folder of the corpus
+    - corpus (Corpus, optional): Corpus the documents are added to. Defaults to the one of the config (CORPUS)
     """
-    # Filter is the file is a new one or not. If it is, the button to process will appear
-    new_files = [pdf for pdf in pdf_docs if pdf.name not in upload_docs]
-    new_files_names = [pdf.name for pdf in new_files]
+    corpus = corpus or Corpus()
+    # Filter is the file is a new one or not (i.e. not processed yet by this session). If it is, the button to process will appear
+    processed = {record["file_id"] for record in st.session_state.uploaded_pdfs}
+    new_files = [pdf for pdf in pdf_docs if getattr(pdf, "file_id", pdf.name) not in processed]
     if new_files and st.button("Process"):
-        # Iterate only trough the new files and save them to the docs folder
-        for pdf in new_files:
-            pdf_path = os.path.join("docs", pdf.name)
-            with open(pdf_path, "wb") as f:
-                f.write(pdf.getvalue())
-            st.session_state.uploaded_pdfs.extend(pdf_docs)
-        # Display the processing message
-        with st.spinner("Processing"):
-            # Create or update the vectorstore with the newly uploaded documents
-            get_vectorstore(new_files_names)
-            st.success(f"{pdf.name} uploaded successfully to 'docs' folder.")
\ No newline at end of file
+        remove_stale_uploads(corpus.docs_path)
+        contents = CorpusContents(corpus, upload_docs)
+        saved, duplicates = [], []
+        with metrics.span("upload", files=len(new_files)) as span:
+            # Iterate only trough the new files and save the ones whose content is new to the docs folder
+            for pdf in new_files:
+                record = save_upload(pdf, contents)
+                # Only the record is kept in the session: the file buffer is released with the upload widget
+                st.session_state.uploaded_pdfs.append(record)
+                if record["duplicate_of"] is None:
+                    saved.append(record["name"])
+                else:
+                    duplicates.append(record)
+            span.set(saved=len(saved), duplicates=len(duplicates))
+        for record in duplicates:
+            if record["duplicate_of"] == record["name"]:
+                st.info(f"{record['name']} is already in the '{corpus.name}' corpus.")
+            else:
+                st.info(f"{record['name']} has the same content as {record['duplicate_of']}, already in the '{corpus.name}' corpus: skipped.")
+        if saved:
+            # Queue the newly uploaded documents; the sidebar shows their progress
+            st.session_state.vectordb = open_vectorstore(saved, corpus)
+            st.success(f"{len(saved)} file(s) uploaded to the '{corpus.name}' corpus. Processing in the background...")
@@ -1,5 +1,5 @@
-import os
-from utils.prepare_vectordb import get_vectorstore
+from utils.corpora import Corpus
+from utils.vectorstore_handle import VectorStoreLease
 
 def initialize_session_state_variables(st):
     """
@@ -8,26 +8,60 @@ def initialize_session_state_variables(st):
     Parameters:
     - st (streamlit.delta_generator.DeltaGenerator): Streamlit's DeltaGenerator object used for rendering elements
     """
+    # The corpus searched by the session (the CORPUS of the config until another one is selected)
+    if "corpus" not in st.session_state:
+        st.session_state.corpus = Corpus()
+    corpus = st.session_state.corpus
     # Get the list of uploaded documents
-    upload_docs = os.listdir("docs")
+    upload_docs = corpus.pdfs()
     # List of session state variables to initialize
-    variables_to_initialize = ["chat_history", "uploaded_pdfs", "processed_documents", "vectordb", "previous_upload_docs_length"]
+    variables_to_initialize = ["chat_history", "history_manager", "uploaded_pdfs", "processed_documents", "vectordb", "previous_upload_docs_length"]
     # Iterate over the variables and initializes them if not present in the session state 
     for variable in variables_to_initialize:
         if variable not in st.session_state:
             if variable == "processed_documents":
-                # Set to the name of the files present in the docs folder
+                # Set to the name of the files present in the docs folder of the corpus
                 st.session_state.processed_documents = upload_docs
             elif variable == "vectordb":
-                # Is set to none if its the first time the app is initialized. If not, is set to the vector database that already exists
-                # If Vector_DB doesn't exist but we have documents, auto-process them
-                if upload_docs and not os.path.exists("Vector_DB - Documents"):
-                    # Auto-process documents on first startup
-                    st.session_state.vectordb = get_vectorstore(upload_docs, from_session_state=False)
+                # Imported here: the pipeline (and LangChain behind it) loads on the first session only
+                from utils.prepare_vectordb import open_vectorstore
+                # Every session shares the vectorstore of the process. The lease keeps it referenced for the life of the session
+                st.session_state.vectorstore_lease = VectorStoreLease(corpus.db_path)
+                # Is set to none if there are no documents yet. If there are, is set to the shared vector database right away:
+                # new or changed documents (e.g. on first startup) are queued for the background worker instead of processed here
+                if upload_docs:
+                    st.session_state.vectordb = open_vectorstore(upload_docs, corpus)
                 else:
-                    st.session_state.vectordb = get_vectorstore(upload_docs, from_session_state=True)
+                    st.session_state.vectordb = None
+            elif variable == "history_manager":
+                # Summary of the older turns of the chat, sent with the recent ones instead of the whole history
+                from utils.chat_history import ChatHistoryManager
+                st.session_state.history_manager = ChatHistoryManager()
             elif variable == "previous_upload_docs_length":
                 # Set to the quantity of documents in the docs folder during app startup
                 st.session_state.previous_upload_docs_length = len(upload_docs)
             else:
-                st.session_state[variable] = []
\ No newline at end of file
+                st.session_state[variable] = []
+
+
+def select_corpus(st, name):
+    """
+    Switch the session to another corpus: its documents, its vectorstore and a new conversation
+
+    Parameters:
+    - st (streamlit.delta_generator.DeltaGenerator): Streamlit's DeltaGenerator object used for rendering elements
+    - name (str): Name of the corpus
+
+    Raises:
+    - ValueError: If the name can't be used as a corpus name
+    """
+    corpus = Corpus(name)
+    # The reference on the previous corpus vectorstore is given back now rather than when the lease is collected
+    lease = st.session_state.get("vectorstore_lease")
+    if lease is not None:
+        lease.release()
+    for variable in ["corpus", "chat_history", "history_manager", "uploaded_pdfs", "processed_documents", "vectordb", "previous_upload_docs_length", "vectorstore_lease"]:
+        if variable in st.session_state:
+            del st.session_state[variable]
+    st.session_state.corpus = corpus
+    initialize_session_state_variables(st)
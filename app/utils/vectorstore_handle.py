@@ -0,0 +1,196 @@
+"""
+Process-wide vectorstore shared by every Streamlit session.
+
+Opening the vectorstore (embedding client, DB client, collection) and syncing it with the docs folder is done
+once per process instead of once per browser session. Sessions hold a reference on the shared handle through
+a VectorStoreLease kept in their session state; the reference is dropped when the session state goes away.
+There is one handle per vector DB folder (each corpus has its own, see corpora.py). A handle whose settings are
+no longer current (e.g. another VECTOR_DB_PATH or CORPORA_DB_PATH) is closed once unreferenced.
+LangChain, the DB client and the Google SDK are only imported when the vectorstore is first opened.
+"""
+import os
+import threading
+import weakref
+from utils import config
+
+# Handles by settings, and the lock guarding the dict and the reference counts
+_handles = {}
+_handles_lock = threading.Lock()
+
+
+def docs_state(pdfs, docs_path=None):
+    """
+    Fingerprint of the PDF files as seen on disk (name, size, modification time)
+
+    Parameters:
+    - pdfs (list): Names of the PDF files
+    - docs_path (str, optional): Folder of the PDF files. Defaults to DOCS_PATH from the config
+
+    Returns:
+    - tuple: Changes whenever a file is added, removed or rewritten
+    """
+    docs_path = docs_path or config.DOCS_PATH
+    state = []
+    for pdf in sorted(pdfs):
+        try:
+            stat = os.stat(os.path.join(docs_path, pdf))
+        except OSError:
+            continue
+        state.append((pdf, stat.st_size, stat.st_mtime_ns))
+    return (os.path.abspath(docs_path), tuple(state))
+
+
+class VectorStoreHandle:
+    """
+    One open vectorstore shared by every session of the process, with the state of its last sync
+    """
+
+    def __init__(self, key):
+        self.key = key
+        # Folder of the vector DB, from the settings key
+        self.db_path = key[1]
+        self.vectordb = None
+        self.refcount = 0
+        self.retired = False
+        # Docs folder state at the last successful sync (None: never synced in this process)
+        self.synced_state = None
+        # Serializes opening and syncing: concurrent sessions wait for the first one, then find nothing to do
+        self.lock = threading.RLock()
+
+    def open(self):
+        """
+        Return the vectorstore, opening it on first use
+
+        Returns:
+        - vectordb: The shared vectorstore
+        """
+        vectordb = self.vectordb
+        if vectordb is not None:
+            # Not waiting for the lock: sessions keep querying while a background sync holds it
+            return vectordb
+        with self.lock:
+            if self.vectordb is None:
+                from utils.ingest_pipeline import create_embedding, open_vectordb
+                self.vectordb = open_vectordb(create_embedding(), db_path=self.db_path)
+            return self.vectordb
+
+    def sync(self, pdfs, progress=None, docs_path=None, force=False):
+        """
+        Sync the vectorstore with the PDF files, unless it was already synced with the same files in this process
+
+        Parameters:
+        - pdfs (list): Names of the PDF files
+        - progress (IngestProgress, optional): Receives progress events
+        - docs_path (str, optional): Folder of the PDF files. Defaults to DOCS_PATH from the config
+        - force (bool, optional): Sync even if the files did not change. Defaults to False
+
+        Returns:
+        - plan (dict or None): The sync plan (see sync_vectorstore), or None when there was nothing to do
+        """
+        state = docs_state(pdfs, docs_path)
+        with self.lock:
+            vectordb = self.open()
+            if not force and state == self.synced_state:
+                return None
+            from utils.ingest_pipeline import sync_vectorstore
+            plan = sync_vectorstore(vectordb, pdfs, progress=progress, docs_path=docs_path, db_path=self.db_path)
+            # Files that failed are retried by the next call
+            self.synced_state = None if plan["failed"] else state
+            return plan
+
+    def close(self):
+        """
+        Drop the vectorstore (it is reopened on next use)
+        """
+        with self.lock:
+            self.vectordb = None
+            self.synced_state = None
+
+
+def _settings_key(db_path=None):
+    return (config.VECTOR_BACKEND, os.path.abspath(db_path or config.VECTOR_DB_PATH), config.EMBEDDING_MODEL)
+
+
+def _is_current(key):
+    """
+    Whether a handle key matches the current settings: same backend and model, and a folder that is
+    VECTOR_DB_PATH or the vector DB of a corpus (under CORPORA_DB_PATH)
+    """
+    backend, db_path, model = key
+    root = os.path.abspath(config.VECTOR_DB_PATH)
+    corpora_root = os.path.abspath(config.CORPORA_DB_PATH)
+    return (backend, model) == (config.VECTOR_BACKEND, config.EMBEDDING_MODEL) and (db_path == root or db_path.startswith(corpora_root + os.sep))
+
+
+def get_handle(db_path=None):
+    """
+    Return the shared handle of a vector DB for the current settings, without taking a reference
+
+    Parameters:
+    - db_path (str, optional): Vector DB folder (e.g. Corpus.db_path). Defaults to VECTOR_DB_PATH from the config
+
+    Returns:
+    - VectorStoreHandle: The handle (its vectorstore is opened on first use)
+    """
+    key = _settings_key(db_path)
+    unused = []
+    with _handles_lock:
+        handle = _handles.get(key)
+        if handle is None:
+            handle = _handles[key] = VectorStoreHandle(key)
+        handle.retired = False
+        # Handles of other settings are closed as soon as no session uses them (handles of other corpora are kept)
+        for other_key, other in list(_handles.items()):
+            if other_key != key and not _is_current(other_key):
+                other.retired = True
+                if other.refcount <= 0:
+                    unused.append(_handles.pop(other_key))
+    # Closed outside the lock: a handle that is still syncing finishes first
+    for other in unused:
+        other.close()
+    return handle
+
+
+def acquire_vectorstore(db_path=None):
+    """
+    Take a reference on the shared handle of a vector DB for the current settings
+
+    Parameters:
+    - db_path (str, optional): Vector DB folder. Defaults to VECTOR_DB_PATH from the config
+
+    Returns:
+    - VectorStoreHandle: The handle, to give back with release_vectorstore()
+    """
+    handle = get_handle(db_path)
+    with _handles_lock:
+        handle.refcount += 1
+    return handle
+
+
+def release_vectorstore(handle):
+    """
+    Give back a reference taken with acquire_vectorstore()
+    """
+    with _handles_lock:
+        handle.refcount -= 1
+        if handle.refcount > 0 or not handle.retired:
+            return
+        if _handles.get(handle.key) is handle:
+            del _handles[handle.key]
+    handle.close()
+
+
+class VectorStoreLease:
+    """
+    Holds one reference on the shared handle for as long as the lease lives (e.g. in a Streamlit session state)
+    """
+
+    def __init__(self, db_path=None):
+        self.handle = acquire_vectorstore(db_path)
+        self._finalizer = weakref.finalize(self, release_vectorstore, self.handle)
+
+    def release(self):
+        """
+        Give the reference back now instead of when the lease is garbage collected
+        """
+        self._finalizer()
@@ -0,0 +1,7 @@
+"""
+The app modules import each other as `utils.x`, with app/ as the root (like `streamlit run app/app.py` does)
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
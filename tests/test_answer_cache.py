@@ -0,0 +1,81 @@
+"""
+Tests of the semantic answer cache with hand-made question vectors and a fake clock.
+"""
+import pytest
+from utils.answer_cache import SemanticAnswerCache, corpus_version, identifiers
+from utils.document_registry import REGISTRY_FILENAME
+
+SCOPE = ("default", "fake")
+QUESTION = [1.0, 0.0, 0.0]
+# Cosine similarity 0.995 with QUESTION: above the threshold
+CLOSE = [1.0, 0.1, 0.0]
+# Cosine similarity 0.71: another question
+FAR = [1.0, 1.0, 0.0]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def cache(clock):
+    return SemanticAnswerCache(max_entries=3, ttl_seconds=60, threshold=0.95, clock=clock)
+
+
+def test_near_identical_question_gets_the_answer(cache):
+    cache.store(SCOPE, 1, "How do I prime the pump?", QUESTION, "Open the inlet valve.", [])
+    hit = cache.lookup(SCOPE, 1, "how to prime the pump", CLOSE)
+    assert hit.answer == "Open the inlet valve." and hit.hits == 1
+    assert cache.lookup(SCOPE, 1, "What is the warranty?", FAR) is None
+    assert cache.lookup(("support", "fake"), 1, "How do I prime the pump?", QUESTION) is None
+
+
+def test_other_identifiers_never_match(cache):
+    cache.store(SCOPE, 1, "What is ERR-11?", QUESTION, "A pressure fault.", [])
+    assert identifiers("What is ERR-12?") == {"err-12", "12"}
+    assert cache.lookup(SCOPE, 1, "What is ERR-12?", QUESTION) is None
+    assert cache.lookup(SCOPE, 1, "what is err-11", QUESTION).answer == "A pressure fault."
+
+
+def test_new_corpus_version_drops_answers(cache):
+    cache.store(SCOPE, 1, "How do I prime the pump?", QUESTION, "Open the inlet valve.", [])
+    assert cache.lookup(SCOPE, 2, "How do I prime the pump?", QUESTION) is None
+    assert len(cache) == 0
+    # An answer generated on the old version while the documents changed is not kept
+    cache.store(SCOPE, 1, "How do I prime the pump?", QUESTION, "Open the inlet valve.", [])
+    assert len(cache) == 0
+
+
+def test_expiry_and_size_limit(cache, clock):
+    cache.store(SCOPE, 1, "How do I prime the pump?", QUESTION, "Open the inlet valve.", [])
+    clock.now = 61
+    assert cache.lookup(SCOPE, 1, "How do I prime the pump?", QUESTION) is None
+    assert len(cache) == 0
+    for i, vector in enumerate(([0, 1, 0], [0, 0, 1], [1, 0, 0], [0, 1, 1])):
+        cache.store(SCOPE, 1, f"question {chr(97 + i)}", vector, f"answer {i}", [])
+    # Least recently used first: the first of the four is gone
+    assert len(cache) == 3
+    assert cache.lookup(SCOPE, 1, "question a", [0, 1, 0]) is None
+    assert cache.lookup(SCOPE, 1, "question d", [0, 1, 1]).answer == "answer 3"
+
+
+def test_empty_answers_are_not_stored(cache):
+    cache.store(SCOPE, 1, "How do I prime the pump?", QUESTION, "", [])
+    assert len(cache) == 0
+
+
+def test_corpus_version_follows_the_registry(tmp_path):
+    assert corpus_version(str(tmp_path)) is None
+    (tmp_path / REGISTRY_FILENAME).write_bytes(b"v1")
+    first = corpus_version(str(tmp_path))
+    (tmp_path / REGISTRY_FILENAME).write_bytes(b"v2 longer")
+    assert first is not None and corpus_version(str(tmp_path)) != first
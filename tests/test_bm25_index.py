@@ -0,0 +1,98 @@
+"""
+Tests of the BM25 index persistence: plain arrays that round-trip the index, and files that are never unpickled.
+"""
+import os
+import pickle
+import numpy as np
+import pytest
+from utils.bm25_index import BM25_FILENAME, LEGACY_BM25_FILENAME, BM25Index, get_bm25_index
+
+CHUNKS = {
+    "a-0": "Error ERR-42 means the pump lost its prime",
+    "a-1": "Open the inlet valve slowly before starting the pump",
+    "b-0": "Part no. A1.2.3 is the inlet valve seal",
+}
+
+
+class Payload:
+    """
+    Pickle that creates a file when it is loaded
+    """
+
+    def __init__(self, marker):
+        self.marker = marker
+
+    def __reduce__(self):
+        return (open, (self.marker, "w"))
+
+
+def build(path=None):
+    index = BM25Index(path, k1=1.2, b=0.6)
+    index.add_many(list(CHUNKS), list(CHUNKS.values()))
+    return index
+
+
+def test_round_trip(tmp_path):
+    index = build(str(tmp_path / BM25_FILENAME))
+    index.remove(["a-1"])
+    index.save()
+    loaded = BM25Index.load(index.path)
+    assert (loaded.k1, loaded.b, len(loaded)) == (1.2, 0.6, 2)
+    for query in ("ERR-42", "inlet valve", "a1.2.3 seal", "pump"):
+        assert loaded.search(query) == index.search(query)
+    # The removed slot is reused, and removing still finds the terms of each chunk
+    loaded.add("c-0", "Replace the seal")
+    assert loaded.id_to_doc["c-0"] == index.free_docs[0]
+    loaded.remove(["b-0"])
+    assert loaded.search("a1.2.3") == []
+    assert loaded.total_length == sum(loaded.doc_lengths)
+
+
+def test_empty_index_round_trip(tmp_path):
+    path = str(tmp_path / BM25_FILENAME)
+    BM25Index(path).save()
+    assert len(BM25Index.load(path)) == 0
+
+
+def test_pickled_index_is_never_loaded(tmp_path):
+    marker = tmp_path / "pwned"
+    path = tmp_path / BM25_FILENAME
+    path.write_bytes(pickle.dumps(Payload(str(marker))))
+    with pytest.raises(ValueError):
+        BM25Index.read(str(path))
+    # Treated as missing: the next sync rebuilds it
+    assert len(BM25Index.load(str(path))) == 0
+    assert not marker.exists()
+
+
+def test_object_arrays_are_refused(tmp_path):
+    marker = tmp_path / "pwned"
+    path = str(tmp_path / BM25_FILENAME)
+    build().save(path)
+    with np.load(path) as arrays:
+        arrays = dict(arrays)
+    arrays["posting_docs"] = np.array([Payload(str(marker))], dtype=object)
+    np.savez(path, **arrays)
+    with pytest.raises(ValueError):
+        BM25Index.read(path)
+    assert not marker.exists()
+
+
+def test_inconsistent_arrays_are_refused(tmp_path):
+    path = str(tmp_path / BM25_FILENAME)
+    build().save(path)
+    with np.load(path) as arrays:
+        arrays = dict(arrays)
+    arrays["posting_docs"] = arrays["posting_docs"] + 100
+    np.savez(path, **arrays)
+    with pytest.raises(ValueError):
+        BM25Index.read(path)
+
+
+def test_legacy_pickle_is_replaced(tmp_path):
+    (tmp_path / LEGACY_BM25_FILENAME).write_bytes(b"old")
+    index = get_bm25_index(str(tmp_path))
+    assert len(index) == 0
+    index.add_many(list(CHUNKS), list(CHUNKS.values()))
+    index.save()
+    assert sorted(os.listdir(tmp_path)) == [BM25_FILENAME]
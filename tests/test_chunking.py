@@ -0,0 +1,88 @@
+"""
+Tests of chunk deduplication: exact and near duplicates, aliases, and chunks (so chunk IDs) that are the same in
+every process whatever its hash seed.
+"""
+import os
+import sys
+import json
+import random
+import subprocess
+from langchain_core.documents import Document
+from utils.chunking import dedupe_chunks, get_aliases, simhash, normalize_text
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")
+# A chunk-sized text (a few hundred words, as in a page of a manual), the same on every run
+_SYLLABLES = ["pu", "mp", "va", "lve", "ga", "uge", "mo", "tor", "in", "let", "pre", "ssu", "re", "pa", "nel", "sta"]
+_rng = random.Random(7)
+WORDS = ["".join(_rng.choice(_SYLLABLES) for _ in range(3)) for _ in range(300)]
+
+
+def variants(count):
+    """
+    Pages that each differ from the same text by one word, or by many: some are near duplicates, some are not
+    """
+    pages = []
+    for i in range(count):
+        words = list(WORDS)
+        words[(i * 37) % len(words)] = "replaced"
+        if i % 3 == 0:
+            # A few pages differ by many words: not near duplicates of the others
+            for j in range(i, i + 60):
+                words[(j * 11) % len(words)] = "changed"
+        pages.append(" ".join(words))
+    return pages
+
+
+def doc(text, page, source="manual.pdf"):
+    return Document(page_content=text, metadata={"source": source, "page": page})
+
+
+def test_exact_duplicates_are_aliased():
+    kept = dedupe_chunks([doc("Safety notice: wear gloves.", 0), doc("SAFETY NOTICE - wear gloves", 3)], max_distance=-1)
+    assert [chunk.metadata["page"] for chunk in kept] == [0]
+    assert get_aliases(kept[0].metadata) == [{"source": "manual.pdf", "page": 3}]
+
+
+def test_near_duplicates_are_aliased():
+    text = " ".join(WORDS)
+    other = " ".join(WORDS[:100] + ["stable"] + WORDS[101:])
+    assert bin(simhash(normalize_text(text)) ^ simhash(normalize_text(other))).count("1") <= 3
+    kept = dedupe_chunks([doc(text, 0), doc(other, 1)], max_distance=3)
+    assert len(kept) == 1
+    assert get_aliases(kept[0].metadata) == [{"source": "manual.pdf", "page": 1}]
+
+
+def test_chunks_differing_by_identifiers_are_kept():
+    text = " ".join(WORDS)
+    kept = dedupe_chunks([doc(text + " error E101", 0), doc(text + " error E102", 1)], max_distance=3)
+    assert len(kept) == 2
+
+
+_DEDUPE_SCRIPT = """
+import json, sys
+from langchain_core.documents import Document
+from utils.chunking import dedupe_chunks, simhash
+from utils.document_registry import make_chunk_ids
+texts = json.loads(sys.stdin.read())
+kept = dedupe_chunks([Document(page_content=t, metadata={"source": "manual.pdf", "page": i}) for i, t in enumerate(texts)], max_distance=3)
+ids = make_chunk_ids("manual.pdf", "hash", {"chunk_tokens": 100}, len(kept))
+print(json.dumps({
+    "signature": simhash(texts[0]),
+    "chunks": [[chunk_id, chunk.page_content, chunk.metadata.get("aliases")] for chunk_id, chunk in zip(ids, kept)],
+}))
+"""
+
+
+def run_with_seed(seed, texts):
+    env = dict(os.environ, PYTHONHASHSEED=str(seed), PYTHONPATH=APP)
+    result = subprocess.run([sys.executable, "-c", _DEDUPE_SCRIPT], input=json.dumps(texts), env=env, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout)
+
+
+def test_chunk_ids_do_not_depend_on_the_hash_seed():
+    texts = variants(40)
+    first, second = run_with_seed(0, texts), run_with_seed(1, texts)
+    assert first["signature"] == second["signature"]
+    assert first["chunks"] == second["chunks"]
+    # Some pages were near duplicates and some were not, so the check covers both
+    assert 1 < len(first["chunks"]) < len(texts)
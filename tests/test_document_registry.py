@@ -0,0 +1,72 @@
+"""
+Tests of the document registry: stable chunk IDs and the sync plan (new, unchanged, touched, changed, removed files).
+"""
+import os
+import pytest
+from utils.document_registry import DocumentRegistry, file_content_hash, make_chunk_ids
+
+PARAMS = {"chunk_tokens": 100, "embedding_model": "fake-embedding"}
+
+
+@pytest.fixture
+def docs(tmp_path):
+    folder = tmp_path / "docs"
+    folder.mkdir()
+    for name in ("a.pdf", "b.pdf"):
+        (folder / name).write_bytes(b"%PDF " + name.encode())
+    return folder
+
+
+@pytest.fixture
+def registry(tmp_path):
+    return DocumentRegistry.load(str(tmp_path / "db"))
+
+
+def record(registry, docs, name, params=PARAMS):
+    path = str(docs / name)
+    stat = os.stat(path)
+    content_hash = file_content_hash(path)
+    registry.record(name, content_hash, make_chunk_ids(name, content_hash, params, 2), params, stat.st_size, stat.st_mtime, path=path)
+
+
+def test_chunk_ids_are_stable():
+    ids = make_chunk_ids("a.pdf", "hash", PARAMS, 3)
+    assert ids == make_chunk_ids("a.pdf", "hash", dict(reversed(list(PARAMS.items()))), 3)
+    assert [chunk_id.rsplit("-", 1)[1] for chunk_id in ids] == ["0", "1", "2"]
+    assert make_chunk_ids("a.pdf", "other hash", PARAMS, 1)[0] != ids[0]
+    assert make_chunk_ids("a.pdf", "hash", dict(PARAMS, chunk_tokens=200), 1)[0] != ids[0]
+    assert make_chunk_ids("b.pdf", "hash", PARAMS, 1)[0] != ids[0]
+
+
+def test_plan_of_new_and_unchanged_files(registry, docs):
+    plan = registry.plan(["a.pdf", "b.pdf"], str(docs), PARAMS)
+    assert (plan["new"], plan["unchanged"]) == (["a.pdf", "b.pdf"], [])
+    record(registry, docs, "a.pdf")
+    plan = registry.plan(["a.pdf", "b.pdf"], str(docs), PARAMS)
+    assert (plan["new"], plan["unchanged"], plan["touched"]) == (["b.pdf"], ["a.pdf"], [])
+    assert plan["hashes"]["a.pdf"] == registry.get("a.pdf")["hash"]
+
+
+def test_plan_of_touched_and_changed_files(registry, docs):
+    record(registry, docs, "a.pdf")
+    record(registry, docs, "b.pdf")
+    # Same content, new modification time: hashed again, unchanged
+    os.utime(docs / "a.pdf", (1, 1))
+    (docs / "b.pdf").write_bytes(b"%PDF new content")
+    plan = registry.plan(["a.pdf", "b.pdf"], str(docs), PARAMS)
+    assert (plan["unchanged"], plan["touched"], plan["changed"]) == (["a.pdf"], ["a.pdf"], ["b.pdf"])
+    # Other ingest parameters: every file is ingested again
+    plan = registry.plan(["a.pdf", "b.pdf"], str(docs), dict(PARAMS, chunk_tokens=200))
+    assert plan["changed"] == ["a.pdf", "b.pdf"]
+
+
+def test_plan_of_removed_files(registry, docs):
+    record(registry, docs, "a.pdf")
+    record(registry, docs, "b.pdf")
+    # Only new uploads listed: files that are still on disk are not removed
+    assert registry.plan([], str(docs), PARAMS)["removed"] == []
+    os.remove(docs / "b.pdf")
+    assert registry.plan(["a.pdf"], str(docs), PARAMS)["removed"] == ["b.pdf"]
+    entry = registry.remove("b.pdf")
+    assert len(entry["chunk_ids"]) == 2 and registry.get("b.pdf") is None
+    assert set(registry.all_chunk_ids()) == set(registry.get("a.pdf")["chunk_ids"])
@@ -0,0 +1,257 @@
+"""
+Tests of the embedding scheduler against a local fake embedding endpoint, with a fake clock: no API call, no real wait.
+"""
+import pytest
+from utils import embedding_scheduler
+from utils.embedding_scheduler import (
+    EmbeddingError,
+    EmbeddingScheduler,
+    RateLimiter,
+    TokenBucket,
+    is_retryable,
+    is_too_large,
+)
+
+
+class FakeClock:
+    """
+    Monotonic clock that only moves when something sleeps
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeEndpoint:
+    """
+    Embedding backend returning [index of the text] for texts like "t12", failing with the queued errors first
+    """
+
+    def __init__(self, errors=(), max_batch=None, short_answers=0):
+        self.errors = list(errors)
+        self.max_batch = max_batch
+        self.short_answers = short_answers
+        self.calls = []
+
+    def __call__(self, texts, task_type):
+        self.calls.append(list(texts))
+        if self.errors:
+            raise self.errors.pop(0)
+        if self.max_batch is not None and len(texts) > self.max_batch:
+            raise Exception(f"400 * BatchEmbedContentsRequest.requests: at most {self.max_batch} requests can be in one batch")
+        if self.short_answers and len(texts) > 1:
+            self.short_answers -= 1
+            texts = texts[:-1]
+        return [[float(text[1:])] for text in texts]
+
+
+class StatusError(Exception):
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def texts(count):
+    return [f"t{i}" for i in range(count)]
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture(autouse=True)
+def full_backoff(monkeypatch):
+    # The jitter always picks the longest delay, so waits can be checked exactly
+    monkeypatch.setattr(embedding_scheduler.random, "uniform", lambda low, high: high)
+
+
+def scheduler(endpoint, clock, **kwargs):
+    options = {"max_concurrency": 1, "max_batch_size": 8, "max_retries": 3, "base_delay": 1.0, "sleep": clock.sleep}
+    options.update(kwargs)
+    return EmbeddingScheduler(endpoint, **options)
+
+
+def test_retries_rate_limit_with_backoff_and_shrinks_batches(clock):
+    endpoint = FakeEndpoint(errors=[Exception("429 Resource has been exhausted (e.g. check quota)")] * 2)
+    embedder = scheduler(endpoint, clock)
+
+    assert embedder.embed(texts(4)) == [[0.0], [1.0], [2.0], [3.0]]
+    assert clock.sleeps == [1.0, 2.0]
+    assert embedder.stats["retries"] == 2
+    # Halved twice by the rate limits (8 -> 2), then grown once by the success
+    assert embedder.batch_size == 3
+
+
+@pytest.mark.parametrize("status_code", [500, 502, 503, 504])
+def test_retries_server_errors_without_shrinking(clock, status_code):
+    endpoint = FakeEndpoint(errors=[StatusError("server error", status_code)])
+    embedder = scheduler(endpoint, clock)
+
+    assert embedder.embed(texts(3)) == [[0.0], [1.0], [2.0]]
+    assert clock.sleeps == [1.0]
+    assert embedder.batch_size == 8
+
+
+def test_backoff_is_capped(clock):
+    endpoint = FakeEndpoint(errors=[StatusError("unavailable", 503)] * 4)
+    embedder = scheduler(endpoint, clock, max_retries=4, base_delay=1.0, max_delay=3.0)
+
+    embedder.embed(texts(1))
+    assert clock.sleeps == [1.0, 2.0, 3.0, 3.0]
+
+
+def test_gives_up_after_max_retries(clock):
+    endpoint = FakeEndpoint(errors=[StatusError("unavailable", 503)] * 10)
+    embedder = scheduler(endpoint, clock, max_retries=2)
+
+    with pytest.raises(EmbeddingError, match="after 3 attempt"):
+        embedder.embed(texts(2))
+    assert len(endpoint.calls) == 3
+
+
+def test_does_not_retry_client_errors(clock):
+    endpoint = FakeEndpoint(errors=[StatusError("API key not valid", 400)])
+    embedder = scheduler(endpoint, clock)
+
+    with pytest.raises(EmbeddingError):
+        embedder.embed(texts(2))
+    assert len(endpoint.calls) == 1
+    assert clock.sleeps == []
+
+
+def test_splits_batches_that_are_too_large(clock):
+    endpoint = FakeEndpoint(max_batch=2)
+    embedder = scheduler(endpoint, clock)
+    reported = []
+
+    vectors = embedder.embed(texts(7), on_batch=lambda start, end, batch: reported.append((start, end, batch)))
+    assert vectors == [[float(i)] for i in range(7)]
+    assert embedder.stats["splits"] > 0
+    # Each text went through exactly one accepted call
+    assert sorted(text for call in endpoint.calls if len(call) <= 2 for text in call) == sorted(texts(7))
+    # Every text is reported once, by the batch that embedded it
+    assert sorted(i for start, end, _ in reported for i in range(start, end)) == list(range(7))
+    assert all(batch == vectors[start:end] for start, end, batch in reported)
+
+
+def test_splits_batches_answered_short(clock):
+    endpoint = FakeEndpoint(short_answers=1)
+    embedder = scheduler(endpoint, clock)
+
+    assert embedder.embed(texts(4)) == [[0.0], [1.0], [2.0], [3.0]]
+    assert embedder.stats["splits"] == 1
+
+
+def test_unrelated_errors_are_not_split(clock):
+    endpoint = FakeEndpoint(errors=[StatusError("Invalid value: title must be at most 3 characters long", 400)])
+    embedder = scheduler(endpoint, clock)
+
+    with pytest.raises(EmbeddingError):
+        embedder.embed(texts(4))
+    assert len(endpoint.calls) == 1
+    assert embedder.stats["splits"] == 0
+
+
+@pytest.mark.parametrize("error, expected", [
+    (StatusError("Request Entity Too Large", 413), True),
+    (Exception("400 Request payload size exceeds the limit: 10000 bytes."), True),
+    (Exception("400 * BatchEmbedContentsRequest.requests: at most 100 requests can be in one batch"), True),
+    (Exception("400 Invalid value: title must be at most 3 characters long"), False),
+    (Exception("400 You can make at most 5 calls with this key"), False),
+    (Exception("429 Resource has been exhausted"), False),
+])
+def test_is_too_large(error, expected):
+    assert is_too_large(error) is expected
+
+
+@pytest.mark.parametrize("error, expected", [
+    (StatusError("rate limited", 429), True),
+    (StatusError("bad gateway", 502), True),
+    (Exception("503 Service Unavailable"), True),
+    (Exception("Deadline Exceeded"), True),
+    (StatusError("not found", 404), False),
+    (Exception("400 API key not valid"), False),
+])
+def test_is_retryable(error, expected):
+    assert is_retryable(error) is expected
+
+
+def test_shrink_and_grow_stay_within_bounds(clock):
+    embedder = scheduler(FakeEndpoint(), clock, max_batch_size=100, min_batch_size=5)
+
+    sizes = []
+    for _ in range(6):
+        embedder._shrink()
+        sizes.append(embedder.batch_size)
+    assert sizes == [50, 25, 12, 6, 5, 5]
+    sizes = []
+    for _ in range(20):
+        embedder._grow()
+        sizes.append(embedder.batch_size)
+    assert sizes[:4] == [6, 7, 8, 10]
+    assert sizes[-1] == 100
+    assert max(sizes) == 100
+
+
+def test_empty_vector_raises(clock):
+    embedder = scheduler(lambda batch, task_type: [[1.0]] * (len(batch) - 1) + [[]], clock)
+
+    with pytest.raises(EmbeddingError, match="Empty embedding"):
+        embedder.embed(texts(3))
+
+
+def test_missing_vector_raises(clock):
+    embedder = scheduler(lambda batch, task_type: [], clock)
+
+    with pytest.raises(EmbeddingError, match="Expected 1 embeddings, got 0"):
+        embedder.embed(texts(1))
+
+
+def test_concurrent_workers_keep_the_order(clock):
+    embedder = scheduler(FakeEndpoint(max_batch=3), clock, max_concurrency=4, max_batch_size=3)
+
+    assert embedder.embed(texts(50)) == [[float(i)] for i in range(50)]
+
+
+def test_token_bucket_waits_for_refill(clock):
+    bucket = TokenBucket(60, clock=clock, sleep=clock.sleep)
+
+    assert bucket.acquire(60) == 0.0
+    # 1 token per second: 30 tokens are back after 30 seconds
+    assert bucket.acquire(30) == pytest.approx(30.0)
+    clock.now += 10
+    assert bucket.acquire(5) == 0.0
+    assert bucket.acquire(10) == pytest.approx(5.0)
+
+
+def test_token_bucket_caps_requests_bigger_than_capacity(clock):
+    bucket = TokenBucket(60, capacity=10, clock=clock, sleep=clock.sleep)
+
+    assert bucket.acquire(50) == 0.0
+    assert bucket.acquire(50) == pytest.approx(10.0)
+
+
+def test_token_bucket_without_limit(clock):
+    bucket = TokenBucket(0, clock=clock, sleep=clock.sleep)
+
+    assert bucket.acquire(10 ** 9) == 0.0
+    assert clock.sleeps == []
+
+
+def test_rate_limiter_throttles_the_scheduler(clock):
+    limiter = RateLimiter(requests_per_minute=2, tokens_per_minute=10 ** 6, clock=clock, sleep=clock.sleep)
+    embedder = scheduler(FakeEndpoint(), clock, rate_limiter=limiter, max_batch_size=1)
+
+    embedder.embed(texts(4))
+    # 2 requests right away, then one every 30 seconds
+    assert clock.now == pytest.approx(60.0)
+    assert embedder.stats["throttled_seconds"] == pytest.approx(60.0)
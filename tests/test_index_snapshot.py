@@ -0,0 +1,90 @@
+"""
+Round trip of a corpus through a snapshot, on the NumPy store with the fake embedding model (no API call), and
+import of a snapshot whose BM25 section is a pickle, which must be rebuilt from the texts and never loaded.
+"""
+import pickle
+import pytest
+from utils import config
+from utils.bm25_index import BM25Index, get_bm25_index, save_bm25_index
+from utils.document_registry import DocumentRegistry
+from utils.index_snapshot import export_snapshot, import_snapshot
+from utils.ingest_pipeline import count_chunks, create_embedding, open_vectordb
+
+CHUNKS = {
+    "manual-0": "Error ERR-42 means the pump lost its prime",
+    "manual-1": "Open the inlet valve slowly before starting the pump",
+    "seals-0": "Part no. A1.2.3 is the inlet valve seal",
+}
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    monkeypatch.setattr(config, "VECTOR_BACKEND", "numpy")
+    monkeypatch.setattr(config, "EMBEDDING_MODEL", "fake-embedding")
+    monkeypatch.setattr(config, "EMBEDDING_CACHE_MAX_ENTRIES", 0)
+
+
+@pytest.fixture
+def source_db(tmp_path):
+    """
+    Vector DB folder with two registered documents, their vectors and their BM25 index
+    """
+    db_path = str(tmp_path / "source")
+    vectordb = open_vectordb(create_embedding(), db_path)
+    ids = list(CHUNKS)
+    vectordb.add_texts(list(CHUNKS.values()), [{"source": chunk_id.split("-")[0] + ".pdf", "page": 0} for chunk_id in ids], ids=ids)
+    registry = DocumentRegistry.load(db_path)
+    registry.record("manual.pdf", "hash-manual", ids[:2], config.ingest_params(), 10, 1.0)
+    registry.record("seals.pdf", "hash-seals", ids[2:], config.ingest_params(), 20, 2.0)
+    bm25 = get_bm25_index(db_path)
+    bm25.add_many(ids, list(CHUNKS.values()))
+    save_bm25_index(bm25)
+    return vectordb, db_path
+
+
+class Payload:
+    """
+    Pickle that creates a file when it is loaded
+    """
+
+    def __init__(self, marker):
+        self.marker = marker
+
+    def __reduce__(self):
+        return (open, (self.marker, "w"))
+
+
+def import_into(tmp_path, snapshot_path, name="target"):
+    db_path = str(tmp_path / name)
+    vectordb = open_vectordb(create_embedding(), db_path)
+    summary = import_snapshot(snapshot_path, vectordb, db_path=db_path, docs_path=str(tmp_path / "docs"))
+    return vectordb, db_path, summary
+
+
+def test_round_trip(tmp_path, source_db):
+    vectordb, db_path = source_db
+    snapshot_path = str(tmp_path / "corpus.snapshot")
+    export_snapshot(vectordb, snapshot_path, db_path=db_path)
+    target, target_path, summary = import_into(tmp_path, snapshot_path)
+    assert (summary["documents"], summary["chunks"], summary["bm25_rebuilt"], summary["params_match"]) == (2, 3, False, True)
+    assert count_chunks(target) == 3
+    assert DocumentRegistry.load(target_path).get("seals.pdf")["chunk_ids"] == ["seals-0"]
+    assert target.get(ids=["manual-1"])["documents"] == [CHUNKS["manual-1"]]
+    source_bm25, target_bm25 = get_bm25_index(db_path), get_bm25_index(target_path)
+    for query in ("ERR-42", "inlet valve", "a1.2.3"):
+        assert target_bm25.search(query) == source_bm25.search(query)
+
+
+def test_pickled_bm25_section_is_rebuilt(tmp_path, source_db, monkeypatch):
+    vectordb, db_path = source_db
+    marker = tmp_path / "pwned"
+    # A snapshot of an earlier version (or a crafted one): its BM25 section is a pickle
+    dump = BM25Index.dump
+    monkeypatch.setattr(BM25Index, "dump", lambda self, file: file.write(pickle.dumps(Payload(str(marker)))))
+    snapshot_path = str(tmp_path / "corpus.snapshot")
+    export_snapshot(vectordb, snapshot_path, db_path=db_path)
+    monkeypatch.setattr(BM25Index, "dump", dump)
+    _, target_path, summary = import_into(tmp_path, snapshot_path)
+    assert summary["bm25_rebuilt"]
+    assert not marker.exists()
+    assert get_bm25_index(target_path).search("ERR-42")[0][0] == "manual-0"
@@ -0,0 +1,121 @@
+"""
+Tests of the ingestion job queue: claims, progress and finishing across docs folders (corpora), on a temporary
+SQLite file. The worker syncs through a fake handle: no vectorstore, no embedding call.
+"""
+import pytest
+from utils import vectorstore_handle
+from utils.ingest_jobs import DONE, FAILED, QUEUED, RUNNING, IngestWorker, JobQueue
+
+WORKER = "host:1"
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / "queue.sqlite"))
+
+
+@pytest.fixture
+def folders(tmp_path):
+    """
+    Two corpora: the default one (no db_path) and "support", with two and one PDF files
+    """
+    default, support = tmp_path / "docs", tmp_path / "corpora" / "support"
+    for folder, names in ((default, ["a.pdf", "b.pdf"]), (support, ["c.pdf"])):
+        folder.mkdir(parents=True)
+        for name in names:
+            (folder / name).write_bytes(b"%PDF")
+    return str(default), str(support), str(tmp_path / "db corpora" / "support")
+
+
+def states(queue, docs_path):
+    return {entry["source"]: entry["state"] for entry in queue.status(docs_path)["files"]}
+
+
+def test_claim_groups_files_by_folder(queue, folders):
+    default, support, support_db = folders
+    queue.submit(["a.pdf", "b.pdf"], default)
+    queue.submit(["c.pdf"], support, support_db)
+    claimed = queue.claim(WORKER)
+    assert claimed == {(default, None): ["a.pdf", "b.pdf"], (support, support_db): ["c.pdf"]}
+    # Nothing left to claim for another worker
+    assert queue.claim("host:2") == {}
+
+
+def test_submit_skips_waiting_files(queue, folders):
+    default, support, support_db = folders
+    assert queue.submit(["a.pdf"], default) is not None
+    assert queue.submit(["a.pdf"], default) is None
+    # Same name in another folder is another file
+    assert queue.submit(["a.pdf"], support, support_db) is not None
+
+
+def test_finish_worker_only_finishes_its_folder(queue, folders):
+    default, support, support_db = folders
+    queue.submit(["a.pdf", "b.pdf"], default)
+    queue.submit(["c.pdf"], support, support_db)
+    queue.claim(WORKER)
+    queue.finish_worker(WORKER, FAILED, "quota", (support, support_db))
+    assert states(queue, default) == {"a.pdf": RUNNING, "b.pdf": RUNNING}
+    assert states(queue, support) == {"c.pdf": FAILED}
+    queue.finish_worker(WORKER, DONE, folder=(default, None))
+    assert states(queue, default) == {"a.pdf": DONE, "b.pdf": DONE}
+    assert states(queue, support) == {"c.pdf": FAILED}
+
+
+def test_update_ignores_finished_files(queue, folders):
+    default, _, _ = folders
+    queue.submit(["a.pdf"], default)
+    queue.claim(WORKER)
+    queue.update("a.pdf", default, state=DONE, chunks_done=3, chunks_total=3)
+    queue.update("a.pdf", default, add_chunks=5)
+    entry, = queue.status(default)["files"]
+    assert (entry["state"], entry["chunks_done"]) == (DONE, 3)
+
+
+def test_orphans_and_failed_files_are_queued_again(queue, folders):
+    default, _, _ = folders
+    queue.submit(["a.pdf", "b.pdf"], default)
+    queue.claim(WORKER)
+    queue.update("b.pdf", default, state=FAILED, error="boom")
+    # Restarted with the same worker ID: its running files are queued again
+    assert queue.requeue_orphans(WORKER) == 1
+    assert queue.retry_failed() == 1
+    assert states(queue, default) == {"a.pdf": QUEUED, "b.pdf": QUEUED}
+
+
+class FakeHandle:
+    """
+    Handle whose sync reports every file of the folder done, or fails for the given folders
+    """
+
+    def __init__(self, failing):
+        self.failing = failing
+        self.synced = []
+
+    def sync(self, pdfs, progress=None, docs_path=None, force=False):
+        self.synced.append(docs_path)
+        if docs_path in self.failing:
+            raise RuntimeError("quota exhausted")
+        for pdf in pdfs:
+            progress.file_started(pdf, 1)
+            progress.file_done(pdf, 1)
+        return {"new": pdfs, "changed": [], "failed": []}
+
+
+def test_failed_folder_does_not_finish_the_others(queue, folders, monkeypatch):
+    default, support, support_db = folders
+    handle = FakeHandle(failing={default})
+    monkeypatch.setattr(vectorstore_handle, "get_handle", lambda db_path=None: handle)
+    queue.submit(["a.pdf", "b.pdf"], default)
+    queue.submit(["c.pdf"], support, support_db)
+    worker = IngestWorker(queue)
+    worker.worker_id = WORKER
+    claimed = queue.claim(WORKER)
+    (first_docs, first_db), first_sources = next(iter(claimed.items()))
+    worker.run_files(first_docs, first_sources, first_db)
+    # The failure of the first folder leaves the files of the second one running, not failed
+    assert states(queue, default) == {"a.pdf": FAILED, "b.pdf": FAILED}
+    assert states(queue, support) == {"c.pdf": RUNNING}
+    worker.run_files(support, ["c.pdf"], support_db)
+    assert states(queue, support) == {"c.pdf": DONE}
+    assert handle.synced == [default, support]
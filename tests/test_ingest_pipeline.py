@@ -0,0 +1,101 @@
+"""
+Tests of sync_vectorstore on the NumPy store with the fake embedding model (no API call): a sync that stops
+midway resumes without writing the stored slices again, and deleted files lose their chunks.
+"""
+import os
+import pytest
+from utils import config
+from utils.bm25_index import get_bm25_index
+from utils.document_registry import DocumentRegistry
+from utils.ingest_pipeline import count_chunks, create_embedding, open_vectordb, sync_vectorstore
+
+
+def write_pdf(path, pages):
+    """
+    Write a minimal PDF with one line of Helvetica text per page
+    """
+    font = 3 + 2 * len(pages)
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>",
+               f"<< /Type /Pages /Kids [{' '.join(f'{3 + 2 * i} 0 R' for i in range(len(pages)))}] /Count {len(pages)} >>".encode()]
+    for i, text in enumerate(pages):
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {4 + 2 * i} 0 R "
+                       f"/Resources << /Font << /F1 {font} 0 R >> >> >>".encode())
+        stream = f"BT /F1 10 Tf 50 750 Td ({text}) Tj ET".encode()
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1) + b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+@pytest.fixture
+def corpus(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "VECTOR_BACKEND", "numpy")
+    monkeypatch.setattr(config, "EMBEDDING_MODEL", "fake-embedding")
+    monkeypatch.setattr(config, "EMBEDDING_CACHE_MAX_ENTRIES", 0)
+    monkeypatch.setattr(config, "PAGE_TEXT_CACHE_MAX_MB", 0)
+    monkeypatch.setattr(config, "PDF_EXTRACT_WORKERS", 1)
+    monkeypatch.setattr(config, "UPSERT_BATCH_SIZE", 2)
+    docs_path, db_path = tmp_path / "docs", str(tmp_path / "db")
+    docs_path.mkdir()
+    # Pages with distinct words: neither running headers nor near duplicates of each other
+    parts = ["inlet valve", "outlet hose", "pressure gauge", "motor fuse", "drain plug"]
+    actions = ["open slowly", "tighten by hand", "read at rest", "replace yearly", "clean after use"]
+    write_pdf(str(docs_path / "manual.pdf"), [f"The {part}: {action}" for part, action in zip(parts, actions)])
+    write_pdf(str(docs_path / "seals.pdf"), ["Seal kit SK-7 fits pump P3"])
+    return open_vectordb(create_embedding(), db_path), str(docs_path), db_path
+
+
+def test_interrupted_sync_resumes(corpus, monkeypatch):
+    vectordb, docs_path, db_path = corpus
+    add_documents = vectordb.add_documents
+    written = []
+
+    def failing_add(documents, ids=None, **kwargs):
+        if len(written) == 2:
+            raise RuntimeError("quota exhausted")
+        written.append(list(ids))
+        return add_documents(documents, ids=ids, **kwargs)
+
+    monkeypatch.setattr(vectordb, "add_documents", failing_add)
+    with pytest.raises(RuntimeError):
+        sync_vectorstore(vectordb, ["manual.pdf", "seals.pdf"], docs_path=docs_path, db_path=db_path)
+    assert count_chunks(vectordb) == 4
+    # manual.pdf was written in slices of 2, 2 and 1 and stopped at the last one: the next sync skips the stored
+    # slices and only writes that one, then seals.pdf
+    stored = list(written)
+    written.clear()
+    monkeypatch.setattr(vectordb, "add_documents", lambda documents, ids=None, **kwargs: written.append(list(ids)) or add_documents(documents, ids=ids, **kwargs))
+    plan = sync_vectorstore(vectordb, ["manual.pdf", "seals.pdf"], docs_path=docs_path, db_path=db_path)
+    assert (plan["new"], plan["failed"]) == (["manual.pdf", "seals.pdf"], {})
+    registry = DocumentRegistry.load(db_path)
+    manual_ids = registry.get("manual.pdf")["chunk_ids"]
+    assert stored == [manual_ids[:2], manual_ids[2:4]]
+    assert written == [manual_ids[4:], registry.get("seals.pdf")["chunk_ids"]]
+    assert count_chunks(vectordb) == len(registry.all_chunk_ids()) == 6
+    assert len(get_bm25_index(db_path)) == 6
+    # Nothing left to do
+    written.clear()
+    plan = sync_vectorstore(vectordb, ["manual.pdf", "seals.pdf"], docs_path=docs_path, db_path=db_path)
+    assert (plan["new"], plan["changed"], plan["unchanged"], written) == ([], [], ["manual.pdf", "seals.pdf"], [])
+
+
+def test_deleted_file_loses_its_chunks(corpus):
+    vectordb, docs_path, db_path = corpus
+    sync_vectorstore(vectordb, ["manual.pdf", "seals.pdf"], docs_path=docs_path, db_path=db_path)
+    seal_ids = DocumentRegistry.load(db_path).get("seals.pdf")["chunk_ids"]
+    assert get_bm25_index(db_path).search("SK-7")[0][0] == seal_ids[0]
+    os.remove(os.path.join(docs_path, "seals.pdf"))
+    plan = sync_vectorstore(vectordb, ["manual.pdf"], docs_path=docs_path, db_path=db_path)
+    assert plan["removed"] == ["seals.pdf"]
+    assert vectordb.get(ids=seal_ids)["ids"] == []
+    assert count_chunks(vectordb) == 5
+    assert get_bm25_index(db_path).search("SK-7") == []
+    assert DocumentRegistry.load(db_path).get("seals.pdf") is None
@@ -0,0 +1,45 @@
+"""
+Tests of the shared vectorstore handles: one per vector DB folder, kept across corpora, retired with the settings.
+Nothing is opened: get_handle() only opens the vectorstore on first use.
+"""
+import pytest
+from utils import config, vectorstore_handle
+from utils.corpora import Corpus
+from utils.vectorstore_handle import acquire_vectorstore, get_handle, release_vectorstore
+
+
+@pytest.fixture(autouse=True)
+def settings(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "VECTOR_BACKEND", "numpy")
+    monkeypatch.setattr(config, "EMBEDDING_MODEL", "fake-embedding")
+    monkeypatch.setattr(config, "DOCS_PATH", str(tmp_path / "docs"))
+    monkeypatch.setattr(config, "VECTOR_DB_PATH", str(tmp_path / "db"))
+    monkeypatch.setattr(config, "CORPORA_PATH", str(tmp_path / "corpora"))
+    monkeypatch.setattr(config, "CORPORA_DB_PATH", str(tmp_path / "db corpora"))
+    monkeypatch.setattr(vectorstore_handle, "_handles", {})
+
+
+def test_switching_corpora_reuses_handles():
+    support = get_handle(Corpus("support").db_path)
+    default = get_handle(Corpus("default").db_path)
+    assert get_handle(Corpus("support").db_path) is support
+    assert get_handle() is default
+    assert not support.retired and not default.retired
+
+
+def test_handles_of_old_settings_are_retired(monkeypatch):
+    old = get_handle(Corpus("support").db_path)
+    monkeypatch.setattr(config, "EMBEDDING_MODEL", "fake-other")
+    new = get_handle(Corpus("support").db_path)
+    assert new is not old
+    assert old.retired and old.key not in vectorstore_handle._handles
+
+
+def test_retired_handle_is_dropped_when_released(monkeypatch):
+    handle = acquire_vectorstore()
+    monkeypatch.setattr(config, "VECTOR_DB_PATH", handle.db_path + " moved")
+    get_handle()
+    # Still referenced: kept until the last session lets it go
+    assert handle.retired and handle.key in vectorstore_handle._handles
+    release_vectorstore(handle)
+    assert handle.key not in vectorstore_handle._handles